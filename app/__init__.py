@@ -1,10 +1,16 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from .replicas import RoutingSession
 
-def create_app(config_name='development'):
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def create_app(config_name='development', config=None):
+    from .database import DEFAULT_SQLITE_PRAGMAS, init_database
+    from .startup import init_templates, url_rule_class
     app = Flask(__name__)
+    app.url_rule_class = url_rule_class()  # URL builders are compiled once per process, not once per app
 
     if config_name == 'testing':
         app.config['TESTING'] = True
@@ -13,18 +19,133 @@ def create_app(config_name='development'):
         app.config['DEBUG_MODE'] = True  #  Enable debug in testing
     else:
         app.config['TESTING'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
         app.config['DEBUG_MODE'] = False  # Disable debug in production
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = 'a-very-secret-key-12345'
+    app.config['SQLITE_PRAGMAS'] = dict(DEFAULT_SQLITE_PRAGMAS)  # {} keeps the SQLite defaults
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 3600))  # seconds
+    app.config['DB_POOL_PRE_PING'] = True
+    app.config['JSON_BACKEND'] = 'auto'  # 'auto' (orjson when installed), 'orjson' or 'stdlib'
+    app.config['REPLICA_DATABASE_URIS'] = [uri for uri in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if uri]
+    app.config['REPLICA_STICKY_SECONDS'] = 5  # reads of a client that just wrote go to the primary for this long
+    app.config['REPLICA_STICKY_COOKIE'] = 'db_primary_until'
+    app.config['REPLICA_RETRY_INTERVAL'] = 30  # seconds before a failed replica is probed again
+    app.config['SHARD_DATABASE_URIS'] = [uri for uri in os.environ.get('SHARD_DATABASE_URLS', '').split(',') if uri]
+    app.config['SHARD_ID_BLOCK_SIZE'] = 1000  # item ids reserved at a time by each process when sharded
+    app.config['ADD_MEMO_SIZE'] = 4096  # results of /add/<a>/<b> kept for repeated pairs
+    app.config['ADD_BATCH_MAX_PAIRS'] = 10000000  # pairs accepted by one POST /add/batch
+    app.config['ADD_BATCH_CHUNK_SIZE'] = 65536  # pairs summed and streamed back at a time
+    app.config['ITEMS_PAGE_SIZE'] = 100  # default page size of GET /items
+    app.config['ITEMS_MAX_PAGE_SIZE'] = 1000  # upper bound for the 'limit' query parameter
+    app.config['ITEMS_STREAM_BATCH_SIZE'] = 1000  # rows fetched per batch when streaming
+    app.config['ITEMS_BULK_MAX_ROWS'] = 100000  # max rows accepted by one bulk request
+    app.config['ITEMS_IMPORT_BATCH_SIZE'] = 5000  # rows per INSERT of /items/import and `flask import-items`
+    app.config['ITEMS_IMPORT_COMMIT_ROWS'] = 50000  # rows per commit of an import
+    app.config['ITEM_CHANGES_KEEP'] = 1000000  # rows of the change log kept for GET /items/changes, None for all
+    app.config['ITEM_CHANGES_BATCH_SIZE'] = 1000  # changes read from the log at a time
+    app.config['ITEM_CHANGES_POLL_INTERVAL'] = 1.0  # seconds, how soon the writes of other processes are streamed
+    app.config['ITEM_CHANGES_HEARTBEAT'] = 15  # seconds between keep-alive comments of an idle stream
+    app.config['ITEM_CHANGES_BUFFER_SIZE'] = 1000  # events buffered per stream before it catches up from the log
+    app.config['ITEM_CHANGES_MAX_SUBSCRIBERS'] = 100  # open streams per process, more are answered 503
+    app.config['ITEM_SNAPSHOT_ENABLED'] = False  # item reads served from an in-process copy of the table
+    app.config['ITEM_SNAPSHOT_POLL_INTERVAL'] = 1.0  # seconds, how soon the snapshot sees the writes of other processes
+    app.config['SEARCH_RANK_WINDOW'] = 1000  # matches ranked by /items/search, see search_items()
+    app.config['WRITE_BEHIND_ENABLED'] = False  # POST /items answers 202 and a background thread writes
+    app.config['WRITE_BEHIND_MAX_QUEUE'] = 10000  # pending items before POST /items answers 503
+    app.config['WRITE_BEHIND_BATCH_SIZE'] = 500  # items per group commit
+    app.config['WRITE_BEHIND_FLUSH_INTERVAL'] = 0.05  # seconds a batch waits to fill up
+    app.config['METRICS_ENABLED'] = True  # per-route metrics at /metrics
+    app.config['METRICS_SLOW_REQUEST_THRESHOLD'] = 0.5  # seconds, slower requests are logged with their queries
+    app.config['QUERY_PROFILER_ENABLED'] = os.environ.get('QUERY_PROFILER', '1' if app.config['TESTING'] else '0') == '1'
+    app.config['QUERY_PROFILER_REPEAT_THRESHOLD'] = 5  # identical statements in one request reported as N+1
+    app.config['QUERY_PROFILER_KEEP'] = 1000  # request profiles kept in memory
+    app.config['RATELIMIT_ENABLED'] = False  # per-client token buckets, over the limit answers 429
+    app.config['RATELIMIT_DEFAULT'] = (20, 40)  # (requests per second, burst) per client and endpoint
+    app.config['RATELIMIT_ROUTES'] = {'create_items_bulk': (1, 5), 'update_items_bulk': (1, 5),
+                                      'delete_items_bulk': (1, 5), 'items_export': (1, 2),
+                                      'items_import': (1, 2), 'metrics_endpoint': None}  # None: no limit
+    app.config['RATELIMIT_API_KEY_HEADER'] = 'X-API-Key'  # clients sending it are limited by key, not by IP
+    app.config['RATELIMIT_STORE'] = 'memory'  # 'memory' (per process) or 'shared' (Redis, see RATELIMIT_REDIS_URL)
+    app.config['RATELIMIT_MAX_KEYS'] = 100000  # clients tracked by the memory store
+    app.config['MAX_CONCURRENT_REQUESTS'] = 0  # requests in progress before answering 503, 0 for no cap
+    app.config['COMPRESS_ENABLED'] = True  # gzip/br/zstd as negotiated through Accept-Encoding
+    app.config['COMPRESS_MIN_SIZE'] = 500  # bytes, smaller bodies are not worth compressing
+    app.config['COMPRESS_LEVELS'] = {'gzip': 6, 'br': 4, 'zstd': 3}
+    app.config['COMPRESS_MIMETYPES'] = ['application/json', 'application/x-ndjson', 'text/html', 'text/plain',
+                                        'text/csv']
+    app.config['CSRF_CACHE_MAX_ENTRIES'] = 10000  # verified (session, CSRF token) pairs remembered
+    app.config['CSRF_CACHE_TTL'] = 300  # seconds, never past the expiry of the token itself
+    app.config['CACHE_TYPE'] = 'lru'  # 'lru' (in-process), 'shared' (Redis, see CACHE_REDIS_URL) or 'null'
+    app.config['CACHE_MAX_ENTRIES'] = 1024
+    app.config['CACHE_TTL'] = 60  # seconds
+    app.config['CACHE_POLL_INTERVAL'] = 1.0  # seconds, how soon an 'lru' cache drops what other processes wrote
+    app.config['PREFORK_WORKERS'] = int(os.environ.get('WEB_CONCURRENCY', 0))  # `flask serve` workers, 0: one per core
+    app.config['PREFORK_MAX_REQUESTS'] = 10000  # requests before a worker is replaced, 0 for never
+    app.config['PREFORK_MAX_REQUESTS_JITTER'] = 1000  # random extra requests, so workers are not replaced together
+    app.config['PREFORK_WARM_PATHS'] = ['/', '/items']  # requested once by the master before forking
+    app.config['JINJA_BYTECODE_CACHE_DIR'] = os.path.join(app.instance_path, 'jinja_cache')  # None disables it
+    if config:
+        app.config.update(config)  # overrides of the defaults above, e.g. from tests
+
+    init_templates(app)
+    from .jsonprovider import init_json
+    init_json(app)
+
+    if app.config['REPLICA_DATABASE_URIS']:
+        from .replicas import replica_binds
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {},
+                                              **replica_binds(app.config['REPLICA_DATABASE_URIS']))
+    if app.config['SHARD_DATABASE_URIS']:
+        from .sharding import shard_binds
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {},
+                                              **shard_binds(app.config['SHARD_DATABASE_URIS']))
+    init_database(app)
+    if app.config['REPLICA_DATABASE_URIS']:
+        from .replicas import init_replicas
+        init_replicas(app)
+    if app.config['SHARD_DATABASE_URIS']:
+        from .sharding import init_sharding
+        init_sharding(app)
+
+    from .cache import init_cache
+    init_cache(app)
+
+    from .changes import init_changes
+    init_changes(app)
+
+    if app.config['ITEM_SNAPSHOT_ENABLED']:
+        from .snapshot import init_snapshot
+        init_snapshot(app)
+
+    if app.config['WRITE_BEHIND_ENABLED']:
+        from .writebehind import init_write_behind
+        init_write_behind(app)
+
+    if app.config['METRICS_ENABLED']:
+        from .metrics import init_metrics
+        init_metrics(app)
+
+    if app.config['QUERY_PROFILER_ENABLED']:
+        from .profiler import init_profiler
+        init_profiler(app)
+
+    if app.config['RATELIMIT_ENABLED'] or app.config['MAX_CONCURRENT_REQUESTS']:
+        from .ratelimit import init_rate_limits
+        init_rate_limits(app)  # after metrics, so that refused requests are counted too
 
-    db.init_app(app)
+    if app.config['COMPRESS_ENABLED']:
+        from .compression import init_compression
+        init_compression(app)  # after metrics, so that response sizes are the compressed ones
 
     from .routes import init_routes
     init_routes(app)
 
-    if config_name != 'testing':
-        with app.app_context():
-            db.create_all()
+    # The schema is created by `flask --app app init-db`, not on every start, see app/cli.py
+    from .cli import init_cli
+    init_cli(app)
 
-    return app
\ No newline at end of file
+    return app
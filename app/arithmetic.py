@@ -0,0 +1,105 @@
+import json
+from array import array
+from .jsonprovider import orjson
+from .utils import add_numbers
+
+try:
+    import numpy
+except ImportError:  # optional, the pure-Python path gives the same results
+    numpy = None
+
+BINARY_MIMETYPE = 'application/octet-stream'
+PAIR_SIZE = 16  # a binary body is little-endian signed 64-bit ints: a0 b0 a1 b1 ...
+JSON_PAIR_SIZE = 64  # bytes allowed per pair of a JSON body: two int64 in full, punctuation and spaces
+
+
+def max_json_body(max_pairs):
+    """The largest JSON batch body read for max_pairs pairs, checked before it is parsed."""
+    return max_pairs * JSON_PAIR_SIZE + 1024
+
+
+def parse_json_pairs(data):
+    """Read the operands of a JSON batch: {"a": [...], "b": [...]}, {"pairs": [[a, b], ...]} or [[a, b], ...].
+
+    Returns the (a, b) columns as lists of ints, raises ValueError for anything else."""
+    if orjson is not None:
+        try:
+            return _columns(orjson.loads(data))
+        except ValueError:  # also integers over 64 bits, which orjson reads as floats
+            pass
+    return _columns(json.loads(data))
+
+
+def _columns(body):
+    if isinstance(body, dict) and 'a' in body:
+        a, b = body['a'], body.get('b')
+        if not isinstance(a, list) or not isinstance(b, list) or len(a) != len(b):
+            raise ValueError("'a' and 'b' must be lists of the same length")
+    else:
+        pairs = body.get('pairs') if isinstance(body, dict) else body
+        if not isinstance(pairs, list) or not all(isinstance(p, list) and len(p) == 2 for p in pairs):
+            raise ValueError("Expected {\"a\": [...], \"b\": [...]} or a list of [a, b] pairs")
+        a, b = [p[0] for p in pairs], [p[1] for p in pairs]
+    if not (all(type(x) is int for x in a) and all(type(x) is int for x in b)):
+        raise ValueError("Operands must be integers")
+    return a, b
+
+
+def add_vectors(a, b):
+    """Element-wise a + b of two int sequences (lists or int64 arrays), exact for ints of any size.
+
+    With NumPy the sums are computed in int64 and the few that overflow are redone with Python ints."""
+    if numpy is not None:
+        try:
+            x, y = numpy.asarray(a, dtype=numpy.int64), numpy.asarray(b, dtype=numpy.int64)
+        except OverflowError:  # an operand over 64 bits
+            pass
+        else:
+            total = x + y
+            results = total.tolist()
+            for i in numpy.flatnonzero(((x ^ total) & (y ^ total)) < 0).tolist():
+                results[i] = add_numbers(int(x[i]), int(y[i]))
+            return results
+    return list(map(add_numbers, a, b))
+
+
+def binary_columns(chunk):
+    """Split a chunk of a binary body (a whole number of pairs) into its (a, b) columns."""
+    if numpy is not None:
+        values = numpy.frombuffer(chunk, dtype='<i8')
+    else:
+        values = array('q', chunk)
+        if array('q', [1]).tobytes()[0] != 1:  # big-endian machine
+            values.byteswap()
+    return values[0::2], values[1::2]
+
+
+def read_binary_pairs(stream, chunk_pairs):
+    """Yield the (a, b) columns of a binary body, chunk_pairs pairs at a time."""
+    size = chunk_pairs * PAIR_SIZE
+    while True:
+        chunk = stream.read(size)
+        while chunk and len(chunk) % PAIR_SIZE:  # short read, complete the last pair
+            more = stream.read(PAIR_SIZE - len(chunk) % PAIR_SIZE)
+            if not more:
+                break
+            chunk += more
+        if not chunk:
+            return
+        yield binary_columns(chunk[:len(chunk) - len(chunk) % PAIR_SIZE])
+
+
+def stream_sums(columns):
+    """Generate {"results": [...]} from an iterable of (a, b) column chunks, one chunk in memory at a time."""
+    yield '{"results":['
+    separator = ''
+    for a, b in columns:
+        if len(a):
+            yield separator + ','.join(map(str, add_vectors(a, b)))
+            separator = ','
+    yield ']}'
+
+
+def chunked(a, b, size):
+    for start in range(0, len(a), size):
+        yield a[start:start + size], b[start:start + size]
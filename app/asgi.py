@@ -0,0 +1,265 @@
+"""Async (ASGI) serving mode of the item API.
+
+The /items CRUD routes run as native coroutines on an async SQLAlchemy engine (aiosqlite for SQLite),
+so a request waiting on the database does not hold a thread. Every other path is handed to the Flask
+app through asgiref's WSGI adapter when asgiref is installed. Serve with e.g. `uvicorn asgi:app`.
+"""
+import asyncio
+import re
+from urllib.parse import parse_qsl
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import make_url
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags, quote_etag
+from .database import set_sqlite_pragmas
+from .etags import item_etag, items_etag
+from .forms import request_csrf_error, validate_item_data
+from .models import Item, ItemTableVersion, log_item_changes
+from .pagination import item_rows, parse_page_args
+from .signals import items_changed
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # SQLAlchemy < 1.4
+    create_async_engine = None
+
+_ITEM_PATH = re.compile(r'^/items/(\d+)$')
+_PAGE_ARGS = {'after', 'limit'}  # the query arguments of GET /items served here, e.g. ?stream= goes to Flask
+
+
+def async_database_uri(uri):
+    """Swap the driver of a database URI for its asyncio counterpart (sqlite -> sqlite+aiosqlite)."""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+    elif url.get_backend_name() == 'postgresql':
+        url = url.set(drivername='postgresql+asyncpg')
+    return url
+
+
+class Request:
+    """The parts of an ASGI HTTP request the item handlers need."""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.body = body
+
+    @property
+    def mimetype(self):
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    def etag_matches(self, header, etag):
+        return header in self.headers and parse_etags(self.headers[header]).contains_weak(etag)
+
+
+class AsyncItemAPI:
+    """ASGI application serving /items from an async engine, next to a Flask app."""
+
+    def __init__(self, flask_app, engine, fallback=None):
+        self.flask_app = flask_app
+        self.engine = engine
+        self.fallback = fallback
+        self.snapshot = 'item_snapshot' in flask_app.extensions  # item reads are then the Flask app's
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] == 'http':
+            handler, args = self._route(scope['method'], scope['path'], scope.get('query_string', b''))
+            if handler is not None:
+                request = Request(scope, await self._read_body(receive))
+                status, body, headers = await handler(request, *args)
+                return await self._send(send, status, body, headers)
+        if self.fallback is not None:
+            return await self.fallback(scope, receive, send)
+        return await self._send(send, 404, self._json({"error": "Not found"}), {})
+
+    def _route(self, method, path, query_string=b''):
+        """The handler of a request and its arguments, (None, ()) for the requests the Flask app serves."""
+        if path == '/items':
+            if method == 'GET' and (self.snapshot or not _PAGE_ARGS.issuperset(
+                    name for name, _ in parse_qsl(query_string.decode('latin-1'), keep_blank_values=True))):
+                return None, ()
+            return {'GET': self.get_items, 'POST': self.create_item}.get(method), ()
+        match = _ITEM_PATH.match(path)
+        if match:
+            if method == 'GET' and self.snapshot:
+                return None, ()
+            handler = {'GET': self.get_item, 'PUT': self.update_item, 'DELETE': self.delete_item}.get(method)
+            return handler, (int(match.group(1)),)
+        return None, ()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks, more = [], True
+        while more:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            more = message.get('more_body', False)
+        return b''.join(chunks)
+
+    async def _send(self, send, status, body, headers):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        raw_headers = [(b'content-length', str(len(body)).encode())]
+        if body:
+            raw_headers.append((b'content-type', b'application/json'))
+        raw_headers += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _json(self, obj):
+        return self.flask_app.json.dumps(obj)
+
+    def _error(self, status, message):
+        return status, self._json({"error": message}), {}
+
+    async def _log(self, conn, op, id):
+        await conn.run_sync(log_item_changes, op, [id], self.flask_app.config['ITEM_CHANGES_KEEP'])
+
+    def _send_items_changed(self, op, ids):
+        with self.flask_app.app_context():
+            items_changed.send(self.flask_app, op=op, ids=ids)
+
+    async def _notify(self, op, ids):
+        # The receivers block (a snapshot catch-up, Redis calls of a shared cache): not on the event loop
+        await asyncio.to_thread(self._send_items_changed, op, ids)
+
+    async def get_items(self, request):
+        try:
+            with self.flask_app.app_context():
+                after, limit = parse_page_args(request.args)
+        except ValueError:
+            return self._error(400, "Invalid input: 'after' and 'limit' must be positive integers")
+        async with self.engine.connect() as conn:
+            changes = (await conn.execute(select(ItemTableVersion.changes))).scalar() or 0
+            etag = items_etag(changes, after, limit)
+            if request.etag_matches('if-none-match', etag):
+                return 304, b'', {'ETag': quote_etag(etag)}
+            rows = (await conn.execute(item_rows(after, limit + 1))).all()
+        headers = {'ETag': quote_etag(etag)}
+        if len(rows) > limit:
+            headers['Link'] = f'</items?after={rows[limit - 1].id}&limit={limit}>; rel="next"'
+            headers['X-Next-Cursor'] = str(rows[limit - 1].id)
+        return 200, self.flask_app.json.items_json(rows[:limit]), headers
+
+    async def get_item(self, request, id):
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(select(Item.id, Item.name, Item.description, Item.version)
+                                      .where(Item.id == id))).first()
+        if row is None:
+            return self._error(404, "Item not found")
+        etag = item_etag(row.id, row.version)
+        if request.etag_matches('if-none-match', etag):
+            return 304, b'', {'ETag': quote_etag(etag)}
+        return 200, self.flask_app.json.item_json(row), {'ETag': quote_etag(etag)}
+
+    async def create_item(self, request):
+        if request.mimetype == 'application/json':
+            try:
+                data = self.flask_app.json.loads(request.body)
+            except ValueError:
+                return self._error(400, "Invalid JSON data")
+        elif request.mimetype == 'application/x-www-form-urlencoded':
+            data = dict(parse_qsl(request.body.decode('utf-8')))
+        else:
+            data = None
+        if not data or not isinstance(data, dict):
+            return self._error(400, "No form data provided")
+        with self.flask_app.app_context():
+            errors = validate_item_data(data)
+        if self.flask_app.config.get('WTF_CSRF_ENABLED', True):
+            # Same check as the Flask route: the session comes from the request's cookie
+            with self.flask_app.test_request_context(request.path, method=request.method, headers=request.headers):
+                error = request_csrf_error(data)
+            if error:
+                errors[self.flask_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')] = [error]
+        if errors:
+            return 400, self._json({"error": "Invalid form data", "errors": errors}), {}
+
+        async with self.engine.begin() as conn:
+            id = (await conn.execute(insert(Item).values(name=data['name'], description=data['description'])
+                                     .returning(Item.id))).scalar()
+            await self._log(conn, 'create', id)
+        await self._notify('create', [id])
+        body = self.flask_app.json.item_json((id, data['name'], data['description']))
+        return 201, body, {'ETag': quote_etag(item_etag(id, 1))}
+
+    async def update_item(self, request, id):
+        async with self.engine.begin() as conn:
+            row = (await conn.execute(select(Item.id, Item.name, Item.description, Item.version)
+                                      .where(Item.id == id))).first()
+            if row is None:
+                return self._error(404, "Item not found")
+            if 'if-match' in request.headers and not request.etag_matches('if-match', item_etag(id, row.version)):
+                return self._error(412, "Item has been modified, reload it and retry")
+            if request.mimetype != 'application/json':
+                return self._error(400, "Request must contain JSON data")
+            try:
+                data = self.flask_app.json.loads(request.body)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                return self._error(400, "Invalid JSON data")
+            name, description = data.get('name'), data.get('description')
+            if name is not None and not isinstance(name, str):
+                return self._error(400, "Invalid type for 'name'. Expected a string.")
+            if description is not None and not isinstance(description, str):
+                return self._error(400, "Invalid type for 'description'. Expected a string.")
+
+            name = name if name else row.name
+            description = description if description else row.description
+            result = await conn.execute(update(Item).where(Item.id == id, Item.version == row.version)
+                                        .values(name=name, description=description, version=row.version + 1))
+            if result.rowcount == 0:  # another request updated the item in between
+                return self._error(412, "Item has been modified, reload it and retry")
+            await self._log(conn, 'update', id)
+        await self._notify('update', [id])
+        body = self.flask_app.json.item_json((id, name, description))
+        return 200, body, {'ETag': quote_etag(item_etag(id, row.version + 1))}
+
+    async def delete_item(self, request, id):
+        async with self.engine.begin() as conn:
+            version = (await conn.execute(select(Item.version).where(Item.id == id))).scalar()
+            if version is None:
+                return self._error(404, "Item not found")
+            if 'if-match' in request.headers and not request.etag_matches('if-match', item_etag(id, version)):
+                return self._error(412, "Item has been modified, reload it and retry")
+            result = await conn.execute(delete(Item).where(Item.id == id, Item.version == version))
+            if result.rowcount == 0:
+                return self._error(412, "Item has been modified, reload it and retry")
+            await self._log(conn, 'delete', id)
+        await self._notify('delete', [id])
+        return 200, self._json({"message": "Item deleted"}), {}
+
+
+def create_asgi_app(flask_app):
+    """Wrap a Flask app from create_app() in the async item API.
+
+    Needs SQLAlchemy's asyncio extension and an async driver (aiosqlite for SQLite)."""
+    if create_async_engine is None:
+        raise RuntimeError("The ASGI mode needs SQLAlchemy 1.4 or newer")
+    if 'item_shards' in flask_app.extensions:
+        raise RuntimeError("The ASGI mode reads the items from the primary database, it does not support sharding")
+    uri = flask_app.config['SQLALCHEMY_DATABASE_URI']
+    engine = create_async_engine(async_database_uri(uri), **flask_app.config.get('ASGI_ENGINE_OPTIONS', {}))
+    if engine.dialect.name == 'sqlite' and flask_app.config['SQLITE_PRAGMAS']:
+        set_sqlite_pragmas(engine.sync_engine, flask_app.config['SQLITE_PRAGMAS'])
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+        fallback = WsgiToAsgi(flask_app)
+    except ImportError:  # without asgiref only the /items API is served
+        fallback = None
+    return AsyncItemAPI(flask_app, engine, fallback)
@@ -0,0 +1,98 @@
+from flask import current_app, request
+from sqlalchemy import insert, update, delete
+from .forms import validate_item_data
+from .models import Item
+from .pagination import MAX_ID
+from .sharding import ID_CHUNK_SIZE, item_shards
+from . import db
+
+
+def parse_bulk_body():
+    """Read a bulk request body: a JSON array, or NDJSON (one JSON object per line).
+
+    Raises ValueError when the body cannot be parsed or is too large."""
+    if request.mimetype == 'application/x-ndjson':
+        rows = [current_app.json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    elif request.is_json:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ValueError("Request must contain a JSON array")
+    else:
+        raise ValueError("Request must contain JSON or NDJSON data")
+    if len(rows) > current_app.config['ITEMS_BULK_MAX_ROWS']:
+        raise ValueError(f"Too many rows, the limit is {current_app.config['ITEMS_BULK_MAX_ROWS']}")
+    return rows
+
+
+def parse_ids(data):
+    """Return the list of integer ids from a bulk update/delete body, or raise ValueError."""
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(type(i) is int and 0 < i <= MAX_ID for i in ids):
+        raise ValueError(f"'ids' must be a list of integers between 1 and {MAX_ID}")
+    if len(ids) > current_app.config['ITEMS_BULK_MAX_ROWS']:
+        raise ValueError(f"Too many ids, the limit is {current_app.config['ITEMS_BULK_MAX_ROWS']}")
+    return ids
+
+
+def validate_rows(rows):
+    """Validate every row with the ItemForm rules and collect the errors per row index."""
+    errors = []
+    for index, row in enumerate(rows):
+        row_errors = validate_item_data(row) if isinstance(row, dict) else {"row": ["Expected a JSON object."]}
+        if row_errors:
+            errors.append({"index": index, "errors": row_errors})
+    return errors
+
+
+def insert_rows(rows):
+    """Insert (name, description) tuples in one executemany and return the new ids in order, the caller commits."""
+    shards = item_shards()
+    if shards is not None:
+        return shards.insert_rows(rows)  # one executemany per shard
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite':
+        return connection.execute(insert(Item).returning(Item.id, sort_by_parameter_order=True),
+                                  [{"name": name, "description": description} for name, description in rows]
+                                  ).scalars().all()
+    # SQLAlchemy runs an ordered INSERT .. RETURNING one row at a time on SQLite. The write lock is held
+    # for the whole transaction, so the new ids are the ones just below last_insert_rowid().
+    connection.exec_driver_sql("INSERT INTO item (name, description) VALUES (?, ?)", rows)
+    last = connection.exec_driver_sql("SELECT last_insert_rowid()").scalar()
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def bulk_create(rows):
+    """Insert all rows with one executemany INSERT and return the new ids, the caller commits."""
+    return insert_rows([(row['name'], row['description']) for row in rows])
+
+
+def _chunks(ids):
+    """(bind arguments, ids) pairs: the ids of every chunk are on the same shard when the items are sharded."""
+    shards = item_shards()
+    if shards is not None:
+        yield from shards.chunks(ids)
+        return
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield None, ids[start:start + ID_CHUNK_SIZE]
+
+
+def bulk_update(ids, values):
+    """Apply the same values to all ids with set-based UPDATE statements, return the updated row count.
+
+    The version of every updated row is bumped, the caller commits."""
+    count = 0
+    for bind_arguments, chunk in _chunks(ids):
+        result = db.session.execute(update(Item).where(Item.id.in_(chunk)).values(version=Item.version + 1, **values)
+                                    .execution_options(synchronize_session=False), bind_arguments=bind_arguments)
+        count += result.rowcount
+    return count
+
+
+def bulk_delete(ids):
+    """Delete all ids with set-based DELETE statements, return the deleted row count, the caller commits."""
+    count = 0
+    for bind_arguments, chunk in _chunks(ids):
+        result = db.session.execute(delete(Item).where(Item.id.in_(chunk))
+                                    .execution_options(synchronize_session=False), bind_arguments=bind_arguments)
+        count += result.rowcount
+    return count
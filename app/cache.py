@@ -0,0 +1,340 @@
+import os
+import pickle
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from .signals import items_changed
+
+
+class CacheStats:
+    """Hit, miss and eviction counters of a cache backend."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class LRUCache:
+    """In-process cache with a max number of entries (least recently used go first) and a TTL."""
+
+    def __init__(self, max_entries=1024, ttl=60, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {}  # kept apart so that LRU pressure never evicts them
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._data[key]
+                    self.stats.evictions += 1
+                self.stats.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def update(self, key, old, new):
+        """Replace the value old of key by new, keeping its expiry; a no-op once the key holds anything else."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > self.clock() and entry[1] is old:
+                self._data[key] = (entry[0], new)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedCache:
+    """Cache stored in a shared server (Redis or anything with the same get/set/delete/incr calls).
+
+    Evictions happen on the server, so only hits and misses are counted here."""
+
+    def __init__(self, client, ttl=60, prefix='flask-app:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def update(self, key, old, new):
+        raw = self.client.get(self.prefix + key)
+        if raw is not None and pickle.loads(raw) == old:
+            self.client.set(self.prefix + key, pickle.dumps(new), xx=True, keepttl=True)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def get_counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return int(self.client.incr(self.prefix + key))
+
+
+class FakeRedis:
+    """Local stand-in for a Redis client, for tests and single-machine setups."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._data = {}  # key -> (expires_at, value)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or (entry[0] is not None and entry[0] <= self.clock()):
+            self._data.pop(key, None)
+            return None
+        return entry[1]
+
+    def set(self, key, value, ex=None, xx=False, keepttl=False):
+        if xx and self.get(key) is None:
+            return None
+        expires = self._data[key][0] if keepttl and key in self._data else self.clock() + ex if ex else None
+        self._data[key] = (expires, value)
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self._data[key] = (None, str(value).encode())
+        return value
+
+
+class NullCache:
+    """Backend used when caching is disabled, every lookup is a miss."""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key):
+        self.stats.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def update(self, key, old, new):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def get_counter(self, key):
+        return 0
+
+    def incr(self, key):
+        return 0
+
+
+class ItemCache:
+    """Read-through cache of item responses in front of get_item and get_items.
+
+    Single items are cached under their id and dropped when that id is written. List pages are
+    cached under a generation number that every write bumps, so stale pages are never read.
+    An in-process backend learns of the writes of other processes from the change log, see ChangeLogFollower."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.follower = None
+
+    def generation(self):
+        """The number of item writes seen, read before a query whose result is then set() under it."""
+        return self.backend.get_counter('items:generation')
+
+    def item_key(self, id):
+        return f'item:{id}'
+
+    def list_key(self, query_string):
+        return f'items:{self.generation()}:{query_string}'
+
+    def get(self, key):
+        """Return the (body, headers, variants) entry under key, variants maps encodings to compressed bodies."""
+        if self.follower is not None:
+            self.follower.ready()
+        return self.backend.get(key)
+
+    def set(self, key, body, headers=None, generation=None):
+        """Store an entry and return it, or None when a write since generation made the body stale.
+
+        The generation is checked after the entry is stored, and drop() bumps it before deleting: a
+        write racing with set() either sees the entry and deletes it, or is seen here."""
+        entry = (body, dict(headers or {}), {})
+        self.backend.set(key, entry)
+        if generation is not None and self.generation() != generation:
+            self.backend.delete(key)
+            return None
+        return entry
+
+    def add_variant(self, key, entry, encoding, body):
+        """Store a compressed copy of the entry's body along with it.
+
+        Only while the entry is still the one under key: one invalidated (or replaced) since is not
+        brought back, and the entry keeps its expiry."""
+        self.backend.update(key, entry, (entry[0], entry[1], dict(entry[2], **{encoding: body})))
+
+    def invalidate(self, sender, op, ids):
+        self.drop(ids if op != 'create' else ())
+
+    def drop(self, ids):
+        """Drop the entries of the given item ids and every cached list page."""
+        self.backend.incr('items:generation')  # first, see set()
+        if ids:
+            self.backend.delete(*[self.item_key(id) for id in ids])
+
+    def stats(self):
+        return dict(self.backend.stats.as_dict(), backend=type(self.backend).__name__)
+
+
+def _poll(ref, interval):
+    # Holds the follower only while reading the log: the thread ends once the app is gone
+    while True:
+        time.sleep(interval)
+        follower = ref()
+        if follower is None:
+            return
+        try:
+            with follower.app.app_context():
+                follower.catch_up()
+        except Exception:  # e.g. the database is briefly unavailable, the next poll retries
+            follower.app.logger.exception("Item cache invalidation from the change log failed")
+        del follower
+
+
+class ChangeLogFollower:
+    """Drops the entries of an in-process item cache that other processes wrote, from the change log.
+
+    The writes of this process invalidate the cache right away (items_changed); the log
+    (app/changes.py) is read every poll_interval seconds for the writes of the others, which is
+    how long they may be served stale."""
+
+    def __init__(self, app, cache, poll_interval=1.0, batch_size=1000):
+        self.app = app
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.seq = None  # last change of the log applied, read before the first entry is cached
+        self._lock = threading.Lock()
+        self._thread = None
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork())
+
+    def _after_fork(self):
+        # The poll thread does not survive a fork, and a lock held by another thread would stay held
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ready(self):
+        if self.seq is None:
+            from .changes import last_seq
+            from . import db
+            with db.engine.connect() as connection:
+                self.seq = last_seq(connection)
+        if self._thread is None:
+            self._thread = threading.Thread(target=_poll, args=(weakref.ref(self), self.poll_interval),
+                                            name='item-cache-log', daemon=True)
+            self._thread.start()
+
+    def catch_up(self):
+        """Drop the entries of the items changed since the last changes applied, all of them when the log
+        was pruned past those."""
+        if self.seq is None:
+            return
+        from .changes import ChangesExpired, changes_since, last_seq
+        from . import db
+        with self._lock:
+            while True:
+                with db.engine.connect() as connection:
+                    try:
+                        changes = changes_since(connection, self.seq, self.batch_size)
+                    except ChangesExpired:
+                        self.seq = last_seq(connection)
+                        self.cache.backend.clear()
+                        self.cache.drop(())
+                        return
+                if not changes:
+                    return
+                self.cache.drop([change["id"] for change in changes if change["op"] != 'create'])
+                self.seq = changes[-1]["seq"]
+                if len(changes) < self.batch_size:
+                    return
+
+
+def create_backend(config):
+    """Build the cache backend selected by CACHE_TYPE ('lru', 'shared' or 'null')."""
+    cache_type = config.get('CACHE_TYPE', 'lru')
+    if cache_type == 'lru':
+        return LRUCache(config.get('CACHE_MAX_ENTRIES', 1024), config.get('CACHE_TTL', 60))
+    if cache_type == 'shared':
+        client = config.get('CACHE_CLIENT')
+        if client is None:
+            import redis  # optional dependency, only needed for a real shared cache
+            client = redis.Redis.from_url(config['CACHE_REDIS_URL'])
+        return SharedCache(client, config.get('CACHE_TTL', 60))
+    if cache_type == 'null':
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_TYPE: {cache_type}")
+
+
+def init_cache(app):
+    """Attach the item cache to the app and invalidate it on every item write.
+
+    An 'lru' cache also follows the change log, unless the database is in-memory SQLite (no
+    other process can write it) or CACHE_POLL_INTERVAL is None."""
+    from .database import is_memory_sqlite
+    cache = ItemCache(create_backend(app.config))
+    app.extensions['item_cache'] = cache
+    items_changed.connect(cache.invalidate, sender=app)
+    if (isinstance(cache.backend, LRUCache) and app.config['CACHE_POLL_INTERVAL'] is not None
+            and not is_memory_sqlite(app.config['SQLALCHEMY_DATABASE_URI'])):
+        cache.follower = ChangeLogFollower(app, cache, app.config['CACHE_POLL_INTERVAL'],
+                                           app.config['ITEM_CHANGES_BATCH_SIZE'])
+    return cache
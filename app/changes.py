@@ -0,0 +1,221 @@
+import os
+import threading
+import weakref
+from sqlalchemy import func, select
+from .models import Item, ItemChange
+from .sharding import item_shards
+from .signals import items_changed
+from . import db
+
+
+class ChangesExpired(LookupError):
+    """The changes after the requested sequence number were pruned from the log."""
+
+    def __init__(self, oldest):
+        super().__init__(f"Changes before sequence number {oldest} are no longer kept, resync from GET /items")
+        self.oldest = oldest
+
+
+def change_rows(since, limit):
+    """Select the logged changes after since, with the current state of the item (None once deleted)."""
+    return (select(ItemChange.seq, ItemChange.op, ItemChange.item_id, Item.name, Item.description, Item.version)
+            .outerjoin(Item, Item.id == ItemChange.item_id)
+            .where(ItemChange.seq > since).order_by(ItemChange.seq).limit(limit))
+
+
+def change_dict(row):
+    item = None if row.version is None else {"id": row.item_id, "name": row.name, "description": row.description,
+                                             "version": row.version}
+    return {"seq": row.seq, "op": row.op, "id": row.item_id, "item": item}
+
+
+def read_changes(connection, since, limit):
+    """The change dicts after since, at most limit. With sharded items, the item states come from the shards."""
+    shards = item_shards()
+    if shards is None:
+        return [change_dict(row) for row in connection.execute(change_rows(since, limit))]
+    rows = connection.execute(select(ItemChange.seq, ItemChange.op, ItemChange.item_id)
+                              .where(ItemChange.seq > since).order_by(ItemChange.seq).limit(limit)).all()
+    items = shards.items_by_id({row.item_id for row in rows})
+    return [{"seq": row.seq, "op": row.op, "id": row.item_id, "item": items.get(row.item_id)} for row in rows]
+
+
+def last_seq(connection):
+    return connection.execute(select(func.max(ItemChange.seq))).scalar() or 0
+
+
+def changes_since(connection, since, limit):
+    """Return the changes after since (at most limit), raise ChangesExpired when some were pruned."""
+    changes = read_changes(connection, since, limit)
+    if since and (not changes or changes[0]["seq"] > since + 1):
+        oldest = connection.execute(select(func.min(ItemChange.seq))).scalar()
+        if oldest is not None and oldest > since + 1 and since < last_seq(connection):
+            raise ChangesExpired(oldest)
+    return changes
+
+
+def sse_event(change, dumps):
+    return f"id: {change['seq']}\nevent: {change['op']}\ndata: {dumps(change)}\n\n"
+
+
+class Subscription:
+    """The bounded buffer of one stream: when the subscriber falls behind by more than max_events,
+    the buffer is dropped and the stream catches up from the change log instead."""
+
+    def __init__(self, max_events):
+        self.max_events = max_events
+        self.events = []  # (seq, rendered event)
+        self.overflowed = False
+        self._ready = threading.Condition()
+
+    def put(self, events):
+        with self._ready:
+            if len(self.events) + len(events) > self.max_events:
+                self.events = []
+                self.overflowed = True
+            else:
+                self.events.extend(events)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Wait up to timeout for events, return (events, overflowed)."""
+        with self._ready:
+            if not self.events and not self.overflowed:
+                self._ready.wait(timeout)
+            events, overflowed = self.events, self.overflowed
+            self.events, self.overflowed = [], False
+            return events, overflowed
+
+
+class ChangeFeed:
+    """Fans the new rows of the change log out to the SSE subscribers of this process.
+
+    One thread reads the log, woken by the writes of this process and every poll_interval
+    seconds for the writes of the others; each event is rendered once for all subscribers."""
+
+    def __init__(self, app, max_subscribers, buffer_size, poll_interval, batch_size):
+        self.app = app
+        self.max_subscribers = max_subscribers
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork())
+
+    def _after_fork(self):
+        # The feed thread does not survive a fork, and a lock held by another thread would stay held
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.subscribers = set()
+
+    def subscribe(self):
+        """Register a new subscriber, or raise OverflowError when max_subscribers are connected."""
+        with self._lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                raise OverflowError("Too many change stream subscribers")
+            subscription = Subscription(self.buffer_size)
+            self.subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscribers.discard(subscription)
+
+    def wake(self, sender=None, **kwargs):
+        self._wake.set()
+
+    def _send_changes(self, seq, dumps):
+        """Put the changes after seq in the subscribers' buffers, return the last one sent.
+
+        With seq None, only the position of the log is read: a stream starts from the changes after it."""
+        if seq is None:
+            with db.engine.connect() as connection:
+                return last_seq(connection)
+        with self._lock:
+            subscribers = list(self.subscribers)
+        if not subscribers:
+            return seq  # the streams catch up from the log by themselves
+        with db.engine.connect() as connection:
+            changes = read_changes(connection, seq, self.batch_size)
+        if not changes:
+            return seq
+        if len(changes) == self.batch_size:
+            self._wake.set()  # more to read
+        events = [(change["seq"], sse_event(change, dumps)) for change in changes]
+        for subscription in subscribers:
+            subscription.put(events)
+        return changes[-1]["seq"]
+
+    def _run(self):
+        dumps = self.app.json.dumps
+        seq = None
+        with self.app.app_context():
+            while True:
+                try:
+                    seq = self._send_changes(seq, dumps)
+                except Exception:  # e.g. the database is briefly unavailable, the next poll retries
+                    self.app.logger.exception("Change feed read failed")
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+def stream_changes(feed, since, heartbeat):
+    """Generate the SSE stream of the changes after since: first from the log, then live from the feed.
+
+    A gap in the live sequence (a full buffer, a change committed while the stream started)
+    is filled from the log, so no change is skipped or sent twice."""
+    dumps = feed.app.json.dumps
+    subscription = feed.subscribe()
+    try:
+        yield f"retry: {int(heartbeat * 1000)}\n\n"
+        catching_up = True
+        while True:
+            if catching_up:
+                with db.engine.connect() as connection:
+                    try:
+                        changes = changes_since(connection, since, feed.batch_size)
+                    except ChangesExpired as e:
+                        yield f"event: expired\ndata: {dumps({'error': str(e), 'oldest_seq': e.oldest})}\n\n"
+                        return
+                if changes:
+                    since = changes[-1]["seq"]
+                    yield ''.join(sse_event(change, dumps) for change in changes)
+                catching_up = len(changes) == feed.batch_size
+                continue
+            events, overflowed = subscription.get(heartbeat)
+            if overflowed:
+                catching_up = True
+                continue
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            chunk = []
+            for seq, event in events:
+                if seq <= since:
+                    continue
+                if seq != since + 1:
+                    catching_up = True
+                    break
+                chunk.append(event)
+                since = seq
+            if chunk:
+                yield ''.join(chunk)
+    finally:
+        feed.unsubscribe(subscription)
+
+
+def init_changes(app):
+    """Attach the change feed of /items/changes/stream, woken by every item write of this process."""
+    feed = ChangeFeed(app, app.config['ITEM_CHANGES_MAX_SUBSCRIBERS'], app.config['ITEM_CHANGES_BUFFER_SIZE'],
+                      app.config['ITEM_CHANGES_POLL_INTERVAL'], app.config['ITEM_CHANGES_BATCH_SIZE'])
+    app.extensions['item_changes'] = feed
+    items_changed.connect(feed.wake, sender=app)
+    return feed
@@ -0,0 +1,82 @@
+import os
+import sys
+import click
+
+
+def _format_of(path, fmt):
+    return fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+
+
+def init_cli(app):
+    """Register the maintenance commands, e.g. `flask --app app init-db`."""
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Create or upgrade the database schema and precompile the templates.
+
+        Run once per deployment (and after pulling model changes) instead of on every app start."""
+        from .schema import upgrade_schema
+        from .startup import precompile_templates
+        upgrade_schema()
+        click.echo(f"Schema of {app.config['SQLALCHEMY_DATABASE_URI']} is up to date.")
+        names = precompile_templates(app)
+        click.echo(f"Compiled {len(names)} template(s) into {app.config['JINJA_BYTECODE_CACHE_DIR']}.")
+
+    @app.cli.command('export-items')
+    @click.argument('path')
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), help="Default: from the file extension.")
+    def export_items_command(path, fmt):
+        """Dump the item table to PATH ('-' for stdout) as NDJSON or CSV."""
+        from sqlalchemy import func, select
+        from .models import Item
+        from .transfer import export_items
+        from . import db
+        if 'item_shards' in app.extensions:
+            raise click.ClickException("export-items is not available when the items are sharded")
+        fmt = _format_of(path, fmt)
+        total = db.session.execute(select(func.count(Item.id))).scalar()
+        with click.open_file(path, 'w', encoding='utf-8') as out, \
+                click.progressbar(length=total, label='Exporting', file=sys.stderr) as bar:
+            for chunk in export_items(fmt):
+                out.write(chunk)
+                bar.update(chunk.count('\n'))
+        click.echo(f"Exported {total} items to {path}.", err=True)
+
+    @app.cli.command('import-items')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), help="Default: from the file extension.")
+    def import_items_command(path, fmt):
+        """Load the items of an NDJSON or CSV dump at PATH ('-' for stdin), ids included when present."""
+        from .transfer import ImportRowError, import_items
+        if 'item_shards' in app.extensions:
+            raise click.ClickException("import-items is not available when the items are sharded")
+
+        def progress(imported, seconds):
+            click.echo(f"  {imported} rows in {seconds:.1f}s ({imported / max(seconds, 1e-9):.0f} rows/s)", err=True)
+
+        binary = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            with binary:
+                imported = import_items(binary, _format_of(path, fmt), progress)
+        except ImportRowError as e:
+            raise click.ClickException(f"Row {e.row}: {e} ({e.imported} rows were imported before it)")
+        size = '' if path == '-' else f" ({os.path.getsize(path) / 1e6:.1f} MB)"
+        click.echo(f"Imported {imported} items from {path}{size}.", err=True)
+
+    @app.cli.command('serve')
+    @click.option('--bind', default='127.0.0.1:8000', show_default=True, help="host:port or unix:path to listen on.")
+    @click.option('--workers', type=int, default=lambda: app.config['PREFORK_WORKERS'],
+                  help="Worker processes. Default: PREFORK_WORKERS, one per CPU core when 0.")
+    @click.option('--threads', type=int, default=1, show_default=True, help="Threads per worker.")
+    @click.option('--max-requests', type=int, default=lambda: app.config['PREFORK_MAX_REQUESTS'],
+                  help="Requests after which a worker is replaced, 0 for never. Default: PREFORK_MAX_REQUESTS.")
+    @click.option('--graceful-timeout', type=int, default=30, show_default=True,
+                  help="Seconds a stopping worker has to finish its requests.")
+    def serve_command(bind, workers, threads, max_requests, graceful_timeout):
+        """Serve the app with pre-forked worker processes, see app/prefork.py."""
+        from .prefork import default_workers, serve
+        try:
+            serve(app, bind, workers or default_workers(), threads, max_requests,
+                  app.config['PREFORK_MAX_REQUESTS_JITTER'] if max_requests else 0, graceful_timeout)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
@@ -0,0 +1,161 @@
+import gzip
+import zlib
+from flask import current_app, g, request
+
+try:
+    import brotli
+except ImportError:  # optional, enables 'br'
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, enables 'zstd'
+    zstandard = None
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, self.level, mtime=0)
+
+    def stream(self):
+        return _ZlibStream(zlib.compressobj(self.level, zlib.DEFLATED, 31))  # wbits 31: gzip container
+
+
+class _ZlibStream:
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, chunk):
+        # A sync flush after every chunk lets the client decode it as soon as it arrives
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream(self):
+        return _BrotliStream(brotli.Compressor(quality=self.level))
+
+
+class _BrotliStream:
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, chunk):
+        return self.compressor.process(chunk) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    name = 'zstd'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self):
+        return _ZstdStream(zstandard.ZstdCompressor(level=self.level).compressobj())
+
+
+class _ZstdStream:
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, chunk):
+        return self.compressor.compress(chunk) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+def available_encoders(levels):
+    """Encoders usable in this process, in the server's order of preference (best ratio per CPU first)."""
+    encoders = []
+    if zstandard is not None:
+        encoders.append(ZstdEncoder(levels['zstd']))
+    if brotli is not None:
+        encoders.append(BrotliEncoder(levels['br']))
+    encoders.append(GzipEncoder(levels['gzip']))
+    return encoders
+
+
+def choose_encoder(encoders):
+    """The encoder the client accepts with the highest quality, or None for an identity response."""
+    best = request.accept_encodings.best_match([encoder.name for encoder in encoders])
+    return next((encoder for encoder in encoders if encoder.name == best), None)
+
+
+def compress_stream(chunks, stream):
+    for chunk in chunks:
+        if chunk:
+            yield stream.compress(chunk)
+    yield stream.finish()
+
+
+def mark_encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # same item, different bytes
+
+
+def precompressed_response(response, variants):
+    """Swap in a cached compressed body matching the client's Accept-Encoding, when there is one."""
+    encoder = choose_encoder(current_app.extensions['compression_encoders'])
+    if encoder is not None and encoder.name in variants:
+        response.set_data(variants[encoder.name])
+        mark_encoded(response, encoder.name)
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_compression(app):
+    """Compress responses with gzip, brotli or zstd as negotiated through Accept-Encoding."""
+    encoders = available_encoders(app.config['COMPRESS_LEVELS'])
+    app.extensions['compression_encoders'] = encoders
+    mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+    min_size = app.config['COMPRESS_MIN_SIZE']
+
+    @app.after_request
+    def compress_response(response):
+        if (response.mimetype not in mimetypes or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers or response.direct_passthrough):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoder = choose_encoder(encoders)
+        if encoder is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.iter_encoded(), encoder.stream())
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            compressed = encoder.compress(body)
+            response.set_data(compressed)
+            cache_entry = g.pop('item_cache_entry', None)
+            if cache_entry is not None:
+                # Keep the compressed body next to the cached one, later hits skip compression
+                app.extensions['item_cache'].add_variant(*cache_entry, encoder.name, compressed)
+        mark_encoded(response, encoder.name)
+        return response
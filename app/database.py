@@ -0,0 +1,50 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from . import db
+
+# Applied to every new SQLite connection, see https://www.sqlite.org/pragma.html
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers no longer block the writer and vice versa
+    'synchronous': 'NORMAL',  # with WAL, fsync only at checkpoints
+    'busy_timeout': 5000,  # ms to wait for the write lock instead of failing with "database is locked"
+    'mmap_size': 268435456,  # 256 MB memory-mapped reads
+    'cache_size': -20000,  # 20 MB page cache per connection
+}
+
+
+def is_memory_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config):
+    """Build the SQLAlchemy engine options from the DB_POOL_* settings.
+
+    Explicit SQLALCHEMY_ENGINE_OPTIONS win over the computed ones."""
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING'], 'pool_recycle': config['DB_POOL_RECYCLE']}
+    if not is_memory_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        # An in-memory SQLite database lives in a single static connection, there is no pool to size
+        options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+                       pool_timeout=config['DB_POOL_TIMEOUT'])
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    return options
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Run the PRAGMA statements on every connection the engine opens."""
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def init_database(app):
+    """Configure the engines from the app config and bind the SQLAlchemy instance to the app."""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and app.config['SQLITE_PRAGMAS']:
+                set_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'])
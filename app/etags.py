@@ -0,0 +1,32 @@
+from flask import Response, jsonify, request
+
+
+def item_etag(id, version):
+    return f'item-{id}-v{version}'
+
+
+def items_etag(changes, after, limit):
+    return f'items-{changes}-{after}-{limit}'
+
+
+def is_not_modified(etag):
+    """True when the client's If-None-Match already names this ETag."""
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    """Bodyless 304 response carrying the ETag."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def precondition_failed(etag):
+    """True when an If-Match header is present and does not name the current ETag.
+
+    Weak tags count too: compressed responses carry the weak form of the same version tag."""
+    return bool(request.if_match) and not request.if_match.contains_weak(etag)
+
+
+def precondition_failed_response():
+    return jsonify({"error": "Item has been modified, reload it and retry"}), 412
@@ -0,0 +1,66 @@
+from json.encoder import encode_basestring_ascii
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional fast backend
+    orjson = None
+
+
+def _string(value):
+    return 'null' if value is None else encode_basestring_ascii(value)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's default provider, plus a direct path from item rows to JSON text."""
+
+    def item_json(self, row):
+        """Encode one (id, name, description, ...) row as a JSON object, without building a dict."""
+        return '{"description":%s,"id":%d,"name":%s}' % (_string(row[2]), row[0], _string(row[1]))
+
+    def items_json(self, rows):
+        return '[' + ','.join([self.item_json(row) for row in rows]) + ']'
+
+
+class OrjsonProvider(StdlibJSONProvider):
+    """JSON provider encoding with orjson.
+
+    Whatever orjson cannot encode (e.g. integers over 64 bits) goes through the stdlib provider.
+    Decoding stays on the stdlib, orjson would turn integers over 64 bits into floats."""
+
+    def _options(self):
+        return orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:  # stdlib-only options such as indent
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+        except TypeError:
+            return super().dumps(obj)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self._app.debug and self.compact is None:
+            return super().response(obj)  # keep the indented output in debug mode
+        try:
+            body = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            return super().response(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def item_json(self, row):
+        return orjson.dumps({"description": row[2], "id": row[0], "name": row[1]}).decode()
+
+    def items_json(self, rows):
+        # Short-lived dicts through orjson beat string formatting of the rows
+        return orjson.dumps([{"description": r[2], "id": r[0], "name": r[1]} for r in rows])
+
+
+def init_json(app):
+    """Select the JSON backend named by JSON_BACKEND: 'auto' (orjson when installed), 'orjson' or 'stdlib'."""
+    backend = app.config['JSON_BACKEND']
+    if backend == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_BACKEND is 'orjson' but orjson is not installed")
+    use_orjson = backend == 'orjson' or (backend == 'auto' and orjson is not None)
+    app.json = OrjsonProvider(app) if use_orjson else StdlibJSONProvider(app)
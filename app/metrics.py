@@ -0,0 +1,135 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from . import db
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # seconds
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)  # bytes
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)  # statements per request
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines, total = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    """Per-endpoint request counts, latency, response size and SQL usage of one app."""
+
+    def __init__(self):
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.latency = {}  # endpoint -> Histogram
+        self.sizes = {}
+        self.queries = {}
+        self.query_seconds = {}  # endpoint -> total seconds spent in SQL
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, method, status, elapsed, size, query_count, query_seconds):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.sizes[endpoint] = Histogram(SIZE_BUCKETS)
+                self.queries[endpoint] = Histogram(QUERY_COUNT_BUCKETS)
+                self.query_seconds[endpoint] = 0.0
+            self.latency[endpoint].observe(elapsed)
+            if size is not None:
+                self.sizes[endpoint].observe(size)
+            self.queries[endpoint].observe(query_count)
+            self.query_seconds[endpoint] += query_seconds
+
+    def render(self, cache_stats=None):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = ['# HELP http_requests_total Requests by endpoint, method and status.',
+                     '# TYPE http_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            for name, help, histograms in (
+                    ('http_request_duration_seconds', 'Request latency by endpoint.', self.latency),
+                    ('http_response_size_bytes', 'Response body size by endpoint.', self.sizes),
+                    ('db_queries_per_request', 'SQL statements run per request by endpoint.', self.queries)):
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+                for endpoint, histogram in sorted(histograms.items()):
+                    lines += histogram.render(name, f'endpoint="{endpoint}"')
+            lines += ['# HELP db_query_seconds_total Time spent in SQL statements by endpoint.',
+                      '# TYPE db_query_seconds_total counter']
+            for endpoint, seconds in sorted(self.query_seconds.items()):
+                lines.append(f'db_query_seconds_total{{endpoint="{endpoint}"}} {seconds}')
+        if cache_stats:
+            for name in ('hits', 'misses', 'evictions'):
+                lines += [f'# TYPE item_cache_{name}_total counter', f'item_cache_{name}_total {cache_stats[name]}']
+        return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries.append((statement, elapsed))
+
+
+def init_metrics(app):
+    """Instrument every request of the app and serve the results at /metrics."""
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+    threshold = app.config['METRICS_SLOW_REQUEST_THRESHOLD']
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = []
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or 'unmatched'
+        queries = g.metrics_queries
+        query_seconds = sum(seconds for statement, seconds in queries)
+        size = None if response.is_streamed else response.calculate_content_length()
+        metrics.record(endpoint, request.method, response.status_code, elapsed, size, len(queries), query_seconds)
+        if elapsed > threshold:
+            app.logger.warning("Slow request %s %s took %.3fs with %d queries (%.3fs in SQL):\n%s",
+                               request.method, request.path, elapsed, len(queries), query_seconds,
+                               '\n'.join(f"  {seconds * 1000:.2f} ms  {statement}" for statement, seconds in queries))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        cache = app.extensions.get('item_cache')
+        body = metrics.render(cache.stats() if cache else None)
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+    return metrics
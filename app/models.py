@@ -1,6 +1,82 @@
+import json
+from flask import current_app
+from sqlalchemy import DDL, event, func, insert, select, text, update
 from . import db
+from .signals import notify_items_changed
 
 class Item(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True}  # ids are never reused, so ETags stay unique
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(25), nullable=False, index=True)
+    description = db.Column(db.String(200))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # The ORM bumps version on every UPDATE and checks it in the WHERE clause (optimistic concurrency)
+    __mapper_args__ = {'version_id_col': version}
+
+
+class ItemTableVersion(db.Model):
+    """Single-row table counting the writes to the item table, the basis of the list ETags."""
+    id = db.Column(db.Integer, primary_key=True)
+    changes = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current():
+        return db.session.execute(select(ItemTableVersion.changes).where(ItemTableVersion.id == 1)).scalar() or 0
+
+
+event.listen(ItemTableVersion.__table__, 'after_create',
+             DDL("INSERT INTO item_table_version (id, changes) VALUES (1, 0)"))
+
+
+class ItemIdBlock(db.Model):
+    """Single-row table of the next free item id when the items are sharded, see app/sharding.py."""
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(25), nullable=False)
-    description = db.Column(db.String(200))
\ No newline at end of file
+    next_id = db.Column(db.Integer, nullable=False, default=1)
+
+
+event.listen(ItemIdBlock.__table__, 'after_create', DDL("INSERT INTO item_id_block (id, next_id) VALUES (1, 1)"))
+
+
+class ItemChange(db.Model):
+    """Change log of the item table: one row per written item, in commit order, see app/changes.py."""
+    __table_args__ = {'sqlite_autoincrement': True}  # sequence numbers are never reused, even after pruning
+
+    seq = db.Column(db.Integer, primary_key=True)
+    op = db.Column(db.String(6), nullable=False)  # 'create', 'update' or 'delete'
+    item_id = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def record(op, ids, keep=None):
+        """Bump the table change counter and log the written ids within the current transaction."""
+        log_item_changes(db.session.connection(), op, ids, keep)
+
+
+CHANGE_PRUNE_EVERY = 10000  # the change log is trimmed to ITEM_CHANGES_KEEP rows once per that many changes
+
+
+def log_item_changes(connection, op, ids, keep=None):
+    """Bump the table change counter and log the written ids on a connection, in its transaction.
+
+    keep bounds the rows of the log kept. app/asgi.py runs it on its async connections with run_sync()."""
+    connection.execute(update(ItemTableVersion).where(ItemTableVersion.id == 1)
+                       .values(changes=ItemTableVersion.changes + 1))
+    if not ids:
+        return
+    if connection.dialect.name == 'sqlite':  # one statement for the whole batch of an import
+        last = connection.execute(text("INSERT INTO item_change (op, item_id) SELECT :op, value "
+                                       "FROM json_each(:ids)"), {'op': op, 'ids': json.dumps(list(ids))}).lastrowid
+    else:
+        connection.execute(insert(ItemChange), [{'op': op, 'item_id': id} for id in ids])
+        last = connection.execute(select(func.max(ItemChange.seq))).scalar() if keep else None
+    if keep:
+        if last // CHANGE_PRUNE_EVERY != (last - len(ids)) // CHANGE_PRUNE_EVERY:
+            connection.execute(ItemChange.__table__.delete().where(ItemChange.seq <= last - keep))
+
+
+def commit_item_changes(op, ids):
+    """Bump the table change counter, log the changes, commit the session and notify listeners of the written ids."""
+    ItemChange.record(op, ids, current_app.config['ITEM_CHANGES_KEEP'])
+    db.session.commit()
+    notify_items_changed(op, ids)
@@ -0,0 +1,67 @@
+from flask import current_app, request, url_for
+from sqlalchemy import select
+from .models import Item
+from .sharding import item_shards
+from . import db
+
+MAX_ID = 2**63 - 1  # the largest SQLite INTEGER, and of a BIGINT elsewhere
+
+def parse_page_args(args):
+    """Read the keyset cursor ('after') and page size ('limit') from query args.
+
+    Raises ValueError for non-integer or negative values, and cursors past the largest id."""
+    after = int(args.get('after', 0))
+    limit = int(args.get('limit', current_app.config['ITEMS_PAGE_SIZE']))
+    if not 0 <= after <= MAX_ID or limit < 1:
+        raise ValueError("'after' must be between 0 and 2**63 - 1 and 'limit' must be >= 1")
+    return after, min(limit, current_app.config['ITEMS_MAX_PAGE_SIZE'])
+
+
+def item_rows(after=0, limit=None):
+    """Select item columns as plain tuples, ordered by id, starting after the cursor."""
+    query = select(Item.id, Item.name, Item.description).where(Item.id > after).order_by(Item.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def fetch_page(after, limit):
+    """Return the (id, name, description) rows of one keyset page and the cursor of the next page (or None).
+
+    With sharded items, every shard is asked for a page in parallel and the pages are merged by id."""
+    shards = item_shards()
+    if shards is not None:
+        rows = shards.gather(item_rows(after, limit + 1), limit + 1)
+    else:
+        rows = db.session.execute(item_rows(after, limit + 1)).all()  # one extra row tells if a next page exists
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def next_link(next_cursor, limit):
+    """Build the RFC 8288 'Link' header value pointing at the next page."""
+    url = url_for(request.endpoint, after=next_cursor, limit=limit)
+    return f'<{url}>; rel="next"'
+
+
+def stream_items(after, fmt):
+    """Generate the item table as a JSON array or NDJSON, fetching rows in server-side batches.
+
+    Only one batch of rows is held in memory at a time, whatever the table size."""
+    batch_size = current_app.config['ITEMS_STREAM_BATCH_SIZE']
+    item_json = current_app.json.item_json
+    shards = item_shards()
+    if shards is not None:
+        batches = shards.stream(item_rows(after), batch_size)
+    else:
+        batches = db.session.execute(item_rows(after).execution_options(yield_per=batch_size)).partitions()
+    if fmt == 'ndjson':
+        for rows in batches:
+            yield ''.join([item_json(row) + '\n' for row in rows])
+        return
+    yield '['
+    separator = ''
+    for rows in batches:
+        yield separator + ','.join([item_json(row) for row in rows])
+        separator = ','
+    yield ']'
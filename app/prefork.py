@@ -0,0 +1,97 @@
+"""Pre-fork multi-process serving: `flask --app app serve --workers 4` (needs `pip install gunicorn`).
+
+The master process creates the app, warms it (templates, first responses, caches) and closes its
+database connections, then forks the workers, which share the warm memory copy-on-write. Every
+worker starts its own connection pools and write-behind thread after the fork.
+
+Signals to the master: HUP replaces the workers one generation at a time (running requests finish),
+USR2 starts a new master from the current code on the same socket (then QUIT the old one),
+TERM stops within the graceful timeout. A worker is also replaced after max_requests requests.
+"""
+import gc
+import os
+from . import db
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # optional, like uvicorn for asgi.py
+    BaseApplication = None
+
+
+def warm_for_fork(app):
+    """Get the master ready to fork: everything the workers would build on their first requests is built here."""
+    from .cache import LRUCache
+    from .startup import precompile_templates
+    precompile_templates(app)
+    cache = app.extensions.get('item_cache')
+    if cache is not None and isinstance(cache.backend, LRUCache):
+        cache.backend.clear()  # on reload, the workers wrote since the last warm-up
+    client = app.test_client()
+    for path in app.config['PREFORK_WARM_PATHS']:
+        try:
+            client.get(path)
+        except Exception:  # e.g. a database without schema yet, the workers will report it
+            app.logger.exception("Warm-up request to %s failed", path)
+    writer = app.extensions.get('write_behind')
+    if writer is not None:
+        writer.close()  # a thread does not survive a fork, every worker starts its own
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()  # no connection may be shared by two processes
+    gc.collect()
+    gc.freeze()  # keeps the collector from writing to (and so copying) the pages of the warm objects
+
+
+def after_fork(app):
+    """Run in every new worker: fresh connection pools, and the per-process threads."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)  # forget the inherited pool without closing the master's sockets
+        cache = app.extensions.get('item_cache')
+        if cache is not None and cache.follower is not None:
+            try:
+                cache.follower.catch_up()  # what was written since the master last read the log
+            except Exception:
+                app.logger.exception("Item cache invalidation from the change log failed")
+    if app.config['WRITE_BEHIND_ENABLED']:
+        from .writebehind import init_write_behind
+        init_write_behind(app)
+
+
+def check_worker_caches(app, workers):
+    """Turn off an 'lru' item cache that several workers would not keep in sync (no change log to follow)."""
+    from .cache import LRUCache, NullCache
+    cache = app.extensions.get('item_cache')
+    if workers > 1 and cache is not None and isinstance(cache.backend, LRUCache) and cache.follower is None:
+        app.logger.warning("The item cache of a worker would not see the writes of the others "
+                           "(CACHE_POLL_INTERVAL is None): it is turned off, use CACHE_TYPE='shared' for one cache.")
+        cache.backend = NullCache()
+
+
+def default_workers():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def serve(app, bind, workers, threads=1, max_requests=0, max_requests_jitter=0, graceful_timeout=30):
+    """Warm the app, fork the workers and supervise them until the master is stopped."""
+    if BaseApplication is None:
+        raise RuntimeError("Pre-fork serving needs gunicorn: pip install gunicorn")
+
+    class PreforkServer(BaseApplication):
+        def load_config(self):
+            options = {'bind': bind, 'workers': workers, 'threads': threads, 'max_requests': max_requests,
+                       'max_requests_jitter': min(max_requests_jitter, max_requests),
+                       'graceful_timeout': graceful_timeout,
+                       'preload_app': True, 'post_fork': lambda server, worker: after_fork(app),
+                       'on_reload': lambda server: warm_for_fork(app)}
+            for name, value in options.items():
+                self.cfg.set(name, value)
+            if 'control_socket_disable' in self.cfg.settings:
+                self.cfg.set('control_socket_disable', True)  # recent gunicorn, one fixed path per user otherwise
+
+        def load(self):
+            return app
+
+    check_worker_caches(app, workers)
+    warm_for_fork(app)
+    PreforkServer().run()
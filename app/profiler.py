@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter, deque
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from . import db
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(APP_DIR)
+SKIPPED_FILES = {os.path.join(APP_DIR, name) for name in ('profiler.py', 'metrics.py', 'database.py', 'replicas.py')}
+LIBRARY_DIRS = tuple({sysconfig.get_paths()[name] for name in ('stdlib', 'platstdlib', 'purelib', 'platlib')})
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$')  # not 'SCAN x VIRTUAL TABLE ...'
+
+
+class Query:
+    __slots__ = ('statement', 'parameters', 'seconds', 'call_site')
+
+    def __init__(self, statement, parameters, seconds, call_site):
+        self.statement = statement
+        self.parameters = parameters
+        self.seconds = seconds
+        self.call_site = call_site
+
+
+class RequestProfile:
+    """The statements of one request, with the repeated ones (N+1 patterns) and the full scans among them."""
+
+    def __init__(self, endpoint, method, path, queries, repeat_threshold, plans):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.queries = queries
+        counts = Counter(query.statement for query in queries)
+        self.repeated = {statement: count for statement, count in counts.items() if count >= repeat_threshold}
+        self.scans = {query.statement: plans[query.statement] for query in queries if plans.get(query.statement)}
+
+    @property
+    def seconds(self):
+        return sum(query.seconds for query in self.queries)
+
+    def call_sites(self, statement):
+        return sorted({query.call_site for query in self.queries if query.statement == statement})
+
+    def repeat_problems(self):
+        return [f"{count}x the same statement (N+1?) from {', '.join(self.call_sites(statement))}: {statement}"
+                for statement, count in self.repeated.items()]
+
+    def scan_problems(self):
+        return [f"full scan of {', '.join(tables)} from {', '.join(self.call_sites(statement))}: {statement}"
+                for statement, tables in self.scans.items()]
+
+    def problems(self):
+        """Human-readable descriptions of the N+1 patterns and full scans, empty when there are none."""
+        return self.repeat_problems() + self.scan_problems()
+
+    def __repr__(self):
+        return f"<RequestProfile {self.method} {self.path} {len(self.queries)} queries>"
+
+
+def call_site():
+    """'file:line in function' of the innermost caller outside the libraries that issued the statement."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(LIBRARY_DIRS) and filename not in SKIPPED_FILES and not filename.startswith('<'):
+            if filename.startswith(ROOT_DIR):
+                filename = os.path.relpath(filename, ROOT_DIR)
+            return f"{filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+
+def explain_full_scans(cursor, statement, parameters):
+    """The tables that EXPLAIN QUERY PLAN reports as scanned in full (SQLite only)."""
+    explain = cursor.connection.cursor()
+    try:
+        rows = explain.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    except Exception:  # e.g. parameters the plain DBAPI cursor cannot bind
+        return []
+    finally:
+        explain.close()
+    return [match.group(1) for match in (FULL_SCAN.match(row[-1]) for row in rows) if match]
+
+
+class QueryProfiler:
+    """Records the statements of every request through engine events and keeps the last profiles."""
+
+    def __init__(self, repeat_threshold, keep):
+        self.repeat_threshold = repeat_threshold
+        self.profiles = deque(maxlen=keep)
+        self.plans = {}  # statement -> fully scanned tables, each statement is explained once
+        self._lock = threading.Lock()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profiler_start'].pop()
+        if not (has_request_context() and 'profiled_queries' in g):
+            return
+        g.profiled_queries.append(Query(statement, parameters, elapsed, call_site()))
+        if statement not in self.plans and not executemany and conn.dialect.name == 'sqlite' \
+                and statement.lstrip()[:6].upper().startswith(('SELECT', 'WITH')):
+            self.plans[statement] = explain_full_scans(cursor, statement, parameters)
+
+    def finish(self, endpoint, method, path, queries):
+        profile = RequestProfile(endpoint, method, path, queries, self.repeat_threshold, self.plans)
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def for_endpoint(self, endpoint):
+        with self._lock:
+            return [profile for profile in self.profiles if profile.endpoint == endpoint]
+
+    def clear(self):
+        with self._lock:
+            self.profiles.clear()
+
+    def budget_violations(self, budgets, allow_repeats=False):
+        """Compare the recorded requests with {endpoint: max queries per request}, return the violations.
+
+        N+1 patterns are violations too, on any endpoint, unless allow_repeats."""
+        with self._lock:
+            profiles = list(self.profiles)
+        violations = []
+        for profile in profiles:
+            budget = budgets.get(profile.endpoint)
+            if budget is not None and len(profile.queries) > budget:
+                violations.append(f"{profile.method} {profile.path} ran {len(profile.queries)} queries, "
+                                  f"the budget of {profile.endpoint} is {budget}:\n"
+                                  + '\n'.join(f"  {q.call_site}: {q.statement}" for q in profile.queries))
+            if not allow_repeats:
+                violations += [f"{profile.method} {profile.path}: {line}" for line in profile.repeat_problems()]
+        return violations
+
+
+def init_profiler(app):
+    """Profile the SQL of every request: statements, durations, call sites, N+1 patterns and full scans.
+
+    Meant for test and development runs; N+1 patterns and full scans are logged as warnings."""
+    profiler = QueryProfiler(app.config['QUERY_PROFILER_REPEAT_THRESHOLD'], app.config['QUERY_PROFILER_KEEP'])
+    app.extensions['query_profiler'] = profiler
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', profiler.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', profiler.after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        g.profiled_queries = []
+
+    @app.teardown_request
+    def finish_profile(exc):
+        # at teardown, so that the statements of streamed responses are in the profile too
+        queries = g.pop('profiled_queries', None)
+        if queries is None:
+            return
+        profile = profiler.finish(request.endpoint or 'unmatched', request.method, request.full_path.rstrip('?'),
+                                  queries)
+        problems = profile.problems()
+        if problems:
+            app.logger.warning("Query profile of %s %s:\n%s", profile.method, profile.path,
+                               '\n'.join(f"  {line}" for line in problems))
+
+    return profiler
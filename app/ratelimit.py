@@ -0,0 +1,126 @@
+import math
+import threading
+import time
+from flask import g, jsonify, request
+
+
+class MemoryBucketStore:
+    """Token buckets of one process, one float per client key.
+
+    A bucket is kept in its GCRA form: the time at which it will be full again ("tat"). Taking a token
+    pushes that time by 1/rate, and the request is refused when it would end up more than burst/rate
+    in the future. Keys whose bucket is full again carry no information, a few of them are dropped on
+    every call (oldest first), so the check stays O(1) and the dict does not grow with one-off clients."""
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._tat = {}  # key -> time the bucket is full again, least recently used first
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take one token, return 0 when allowed or the seconds to wait for the next token."""
+        now = self.clock()
+        with self._lock:
+            tat = max(self._tat.pop(key, now), now)
+            new_tat = tat + 1 / rate
+            wait = new_tat - now - burst / rate
+            self._tat[key] = tat if wait > 0 else new_tat  # moves the key to the end
+            for _ in range(2):
+                oldest = next(iter(self._tat))
+                if self._tat[oldest] > now and len(self._tat) <= self.max_keys:
+                    break
+                del self._tat[oldest]
+        return max(wait, 0)
+
+    def __len__(self):
+        return len(self._tat)
+
+
+class SharedBucketStore:
+    """Token buckets in a shared server (Redis or anything with the same get/set calls), for several workers.
+
+    The read and the write are two calls, so concurrent requests of one client on different workers
+    can both get the last token: a client may go over its burst by at most the number of workers."""
+
+    def __init__(self, client, prefix='flask-app:ratelimit:', clock=time.time):
+        self.client = client
+        self.prefix = prefix
+        self.clock = clock  # wall clock, shared by all the machines
+
+    def take(self, key, rate, burst):
+        now = self.clock()
+        raw = self.client.get(self.prefix + key)
+        tat = max(float(raw), now) if raw is not None else now
+        new_tat = tat + 1 / rate
+        wait = new_tat - now - burst / rate
+        if wait > 0:
+            return wait
+        # The key expires when the bucket is full again
+        self.client.set(self.prefix + key, repr(new_tat).encode(), ex=max(1, math.ceil(new_tat - now)))
+        return 0
+
+
+def create_store(config):
+    """Build the bucket store selected by RATELIMIT_STORE ('memory' or 'shared')."""
+    store = config.get('RATELIMIT_STORE', 'memory')
+    if store == 'memory':
+        return MemoryBucketStore(config.get('RATELIMIT_MAX_KEYS', 100000))
+    if store == 'shared':
+        client = config.get('RATELIMIT_CLIENT')
+        if client is None:
+            import redis  # optional dependency, only needed for a real shared store
+            client = redis.Redis.from_url(config['RATELIMIT_REDIS_URL'])
+        return SharedBucketStore(client)
+    raise ValueError(f"Unknown RATELIMIT_STORE: {store}")
+
+
+def client_key(api_key_header):
+    """The API key of the request when it sends one, its remote address otherwise."""
+    api_key = request.headers.get(api_key_header)
+    return f'key:{api_key}' if api_key else f'ip:{request.remote_addr}'
+
+
+def too_many_requests(wait, status=429, message="Too many requests, retry later"):
+    return jsonify({"error": message}), status, {'Retry-After': str(max(1, math.ceil(wait)))}
+
+
+def init_rate_limits(app):
+    """Per-client token buckets (RATELIMIT_*) and a cap on requests in progress (MAX_CONCURRENT_REQUESTS).
+
+    Both run before the view, so a refused request costs no database work."""
+    default = app.config['RATELIMIT_DEFAULT']
+    limits = app.config['RATELIMIT_ROUTES']  # endpoint -> (rate, burst), None for no limit
+    api_key_header = app.config['RATELIMIT_API_KEY_HEADER']
+    max_concurrent = app.config['MAX_CONCURRENT_REQUESTS']
+
+    if app.config['RATELIMIT_ENABLED']:
+        store = create_store(app.config)
+        app.extensions['rate_limits'] = store
+
+        @app.before_request
+        def check_rate_limit():
+            limit = limits.get(request.endpoint, default)
+            if limit is None:
+                return None
+            wait = store.take(f'{request.endpoint}:{client_key(api_key_header)}', *limit)
+            if wait:
+                return too_many_requests(wait)
+            return None
+
+    if max_concurrent:
+        slots = threading.BoundedSemaphore(max_concurrent)
+        app.extensions['request_slots'] = slots
+
+        @app.before_request
+        def admit_request():
+            # Shed load right away instead of queueing for a database connection
+            if not slots.acquire(blocking=False):
+                return too_many_requests(1, 503, "Server is busy, retry later")
+            g.request_slot = True
+            return None
+
+        @app.teardown_request
+        def release_request_slot(exc):
+            if g.pop('request_slot', False):
+                slots.release()
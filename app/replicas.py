@@ -0,0 +1,126 @@
+import functools
+import itertools
+import threading
+import time
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+
+class RoutingSession(Session):
+    """Session that runs the statements of replica-enabled views on the replica chosen for the request.
+
+    Flushes (INSERT/UPDATE/DELETE) always go to the primary, except for the item statements
+    of a request routed to an item shard (see app/sharding.py), reads and writes alike."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('db_shard') is not None:
+            from .sharding import shard_bind
+            engine = shard_bind(mapper)
+            if engine is not None:
+                return engine
+        if bind is None and not self._flushing and has_app_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaSet:
+    """Round-robin choice among the healthy read replicas.
+
+    A replica whose query fails is taken out for retry_interval seconds, then probed again."""
+
+    def __init__(self, keys, retry_interval=30, clock=time.monotonic):
+        self.keys = list(keys)
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self._down = {}  # key -> time it was marked down
+        self._cycle = itertools.cycle(self.keys)
+        self._lock = threading.Lock()
+
+    def choose(self, engines):
+        """Return the bind key of a healthy replica, or None to read from the primary."""
+        with self._lock:
+            for _ in range(len(self.keys)):
+                key = next(self._cycle)
+                down_since = self._down.get(key)
+                if down_since is None:
+                    return key
+                if self.clock() - down_since >= self.retry_interval and self._probe(engines[key]):
+                    del self._down[key]
+                    return key
+        return None
+
+    def mark_down(self, key):
+        with self._lock:
+            self._down[key] = self.clock()
+
+    def healthy(self):
+        return [key for key in self.keys if key not in self._down]
+
+    def _probe(self, engine):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1 FROM item LIMIT 1"))
+            return True
+        except OperationalError:
+            return False
+
+
+def reads_primary():
+    """True when this client wrote recently, so its reads must see its own writes."""
+    try:
+        return float(request.cookies.get(current_app.config['REPLICA_STICKY_COOKIE'], 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_from_replica(view):
+    """Run a read-only view on a read replica, falling back to the primary if the replica fails."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        from . import db
+        replicas = current_app.extensions.get('replicas')
+        if replicas is None or reads_primary():
+            return view(*args, **kwargs)
+        g.db_replica = replicas.choose(db.engines)
+        if g.db_replica is None:
+            return view(*args, **kwargs)
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            current_app.logger.warning("Read replica %s failed, reading from the primary", g.db_replica,
+                                       exc_info=True)
+            replicas.mark_down(g.db_replica)
+            db.session.rollback()
+            g.db_replica = None
+            return view(*args, **kwargs)
+        finally:
+            g.pop('db_replica', None)
+    return wrapper
+
+
+def replica_binds(uris):
+    """SQLALCHEMY_BINDS entries for the replica URIs: replica0, replica1, ..."""
+    return {f'replica{n}': uri for n, uri in enumerate(uris)}
+
+
+def init_replicas(app):
+    """Route replica-enabled reads to REPLICA_DATABASE_URIS and keep writers on the primary for a while."""
+    from . import db
+    keys = [key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('replica')]
+    for key in keys:
+        # Replicas copy the primary's tables, they have no models of their own. Flask-SQLAlchemy made an
+        # empty MetaData per bind, which would make create_all() of every later app look for these binds.
+        db.metadatas.pop(key, None)
+    app.extensions['replicas'] = ReplicaSet(keys, app.config['REPLICA_RETRY_INTERVAL'])
+    sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+
+    @app.after_request
+    def stick_writers_to_primary(response):
+        if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+            response.set_cookie(app.config['REPLICA_STICKY_COOKIE'], str(time.time() + sticky_seconds),
+                                max_age=sticky_seconds, httponly=True, samesite='Lax')
+        return response
@@ -1,58 +1,400 @@
-from flask import jsonify, abort, request, render_template
+import functools
+import queue
+import re
+import time
+from flask import jsonify, abort, request, render_template, Response, stream_with_context, url_for, g
+from sqlalchemy import select
+from sqlalchemy.orm.exc import StaleDataError
 from .utils import add_numbers, get_home_message
-from .models import Item
-from .forms import ItemForm
+from .models import Item, ItemTableVersion, commit_item_changes
+from .search import search_items, SEARCH_MODES  # also attaches the FTS index DDL to the item table
+from .pagination import MAX_ID, parse_page_args, fetch_page, next_link, stream_items
+from .compression import precompressed_response
+from .replicas import read_from_replica, reads_primary
+from .sharding import new_item_id, on_item_shard, unsharded
+from .etags import (item_etag, items_etag, is_not_modified, not_modified, precondition_failed,
+                    precondition_failed_response)
 from . import db
 
+# The error message of /submit for the first of these (field, code) found, see validate_item_request()
+SUBMIT_ERRORS = (('name', 'too_long', "Name is too long"), ('description', 'too_long', "Description is too long"),
+                 ('name', 'required', "Name required"))
+
+# Refused in the search text: FTS5 cannot match them, a NUL even ends its query string early
+_CONTROL_CHARACTERS = re.compile(r'[\x00-\x1f\x7f]')
+
+# Forms (Flask-WTF/WTForms) and bulk are imported inside the views that use them: they are most
+# of the import time of this module and a worker that never serves those routes should not pay for them.
+
 def init_routes(app):
+    cache = app.extensions['item_cache']
+    snapshot = app.extensions.get('item_snapshot')  # when set, item reads make no query at all
+    replicas = app.extensions.get('replicas')
+
+    def cached_json(key):
+        """Return the cached JSON response stored under key, or None on a miss.
+
+        A client that just wrote always misses: the cache may hold what a lagging replica served before its write."""
+        if replicas is not None and reads_primary():
+            return None
+        g.item_cache_generation = cache.generation()  # before the query, see store_json()
+        cached = cache.get(key)
+        if cached is None:
+            return None
+        body, headers, variants = cached
+        response = Response(body, 200, headers, mimetype='application/json')
+        etag, _ = response.get_etag()
+        if etag and is_not_modified(etag):
+            return not_modified(etag)
+        response.headers['X-Cache'] = 'HIT'
+        g.item_cache_entry = (key, cached)  # lets the compression hook add its output to the entry
+        return precompressed_response(response, variants) if variants else response
+
+    def store_json(key, response, *header_names):
+        """Cache the body (and the given headers) of a successful JSON response, unless a replica served it
+        or an item write came in since cached_json() (the body may predate it)."""
+        response.headers['X-Cache'] = 'MISS'
+        if g.get('db_replica') is not None:
+            return response  # possibly older than the last write, which already invalidated the entry
+        entry = cache.set(key, response.get_data(), {h: response.headers[h] for h in header_names
+                                                     if h in response.headers}, g.get('item_cache_generation'))
+        if entry is not None:
+            g.item_cache_entry = (key, entry)
+        return response
 
     @app.route('/')
     def home():
         return jsonify(get_home_message()), 200
 
+    @functools.lru_cache(maxsize=app.config['ADD_MEMO_SIZE'])
+    def add_body(a, b):
+        """JSON body of /add/<a>/<b>, memoized on the raw path segments (a ValueError is not cached)."""
+        return app.json.dumps({"result": add_numbers(int(a), int(b))}) + '\n'
+
     @app.route('/add/<a>/<b>')
     def add(a, b):
         try:
-            a, b = int(a), int(b)
-            result = add_numbers(a, b)
-            return jsonify({"result": result}), 200
+            return Response(add_body(a, b), mimetype='application/json'), 200
         except ValueError:
             return jsonify({"error": "Invalid input: parameters must be integers"}), 400
 
+    @app.route('/add/batch', methods=['POST'])
+    def add_batch():
+        from .arithmetic import (BINARY_MIMETYPE, PAIR_SIZE, chunked, max_json_body, parse_json_pairs,
+                                 read_binary_pairs, stream_sums)
+        max_pairs = app.config['ADD_BATCH_MAX_PAIRS']
+        chunk_pairs = app.config['ADD_BATCH_CHUNK_SIZE']
+        if request.mimetype == BINARY_MIMETYPE:
+            length = request.content_length
+            if length is None or length % PAIR_SIZE:
+                return jsonify({"error": "Binary body must be whole pairs of little-endian 64-bit integers"}), 400
+            if length // PAIR_SIZE > max_pairs:
+                return jsonify({"error": f"Too many pairs, the limit is {max_pairs}"}), 400
+            columns = read_binary_pairs(request.stream, chunk_pairs)
+        else:
+            length = request.content_length
+            if length is None:
+                return jsonify({"error": "A Content-Length is required"}), 411
+            if length > max_json_body(max_pairs):  # before the whole body is read and parsed into ints
+                return jsonify({"error": f"Body too large for {max_pairs} pairs"}), 413
+            try:
+                a, b = parse_json_pairs(request.get_data())
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if len(a) > max_pairs:
+                return jsonify({"error": f"Too many pairs, the limit is {max_pairs}"}), 400
+            columns = chunked(a, b, chunk_pairs)
+        return Response(stream_with_context(stream_sums(columns)), mimetype='application/json')
+
     @app.route('/about')
     def about():
         return "About Page", 200
 
     @app.route('/items', methods=['POST'])
     def create_item():
-        if not request.form:
+        if not request.form and not request.is_json:
             return jsonify({"error": "No form data provided"}), 400
-        form = ItemForm()
-        if form.validate_on_submit():
-            item = Item(name=form.name.data, description=form.description.data)
+        from .forms import validate_item_request
+        values, errors = validate_item_request()
+        if not errors:
+            writer = app.extensions.get('write_behind')
+            if writer is not None:
+                # Write-behind mode: the row is written later in a group-committed batch
+                try:
+                    token = writer.submit({"name": values['name'], "description": values['description']})
+                except queue.Full:
+                    return jsonify({"error": "Too many pending writes, retry later"}), 503, {'Retry-After': '1'}
+                status_url = url_for('get_pending_item', token=token)
+                return jsonify({"status": "pending", "token": token, "status_url": status_url}), 202, {'Location': status_url}
+
+            item = Item(id=new_item_id(), name=values['name'], description=values['description'])
             db.session.add(item)
-            db.session.commit()
-            return jsonify({"id": item.id, "name": item.name, "description": item.description}), 201
-        return jsonify({"error": "Invalid form data", "errors": form.errors}), 400
+            db.session.flush()  # assigns the id that the change log records
+            commit_item_changes('create', [item.id])
+            response = jsonify({"id": item.id, "name": item.name, "description": item.description})
+            response.set_etag(item_etag(item.id, item.version))
+            return response, 201
+        return jsonify({"error": "Invalid form data", "errors": errors}), 400
+
+    @app.route('/items/pending/<token>', methods=['GET'])
+    def get_pending_item(token):
+        writer = app.extensions.get('write_behind')
+        status = writer.status(token) if writer is not None else None
+        if status is None:
+            return jsonify({"error": "Unknown token"}), 404
+        if status["status"] == "created":
+            return jsonify(dict(status, url=url_for('get_item', id=status["id"]))), 200
+        return jsonify(status), 200
+
+    @app.route('/items/bulk', methods=['POST'])
+    def create_items_bulk():
+        from .bulk import parse_bulk_body, validate_rows, bulk_create
+        try:
+            rows = parse_bulk_body()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not rows:
+            return jsonify({"error": "No items provided"}), 400
+
+        errors = validate_rows(rows)
+        if errors:
+            # Nothing is inserted when any row is invalid
+            return jsonify({"error": "Invalid item data", "errors": errors}), 400
+        ids = bulk_create(rows)
+        commit_item_changes('create', ids)
+        return jsonify({"created": len(ids), "ids": ids}), 201
+
+    @app.route('/items/bulk', methods=['PUT'])
+    def update_items_bulk():
+        from .bulk import parse_ids, bulk_update
+        from .forms import validate_item_data
+        data = request.get_json(silent=True)
+        try:
+            ids = parse_ids(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        values = {k: data[k] for k in ('name', 'description') if data.get(k) is not None}
+        if not values:
+            return jsonify({"error": "No fields to update"}), 400
+        errors = {k: v for k, v in validate_item_data(values).items() if k in values}
+        if errors:
+            return jsonify({"error": "Invalid item data", "errors": errors}), 400
+        updated = bulk_update(ids, values)
+        commit_item_changes('update', ids)
+        return jsonify({"updated": updated}), 200
+
+    @app.route('/items/bulk', methods=['DELETE'])
+    def delete_items_bulk():
+        from .bulk import parse_ids, bulk_delete
+        try:
+            ids = parse_ids(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        deleted = bulk_delete(ids)
+        commit_item_changes('delete', ids)
+        return jsonify({"deleted": deleted}), 200
+
+    @app.route('/items/export', methods=['GET'])
+    @unsharded
+    def items_export():
+        from .transfer import EXPORT_FORMATS, export_format, export_items
+        try:
+            fmt = export_format(request.args.get('format'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return Response(stream_with_context(export_items(fmt)), mimetype=EXPORT_FORMATS[fmt],
+                        headers={'Content-Disposition': f'attachment; filename=items.{fmt}'})
+
+    @app.route('/items/import', methods=['POST'])
+    @unsharded
+    def items_import():
+        from .transfer import ImportRowError, export_format, import_items, upload_stream
+        try:
+            binary, mimetype = upload_stream()
+            fmt = export_format(request.args.get('format'), mimetype)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        def progress(imported, seconds):
+            app.logger.info("Import: %d rows in %.1fs (%.0f rows/s)", imported, seconds, imported / max(seconds, 1e-9))
+
+        start = time.perf_counter()
+        try:
+            imported = import_items(binary, fmt, progress)
+        except ImportRowError as e:
+            return jsonify({"error": str(e), "row": e.row, "imported": e.imported}), 400
+        seconds = time.perf_counter() - start
+        return jsonify({"imported": imported, "seconds": round(seconds, 3),
+                        "rows_per_second": round(imported / max(seconds, 1e-9))}), 201
 
     @app.route('/items', methods=['GET'])
+    @read_from_replica
     def get_items():
-        items = Item.query.all()
-        return jsonify([{"id": i.id, "name": i.name, "description": i.description} for i in items]), 200
+        try:
+            after, limit = parse_page_args(request.args)
+        except ValueError:
+            return jsonify({"error": "Invalid input: 'after' and 'limit' must be positive integers"}), 400
+
+        stream = request.args.get('stream')
+        if stream is not None:
+            # Opt-in streaming of the whole table (from the cursor on) as a JSON array or NDJSON
+            if stream not in ('json', 'ndjson'):
+                return jsonify({"error": "Invalid stream format, use 'json' or 'ndjson'"}), 400
+            mimetype = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+            return Response(stream_with_context(stream_items(after, stream)), mimetype=mimetype)
+
+        if snapshot is not None:
+            # The position in the change log stands for the table change counter ('s' keeps the two apart)
+            seq, rows = snapshot.page(after, limit + 1)
+            etag = items_etag(f's{seq}', after, limit)
+            if is_not_modified(etag):
+                return not_modified(etag)
+            rows, next_cursor = rows[:limit], rows[limit - 1].id if len(rows) > limit else None
+            response = Response(app.json.items_json(rows), mimetype='application/json')
+            response.set_etag(etag)
+            if next_cursor is not None:
+                response.headers['Link'] = next_link(next_cursor, limit)
+                response.headers['X-Next-Cursor'] = str(next_cursor)
+            return response, 200
+
+        key = cache.list_key(f'{after}:{limit}')
+        response = cached_json(key)
+        if response is not None:
+            return response
+
+        # The table change counter alone decides whether the client's copy is still current
+        etag = items_etag(ItemTableVersion.current(), after, limit)
+        if is_not_modified(etag):
+            return not_modified(etag)
+
+        rows, next_cursor = fetch_page(after, limit)
+        response = Response(app.json.items_json(rows), mimetype='application/json')
+        response.set_etag(etag)
+        if next_cursor is not None:
+            response.headers['Link'] = next_link(next_cursor, limit)
+            response.headers['X-Next-Cursor'] = str(next_cursor)
+        return store_json(key, response, 'ETag', 'Link', 'X-Next-Cursor'), 200
+
+    @app.route('/items/changes', methods=['GET'])
+    def item_changes():
+        from .changes import ChangesExpired, changes_since
+        try:
+            since = int(request.args.get('since', 0))
+            limit = min(int(request.args.get('limit', app.config['ITEMS_PAGE_SIZE'])), app.config['ITEMS_MAX_PAGE_SIZE'])
+            if not 0 <= since <= MAX_ID or limit < 1:  # larger sequence numbers overflow SQLite's INTEGER
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "Invalid input: 'since' and 'limit' must be positive integers"}), 400
+        # Always from the primary: a replica may not have the latest changes yet
+        with db.engine.connect() as connection:
+            try:
+                changes = changes_since(connection, since, limit + 1)  # one extra row tells if more are waiting
+            except ChangesExpired as e:
+                return jsonify({"error": str(e), "oldest_seq": e.oldest}), 410
+        changes, more = changes[:limit], len(changes) > limit
+        return jsonify({"changes": changes, "last_seq": changes[-1]["seq"] if changes else since, "more": more}), 200
+
+    @app.route('/items/changes/stream', methods=['GET'])
+    def item_changes_stream():
+        from .changes import last_seq, stream_changes
+        since = request.args.get('since', request.headers.get('Last-Event-ID'))
+        try:
+            if since is None:
+                with db.engine.connect() as connection:
+                    since = last_seq(connection)  # only the changes from now on
+            since = int(since)
+            if not 0 <= since <= MAX_ID:
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "Invalid input: 'since' must be a positive integer"}), 400
+        feed = app.extensions['item_changes']
+        try:
+            stream = stream_changes(feed, since, app.config['ITEM_CHANGES_HEARTBEAT'])
+            first = next(stream)  # subscribes, or raises when the process has too many streams
+        except OverflowError as e:
+            return jsonify({"error": str(e)}), 503, {'Retry-After': '5'}
+
+        def events():
+            yield first
+            yield from stream
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/items/search', methods=['GET'])
+    @unsharded
+    def search():
+        q = request.args.get('q')
+        name = request.args.get('name')
+        name_prefix = request.args.get('name_prefix')
+        mode = request.args.get('mode', 'substring')
+        if not (q or name or name_prefix):
+            return jsonify({"error": "Provide at least one of 'q', 'name' or 'name_prefix'"}), 400
+        if mode not in SEARCH_MODES:
+            return jsonify({"error": "Invalid mode, use 'substring' or 'prefix'"}), 400
+        if q and _CONTROL_CHARACTERS.search(q):
+            return jsonify({"error": "Invalid input: 'q' must not contain control characters"}), 400
+        try:
+            limit = min(int(request.args.get('limit', app.config['ITEMS_PAGE_SIZE'])), app.config['ITEMS_MAX_PAGE_SIZE'])
+            offset = int(request.args.get('offset', 0))
+            if limit < 1 or not 0 <= offset <= MAX_ID - limit - 1:  # OFFSET (and the rank window) fit SQLite's INTEGER
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "Invalid input: 'limit' and 'offset' must be positive integers"}), 400
+
+        # one extra row tells if a next page exists
+        if snapshot is not None and not q:
+            items = snapshot.search_names(name, name_prefix, limit + 1, offset)
+        else:
+            items = search_items(q, mode, name, name_prefix, limit + 1, offset, app.config['SEARCH_RANK_WINDOW'])
+        response = jsonify(items[:limit])
+        if len(items) > limit:
+            args = dict(request.args, offset=offset + limit, limit=limit)
+            response.headers['Link'] = f'<{url_for("search", **args)}>; rel="next"'
+        return response, 200
 
     @app.route('/items/<int:id>', methods=['GET'])
+    @on_item_shard
+    @read_from_replica
     def get_item(id):
-        item = Item.query.get(id)
-        if not item:
+        if snapshot is not None:
+            row = snapshot.get(id)
+            if row is None:
+                return jsonify({"error": "Item not found"}), 404
+            if is_not_modified(item_etag(row.id, row.version)):
+                return not_modified(item_etag(row.id, row.version))
+            response = Response(app.json.item_json(row), mimetype='application/json')
+            response.set_etag(item_etag(row.id, row.version))
+            return response, 200
+
+        key = cache.item_key(id)
+        response = cached_json(key)
+        if response is not None:
+            return response
+
+        if request.if_none_match:
+            # Only the version column is read to answer a conditional GET
+            version = db.session.execute(select(Item.version).where(Item.id == id)).scalar()
+            if version is not None and is_not_modified(item_etag(id, version)):
+                return not_modified(item_etag(id, version))
+
+        row = db.session.execute(select(Item.id, Item.name, Item.description, Item.version)
+                                 .where(Item.id == id)).first()
+        if row is None:
             return jsonify({"error": "Item not found"}), 404
-        item_data = {"id": item.id, "name": item.name, "description": item.description}
-        return jsonify(item_data), 200
+        response = Response(app.json.item_json(row), mimetype='application/json')
+        response.set_etag(item_etag(row.id, row.version))
+        return store_json(key, response, 'ETag'), 200
 
     @app.route('/items/<int:id>', methods=['PUT'])
+    @on_item_shard
     def update_item(id):
         item = Item.query.get(id)
         if not item:
             return jsonify({"error": "Item not found"}), 404
+        if precondition_failed(item_etag(item.id, item.version)):
+            return precondition_failed_response()
 
         if not request.is_json:  # Add this for robustness
             return jsonify({"error": "Request must contain JSON data"}), 400
@@ -71,49 +413,53 @@ def init_routes(app):
 
         item.name = name if name is not None and len(name)>0 else item.name
         item.description = description if description is not None and len(description)>0 else item.description
-        db.session.commit()
-        return jsonify({"id": item.id, "name": item.name, "description": item.description}), 200
+        try:
+            commit_item_changes('update', [item.id])
+        except StaleDataError:  # another request updated the item since it was loaded
+            db.session.rollback()
+            return precondition_failed_response()
+        response = jsonify({"id": item.id, "name": item.name, "description": item.description})
+        response.set_etag(item_etag(item.id, item.version))
+        return response, 200
 
 
     @app.route('/items/<int:id>', methods=['DELETE'])
+    @on_item_shard
     def delete_item(id):
         item = Item.query.get(id)
         if not item:
             return jsonify({"error": "Item not found"}), 404
+        if precondition_failed(item_etag(item.id, item.version)):
+            return precondition_failed_response()
         db.session.delete(item)
-        db.session.commit()
+        try:
+            commit_item_changes('delete', [id])
+        except StaleDataError:
+            db.session.rollback()
+            return precondition_failed_response()
         return jsonify({"message": "Item deleted"}), 200
 
     @app.route('/submit', methods=['GET', 'POST'])
     def submit_form():
-        form = ItemForm()
         if request.method == 'POST':
-            if form.validate_on_submit():
+            from .forms import validate_item_request
+            codes = {}
+            values, errors = validate_item_request(codes)
+            if not errors:
                 # Return JSON on successful submission
                 return jsonify({
                     "message": "Form submitted",
-                    "name": form.name.data,
-                    "description": form.description.data
+                    "name": values['name'],
+                    "description": values['description']
                 }), 200
-            else:
-                if len(form.name.data) > 25:
-                    # Return JSON with error details when form is invalid
-                    return jsonify({
-                        "error": "Name is too long"
-                    }), 400
-                if len(form.description.data) > 200:
-                    # Return JSON with error details when form is invalid
-                    return jsonify({
-                        "error": "Description is too long"
-                    }), 400
-                if form.name.data == "":
-                    # Return JSON with error details when form is invalid
-                    return jsonify({
-                        "error": "Name required"
-                    }), 400
-
-        # For GET requests, render the form HTML page
-        return render_template('submit.html', form=form)
+            # One message for the first problem, all of them under "errors"
+            message = next((message for field, code, message in SUBMIT_ERRORS if codes.get(field) == code), None)
+            if message is not None:
+                return jsonify({"error": message, "errors": errors}), 400
+
+        # For GET requests (and submissions without a valid CSRF token), render the form HTML page
+        from .forms import ItemForm
+        return render_template('submit.html', form=ItemForm())
 
     # New Route for Config Testing
     @app.route('/config-status')
@@ -121,6 +467,12 @@ def init_routes(app):
         debug_mode = app.config['DEBUG_MODE']
         return jsonify({"debug_mode": debug_mode}), 200
 
+    @app.route('/cache-stats')
+    def cache_stats():
+        if snapshot is not None:
+            return jsonify(dict(cache.stats(), snapshot=snapshot.stats())), 200
+        return jsonify(cache.stats()), 200
+
     # New Route for 500 Error Testing
     @app.route('/trigger-error')
     def trigger_error():
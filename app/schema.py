@@ -0,0 +1,19 @@
+from flask import current_app
+from sqlalchemy import inspect, text
+from . import db
+
+
+def upgrade_schema():
+    """Create missing tables and add the columns newer models need to an existing database."""
+    db.create_all()
+    columns = {c['name'] for c in inspect(db.engine).get_columns('item')}
+    if 'version' not in columns:
+        db.session.execute(text("ALTER TABLE item ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_item_name ON item (name)"))
+    db.session.commit()
+    if db.engine.dialect.name == 'sqlite':
+        from .search import create_fts_index
+        create_fts_index()
+    if 'item_shards' in current_app.extensions:
+        from .sharding import create_shard_tables
+        create_shard_tables()
@@ -0,0 +1,229 @@
+"""Items hash-partitioned across several databases (e.g. SQLite files), see SHARD_DATABASE_URIS.
+
+The item of id i lives on shard_index(i, N). Ids come from one allocator on the primary database,
+handed out in blocks per process, so they are unique across the shards and a new item is written to
+a single shard. The primary keeps the tables that are not sharded: the change counter and the change
+log (one small write per request) and the allocator (one write per block of ids). A SQLite file has one
+writer at a time: writes to different shards no longer wait for each other.
+
+The number of shards is fixed by the first write, moving rows between shards is not supported.
+"""
+import functools
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+from operator import itemgetter
+from flask import current_app, g, jsonify
+from sqlalchemy import func, inspect, select, update
+from sqlalchemy.schema import CreateIndex, CreateTable
+from .models import Item, ItemIdBlock
+from . import db
+
+SHARDED_TABLES = {Item.__tablename__}
+ID_CHUNK_SIZE = 500  # keeps IN (...) lists below SQLite's bound parameter limit
+_GOLDEN = 0x9E3779B97F4A7C15  # 2**64 / golden ratio, Fibonacci hashing
+
+
+def shard_index(id, count):
+    """The shard of an id: consecutive ids are spread evenly, whatever the number of shards."""
+    return ((id * _GOLDEN) & 0xFFFFFFFFFFFFFFFF) * count >> 64
+
+
+def shard_binds(uris):
+    """SQLALCHEMY_BINDS entries for the shard URIs: shard0, shard1, ..."""
+    return {f'shard{n}': uri for n, uri in enumerate(uris)}
+
+
+class ShardSet:
+    """The shard bind keys, the id allocator of this process and the thread pool of the scatter-gather reads."""
+
+    def __init__(self, keys, id_block_size):
+        self.keys = list(keys)
+        self.id_block_size = id_block_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next_id = self._end_id = 0
+        self._executor = None
+
+    def key_for(self, id):
+        return self.keys[shard_index(id, len(self.keys))]
+
+    def group(self, ids):
+        """{bind key: ids on that shard} in shard order, the ids of a shard in the order given.
+
+        A request writing to several shards takes their write locks in this order, then the primary's:
+        two requests never wait for each other's locks."""
+        groups = {key: [] for key in self.keys}
+        for id in ids:
+            groups[self.key_for(id)].append(id)
+        return {key: shard_ids for key, shard_ids in groups.items() if shard_ids}
+
+    def _check_fork(self):
+        # A forked worker must neither hand out the ids of its parent's block nor use its pool threads
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._next_id = self._end_id = 0
+            self._executor = None
+
+    def allocate_ids(self, count):
+        """Return count new item ids, reserving a block on the primary when the current one runs out."""
+        with self._lock:
+            self._check_fork()
+            if self._end_id - self._next_id < count:
+                size = max(count, self.id_block_size)
+                with db.engine.begin() as connection:  # its own short transaction, not the request's
+                    connection.execute(update(ItemIdBlock).where(ItemIdBlock.id == 1)
+                                       .values(next_id=ItemIdBlock.next_id + size))
+                    self._end_id = connection.execute(select(ItemIdBlock.next_id)
+                                                      .where(ItemIdBlock.id == 1)).scalar()
+                self._next_id = self._end_id - size
+            ids = list(range(self._next_id, self._next_id + count))
+            self._next_id += count
+            return ids
+
+    def scatter(self, read):
+        """Run read(key, connection) on every shard in parallel, return the results in shard order."""
+        engines = {key: db.engines[key] for key in self.keys}
+
+        def run(key):
+            with engines[key].connect() as connection:
+                return read(key, connection)
+
+        with self._lock:
+            self._check_fork()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(len(self.keys), thread_name_prefix='shard')
+            executor = self._executor
+        return list(executor.map(run, self.keys))
+
+    def gather(self, query, limit):
+        """The first limit rows of an id-ordered select over all shards."""
+        results = self.scatter(lambda key, connection: connection.execute(query).all())
+        return list(islice(heapq.merge(*results, key=itemgetter(0)), limit))
+
+    def stream(self, query, batch_size):
+        """Generate the rows of an id-ordered select over all shards in batches, merged as they are fetched."""
+        with ExitStack() as stack:
+            results = [stack.enter_context(db.engines[key].connect()).execution_options(yield_per=batch_size)
+                       .execute(query) for key in self.keys]
+            merged = heapq.merge(*results, key=itemgetter(0))
+            while True:
+                batch = list(islice(merged, batch_size))
+                if not batch:
+                    return
+                yield batch
+
+    def connection(self, key):
+        """The session's connection to a shard, in the transaction that commit_item_changes() commits."""
+        return db.session.connection(bind_arguments={'bind': db.engines[key]})
+
+    def insert_rows(self, rows):
+        """Insert (name, description) tuples on their shards, return the new ids in order."""
+        ids = self.allocate_ids(len(rows))
+        groups = {key: [] for key in self.keys}  # in shard order, see group()
+        for id, (name, description) in zip(ids, rows):
+            groups[self.key_for(id)].append((id, name, description))
+        for key, values in groups.items():
+            if values:
+                self.connection(key).exec_driver_sql("INSERT INTO item (id, name, description) VALUES (?, ?, ?)", values)
+        return ids
+
+    def chunks(self, ids):
+        """(bind arguments, ids) per shard, for bulk statements run through the session."""
+        for key, shard_ids in self.group(ids).items():
+            for start in range(0, len(shard_ids), ID_CHUNK_SIZE):
+                yield {'bind': db.engines[key]}, shard_ids[start:start + ID_CHUNK_SIZE]
+
+    def items_by_id(self, ids):
+        """{id: item dict} of the ids that still exist, read from their shards in parallel."""
+        groups = self.group(ids)
+        if not groups:
+            return {}
+
+        def read(key, connection):
+            shard_ids = groups.get(key, [])
+            rows = []
+            for start in range(0, len(shard_ids), ID_CHUNK_SIZE):
+                rows += connection.execute(select(Item.id, Item.name, Item.description, Item.version)
+                                           .where(Item.id.in_(shard_ids[start:start + ID_CHUNK_SIZE]))).all()
+            return rows
+
+        results = self.scatter(read)
+        return {row.id: {"id": row.id, "name": row.name, "description": row.description, "version": row.version}
+                for rows in results for row in rows}
+
+
+def item_shards():
+    """The ShardSet of the app, None when the items are not sharded."""
+    return current_app.extensions.get('item_shards')
+
+
+def new_item_id():
+    """Allocate the id of a new item and route the session's item statements to its shard.
+
+    Returns None when the items are not sharded: the database assigns the id."""
+    shards = item_shards()
+    if shards is None:
+        return None
+    id = shards.allocate_ids(1)[0]
+    g.db_shard = shards.key_for(id)
+    return id
+
+
+def on_item_shard(view):
+    """Run the item statements of a view taking an item id on the shard of that item."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        shards = item_shards()
+        if shards is not None:
+            g.db_shard = shards.key_for(kwargs['id'])
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def unsharded(view):
+    """Answer 501 from a view that only works on an item table in the primary database."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if item_shards() is not None:
+            return jsonify({"error": "Not available when the items are sharded"}), 501
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def shard_bind(mapper):
+    """The shard engine for the statements of mapper in this request, or None."""
+    key = g.get('db_shard')
+    if key is None or mapper is None or inspect(mapper).local_table.name not in SHARDED_TABLES:
+        return None
+    return db.engines[key]
+
+
+def create_shard_tables():
+    """Create the item table on every shard and move the allocator past the ids already there."""
+    shards = item_shards()
+    top = 0
+    for key in shards.keys:
+        with db.engines[key].begin() as connection:
+            # Without the FTS index of the primary: /items/search is not available on sharded items
+            connection.execute(CreateTable(Item.__table__, if_not_exists=True))
+            for index in Item.__table__.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+            top = max(top, connection.execute(select(func.max(Item.id))).scalar() or 0)
+    db.session.execute(update(ItemIdBlock).where(ItemIdBlock.id == 1, ItemIdBlock.next_id <= top)
+                       .values(next_id=top + 1))
+    db.session.commit()
+
+
+def init_sharding(app):
+    """Store the items on the SHARD_DATABASE_URIS databases instead of the primary."""
+    if app.config['REPLICA_DATABASE_URIS']:
+        raise ValueError("SHARD_DATABASE_URIS and REPLICA_DATABASE_URIS cannot be used together")
+    keys = sorted((key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('shard')),
+                  key=lambda key: int(key[len('shard'):]))
+    for key in keys:
+        db.metadatas.pop(key, None)  # the shards have the item table only, see create_shard_tables()
+    app.extensions['item_shards'] = ShardSet(keys, app.config['SHARD_ID_BLOCK_SIZE'])
@@ -0,0 +1,12 @@
+from blinker import Namespace
+from flask import current_app
+
+_signals = Namespace()
+
+# Sent after a committed write to the item table, with op ('create', 'update', 'delete') and the ids
+items_changed = _signals.signal('items-changed')
+
+
+def notify_items_changed(op, ids):
+    """Tell the listeners (cache, ...) which items a committed write touched."""
+    items_changed.send(current_app._get_current_object(), op=op, ids=list(ids))
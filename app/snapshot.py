@@ -0,0 +1,237 @@
+"""In-process read model of the item table: GET /items/<id>, GET /items and name searches without a query.
+
+The rows are kept column by column in arrays and lists sorted by id, with a second order by (name, id):
+about 50 bytes per row plus its strings, against over a kilobyte for an ORM instance. Lookups are
+bisections, a read takes microseconds.
+
+The snapshot is loaded at startup and follows the change log (app/changes.py): right after every write
+of this process, and every ITEM_SNAPSHOT_POLL_INTERVAL seconds for the writes of the others.
+"""
+import os
+import sys
+import threading
+import time
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from .changes import ChangesExpired, changes_since, last_seq
+from .models import Item
+from .sharding import item_shards
+from .signals import items_changed
+from . import db
+
+ItemRow = namedtuple('ItemRow', ['id', 'name', 'description', 'version'])  # a tuple, like the rows of a query
+
+
+def _poll(ref, interval):
+    # Holds the snapshot only while refreshing it: the thread ends once the app is gone
+    while True:
+        time.sleep(interval)
+        snapshot = ref()
+        if snapshot is None:
+            return
+        try:
+            with snapshot.app.app_context():
+                snapshot.catch_up()
+        except Exception:  # e.g. the database is briefly unavailable, the next poll retries
+            snapshot.app.logger.exception("Item snapshot refresh failed")
+        del snapshot
+
+
+class ItemSnapshot:
+    """The item table in columns: ids, versions, names and descriptions at the same positions, ordered by id."""
+
+    __slots__ = ('app', 'poll_interval', 'batch_size', 'seq', 'loaded', '_ids', '_versions', '_names',
+                 '_descriptions', '_name_keys', '_name_ids', '_lock', '_refresh_lock', '_thread', '__weakref__')
+
+    def __init__(self, app, poll_interval=1.0, batch_size=1000):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.seq = 0  # last change of the log applied
+        self.loaded = False
+        self._ids = array('q')
+        self._versions = array('q')
+        self._names = []
+        self._descriptions = []
+        self._name_keys = []  # the names in (name, id) order, for bisections
+        self._name_ids = array('q')  # the ids in the same order
+        self._lock = threading.Lock()  # readers and the writer that applies changes
+        self._refresh_lock = threading.Lock()  # one reload or catch-up at a time
+        self._thread = None
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork())
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _after_fork(self):
+        # The poll thread does not survive a fork, and a lock held by another thread would stay held
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def _ready(self):
+        if not self.loaded:
+            self.load()
+        if self._thread is None:
+            self._thread = threading.Thread(target=_poll, args=(weakref.ref(self), self.poll_interval),
+                                            name='item-snapshot', daemon=True)
+            self._thread.start()
+
+    def load(self):
+        """Read the whole table into a new snapshot, then swap it in."""
+        with self._refresh_lock:
+            ids, versions, names, descriptions = array('q'), array('q'), [], []
+            query = select(Item.id, Item.name, Item.description, Item.version).order_by(Item.id)
+            with db.engine.connect() as connection:
+                # The log position first: a change committed while the table is read is applied again by
+                # the next catch-up, it is never skipped
+                seq = last_seq(connection)
+                shards = item_shards()
+                if shards is not None:
+                    batches = shards.stream(query, self.batch_size)
+                else:
+                    batches = connection.execute(query.execution_options(yield_per=self.batch_size)).partitions()
+                for rows in batches:
+                    for id, name, description, version in rows:
+                        ids.append(id)
+                        versions.append(version)
+                        names.append(sys.intern(name))  # repeated names are stored once
+                        descriptions.append(description)
+            order = sorted(range(len(ids)), key=lambda i: (names[i], ids[i]))
+            name_keys, name_ids = [names[i] for i in order], array('q', (ids[i] for i in order))
+            with self._lock:
+                self._ids, self._versions, self._names, self._descriptions = ids, versions, names, descriptions
+                self._name_keys, self._name_ids = name_keys, name_ids
+                self.seq = seq
+                self.loaded = True
+
+    def catch_up(self):
+        """Apply the changes logged since the last ones applied, reload when the log was pruned past them."""
+        if not self.loaded:
+            return
+        with self._refresh_lock:
+            while True:
+                with db.engine.connect() as connection:
+                    try:
+                        changes = changes_since(connection, self.seq, self.batch_size)
+                    except ChangesExpired:
+                        break
+                if not changes:
+                    return
+                with self._lock:
+                    for change in changes:  # the item state is the current one, whatever the op
+                        if change["item"] is None:
+                            self._remove(change["id"])
+                        else:
+                            self._upsert(change["item"])
+                    self.seq = changes[-1]["seq"]
+                if len(changes) < self.batch_size:
+                    return
+        self.load()
+
+    def on_items_changed(self, sender, **kwargs):
+        """Signal receiver: the writes of this process are seen by its next read."""
+        try:
+            self.catch_up()
+        except Exception:  # the write is committed, the poll thread catches up later
+            self.app.logger.exception("Item snapshot refresh failed")
+
+    def _position(self, id):
+        position = bisect_left(self._ids, id)
+        return position if position < len(self._ids) and self._ids[position] == id else None
+
+    def _name_position(self, name, id):
+        low = bisect_left(self._name_keys, name)
+        return bisect_left(self._name_ids, id, low, bisect_right(self._name_keys, name, low))
+
+    def _upsert(self, item):
+        id, name = item["id"], sys.intern(item["name"])
+        position = self._position(id)
+        if position is None:
+            position = bisect_left(self._ids, id)
+            self._ids.insert(position, id)
+            self._versions.insert(position, item["version"])
+            self._names.insert(position, name)
+            self._descriptions.insert(position, item["description"])
+        else:
+            self._versions[position] = item["version"]
+            self._descriptions[position] = item["description"]
+            if self._names[position] == name:
+                return
+            old = self._name_position(self._names[position], id)
+            del self._name_keys[old]
+            del self._name_ids[old]
+            self._names[position] = name
+        new = self._name_position(name, id)
+        self._name_keys.insert(new, name)
+        self._name_ids.insert(new, id)
+
+    def _remove(self, id):
+        position = self._position(id)
+        if position is None:
+            return
+        old = self._name_position(self._names[position], id)
+        del self._name_keys[old]
+        del self._name_ids[old]
+        for column in (self._ids, self._versions, self._names, self._descriptions):
+            del column[position]
+
+    def _row(self, position):
+        return ItemRow(self._ids[position], self._names[position], self._descriptions[position],
+                       self._versions[position])
+
+    def get(self, id):
+        """The ItemRow of id, None when there is no such item."""
+        self._ready()
+        with self._lock:
+            position = self._position(id)
+            return None if position is None else self._row(position)
+
+    def page(self, after, limit):
+        """(seq, rows): the change the snapshot is at and the first limit rows with an id above after."""
+        self._ready()
+        with self._lock:
+            start = bisect_right(self._ids, after)
+            return self.seq, [self._row(position) for position in range(start, min(start + limit, len(self._ids)))]
+
+    def search_names(self, name=None, name_prefix=None, limit=20, offset=0):
+        """Items with the name and/or the name prefix, in (name, id) order like search_items() without q."""
+        self._ready()
+        with self._lock:
+            low, high = 0, len(self._name_keys)
+            if name is not None:
+                low, high = bisect_left(self._name_keys, name), bisect_right(self._name_keys, name)
+            if name_prefix is not None:
+                low = max(low, bisect_left(self._name_keys, name_prefix))
+                high = min(high, bisect_left(self._name_keys, name_prefix + '\U0010ffff'))
+            ids = self._name_ids[low + offset:min(high, low + offset + limit)]
+            rows = [self._row(self._position(id)) for id in ids]
+        return [{"id": row.id, "name": row.name, "description": row.description} for row in rows]
+
+    def memory_bytes(self):
+        """Approximate size of the snapshot: the columns and the strings they hold, each string once."""
+        with self._lock:
+            columns = (self._ids, self._versions, self._names, self._descriptions, self._name_keys, self._name_ids)
+            strings = {id(s): s for column in (self._names, self._descriptions) for s in column if s is not None}
+            return sum(sys.getsizeof(column) for column in columns) + sum(map(sys.getsizeof, strings.values()))
+
+    def stats(self):
+        return {"rows": len(self._ids), "seq": self.seq, "loaded": self.loaded}
+
+
+def init_snapshot(app):
+    """Serve the item reads from an ItemSnapshot, loaded now if the schema exists (else on the first read)."""
+    snapshot = ItemSnapshot(app, app.config['ITEM_SNAPSHOT_POLL_INTERVAL'], app.config['ITEM_CHANGES_BATCH_SIZE'])
+    app.extensions['item_snapshot'] = snapshot
+    items_changed.connect(snapshot.on_items_changed, sender=app)
+    with app.app_context():
+        try:
+            snapshot.load()
+        except OperationalError:  # no schema yet, see `flask init-db`
+            app.logger.info("Item snapshot not loaded, the item table does not exist yet")
+    return snapshot
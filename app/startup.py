@@ -0,0 +1,64 @@
+import inspect
+import os
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.routing import Rule
+
+# Builders compiled by CachedRule, shared by every app created in this process
+_builders = {}
+
+
+class CachedRule(Rule):
+    """A URL rule that compiles its URL builders once per process.
+
+    Werkzeug compiles two builder functions per rule with ast + compile() whenever a rule is added,
+    which is most of the cost of create_app(). The builders only depend on the rule text, its defaults
+    and the map's slash handling, and take the rule as an argument, so apps created later (test suites,
+    new workers) reuse them.
+
+    _compile_builder() and _trace are private Werkzeug API (2.2 to 3.1): see url_rule_class()."""
+
+    def _compile_builder(self, append_unknown=True):
+        trace = getattr(self, '_trace', None)
+        if trace is None:  # not the rule state this cache key was written for
+            return super()._compile_builder(append_unknown)
+        key = (self.rule, self.host if self.map.host_matching else self.subdomain, self.merge_slashes,
+               tuple(sorted((name, repr(value)) for name, value in (self.defaults or {}).items())),
+               tuple(trace), append_unknown)
+        builder = _builders.get(key)
+        if builder is None:
+            builder = _builders[key] = super()._compile_builder(append_unknown)
+        return builder
+
+
+def url_rule_class():
+    """CachedRule when Werkzeug's Rule has the builder hook it overrides, else the stock Rule."""
+    try:
+        parameters = list(inspect.signature(Rule._compile_builder).parameters)
+    except (AttributeError, TypeError, ValueError):
+        return Rule
+    return CachedRule if parameters == ['self', 'append_unknown'] else Rule
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Jinja bytecode cache in a directory that is only created once a template is compiled."""
+
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+
+def init_templates(app):
+    """Keep compiled templates in JINJA_BYTECODE_CACHE_DIR so that a new worker does not recompile them.
+
+    Only the environment options are set here, Flask still creates the environment on first use."""
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if directory:
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=TemplateBytecodeCache(directory))
+
+
+def precompile_templates(app):
+    """Compile every template into the bytecode cache, return their names."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
@@ -0,0 +1,112 @@
+import atexit
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from .bulk import bulk_create
+from .models import commit_item_changes
+from . import db
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Queue of validated items written by a background thread in group-committed batches.
+
+    A batch is flushed when it holds batch_size items or when flush_interval seconds passed since
+    its first item, whichever comes first. Every batch is one INSERT and one commit."""
+
+    def __init__(self, app, max_size=10000, batch_size=500, flush_interval=0.05, max_statuses=100000):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_statuses = max_statuses
+        self._queue = queue.Queue(maxsize=max_size)
+        self._statuses = OrderedDict()  # token -> {"status": ..., "id": ...}, oldest first
+        self._lock = threading.Lock()
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def submit(self, row, timeout=0.1):
+        """Queue one validated row and return its token, or raise queue.Full when the queue stays full."""
+        if self.closed:
+            raise queue.Full
+        token = uuid.uuid4().hex
+        self._set_status(token, {"status": "pending"})
+        try:
+            self._queue.put((token, row), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                del self._statuses[token]
+            raise
+        return token
+
+    def status(self, token):
+        with self._lock:
+            return self._statuses.get(token)
+
+    def wait(self):
+        """Block until every queued item has been written."""
+        self._queue.join()
+
+    def close(self, timeout=30):
+        """Stop accepting items, write everything still queued and stop the writer thread."""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _set_status(self, token, status):
+        with self._lock:
+            self._statuses[token] = status
+            while len(self._statuses) > self.max_statuses:
+                self._statuses.popitem(last=False)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                self._queue.task_done()
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _flush(self, batch):
+        with self.app.app_context():
+            try:
+                ids = bulk_create([row for token, row in batch])
+                commit_item_changes('create', ids)
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.exception("Write-behind flush of %d items failed", len(batch))
+                for token, row in batch:
+                    self._set_status(token, {"status": "failed", "error": str(e)})
+                return
+        for (token, row), id in zip(batch, ids):
+            self._set_status(token, {"status": "created", "id": id})
+
+
+def init_write_behind(app):
+    """Start the write-behind queue for POST /items and drain it when the process exits."""
+    writer = WriteBehindQueue(app, app.config['WRITE_BEHIND_MAX_QUEUE'], app.config['WRITE_BEHIND_BATCH_SIZE'],
+                              app.config['WRITE_BEHIND_FLUSH_INTERVAL'])
+    app.extensions['write_behind'] = writer
+    atexit.register(writer.close)
+    return writer
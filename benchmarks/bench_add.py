@@ -0,0 +1,56 @@
+"""Pairs per second: /add/<a>/<b> one pair per request vs POST /add/batch, with and without NumPy."""
+import json
+import random
+import time
+import pytest
+from app import arithmetic
+from .harness import measure
+
+BATCH = 1000000
+
+
+def _pairs_per_second(result, pairs_per_call=1):
+    result["pairs_per_second"] = round(result["rps"] * pairs_per_call)
+    return result
+
+
+@pytest.mark.parametrize('pairs', ['distinct', 'hot'])
+def test_single_pair_route(client, pairs, bench_requests, record):
+    """The existing route; 'hot' repeats 16 pairs so that they come from the memo."""
+    spread = 16 if pairs == 'hot' else 10 ** 9
+    record(_pairs_per_second(measure(lambda i: client.get(f'/add/{i % spread}/{i * 7 % spread}'),
+                                     bench_requests * 5, warmup=50)))
+
+
+@pytest.fixture(params=['numpy', 'pure-python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(arithmetic, 'numpy', None)
+    return request.param
+
+
+@pytest.mark.parametrize('body', ['json', 'binary'])
+def test_batch_route(client, backend, body, record):
+    rng = random.Random(0)
+    a = [rng.randrange(-2 ** 62, 2 ** 62) for _ in range(BATCH)]
+    b = [rng.randrange(-2 ** 62, 2 ** 62) for _ in range(BATCH)]
+    if body == 'json':
+        data, content_type = json.dumps({"a": a, "b": b}), 'application/json'
+    else:
+        from array import array
+        pairs = array('q', [0]) * (2 * BATCH)
+        pairs[0::2], pairs[1::2] = array('q', a), array('q', b)
+        data, content_type = pairs.tobytes(), 'application/octet-stream'
+
+    def call(i):
+        response = client.post('/add/batch', data=data, content_type=content_type)
+        return response.get_data()
+
+    start = time.perf_counter()
+    assert json.loads(call(0))["results"][:3] == [x + y for x, y in zip(a[:3], b[:3])]
+    first = time.perf_counter() - start
+    result = measure(call, 3, warmup=0)
+    result["first_call_ms"] = round(first * 1000, 1)
+    record(_pairs_per_second(result, BATCH))
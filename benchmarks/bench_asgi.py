@@ -0,0 +1,39 @@
+"""Sync (threaded WSGI) vs async (uvicorn + aiosqlite) serving of the item API at high concurrency.
+
+Both servers run in their own process against the same seeded database file.
+"""
+import pytest
+from app import create_app, db
+from app.schema import upgrade_schema
+from .harness import PYTHON, ServerProcess, measure_concurrent, seed_items
+
+SERVERS = {
+    'sync': [PYTHON, '-m', 'flask', '--app', "app:create_app('production')", 'run', '--port', '{port}',
+             '--with-threads', '--no-reload', '--no-debugger'],
+    'async': [PYTHON, '-m', 'uvicorn', 'asgi:app', '--port', '{port}', '--log-level', 'warning'],
+}
+
+
+@pytest.fixture
+def database_url(tmp_path, rows):
+    url = f"sqlite:///{tmp_path / 'bench.db'}"
+    app = create_app('production', {'SQLALCHEMY_DATABASE_URI': url})
+    with app.app_context():
+        upgrade_schema()
+        seed_items(rows)
+        db.engine.dispose()
+    return url
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+@pytest.mark.parametrize('clients', [16, 64])
+def test_get_item_concurrency(mode, clients, database_url, rows, bench_requests, record):
+    if mode == 'async':
+        pytest.importorskip('uvicorn')
+        pytest.importorskip('aiosqlite')
+    requests_per_client = max(bench_requests // clients, 10)
+    with ServerProcess(SERVERS[mode], env={'DATABASE_URL': database_url}) as server:
+        result = measure_concurrent(server.port, lambda n, i: f'/items/{(n * 1009 + i * 7919) % rows + 1}',
+                                    clients, requests_per_client)
+    assert result["errors"] == 0
+    record(result)
@@ -0,0 +1,22 @@
+"""What a downstream poll costs after a few writes: the whole table (GET /items?stream=ndjson) vs the deltas
+(GET /items/changes?since=<last seq>)."""
+import pytest
+from app import db
+from app.changes import last_seq
+from .harness import measure
+
+WRITES = 10
+
+
+@pytest.mark.parametrize('poll', ['full-table', 'changes'])
+def test_poll_after_writes(file_app, rows, poll, record):
+    client = file_app.test_client()
+    with file_app.app_context(), db.engine.connect() as connection:
+        since = last_seq(connection)  # the consumer is up to date
+    for i in range(WRITES):
+        client.put(f'/items/{i * 7 % rows + 1}', json={'description': f'changed {i}'})
+    path = '/items?stream=ndjson' if poll == 'full-table' else f'/items/changes?since={since}'
+    body = client.get(path).get_data()
+    result = measure(lambda i: client.get(path).get_data(), 50, warmup=3)
+    result["bytes_per_poll"] = len(body)
+    record(result, f'test_poll_after_writes[{poll}-{rows}rows]')
@@ -0,0 +1,45 @@
+"""CPU time vs bytes saved when compressing a 10k-item list response, per encoding and level."""
+import pytest
+from app import create_app, db
+from app.compression import BrotliEncoder, GzipEncoder, ZstdEncoder, brotli, zstandard
+from .harness import measure, seed_items
+
+ROWS = 10000
+CASES = [('gzip', GzipEncoder, level) for level in (1, 6, 9)]
+CASES += [('br', BrotliEncoder, level) for level in (1, 4, 9)] if brotli else []
+CASES += [('zstd', ZstdEncoder, level) for level in (1, 3, 9)] if zstandard else []
+
+
+@pytest.fixture(scope='module')
+def body():
+    app = create_app('testing', {'ITEMS_MAX_PAGE_SIZE': ROWS, 'COMPRESS_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        seed_items(ROWS)
+        yield app.test_client().get(f'/items?limit={ROWS}').get_data()
+        db.drop_all()
+
+
+@pytest.mark.parametrize('name, encoder_class, level', CASES, ids=[f'{n}-{lvl}' for n, _, lvl in CASES])
+def test_compress_list(body, name, encoder_class, level, record):
+    encoder = encoder_class(level)
+    result = measure(lambda i: encoder.compress(body), 20, warmup=2)
+    compressed = len(encoder.compress(body))
+    result.update(bytes_in=len(body), bytes_out=compressed, ratio=round(len(body) / compressed, 2))
+    record(result)
+
+
+@pytest.mark.parametrize('name, encoder_class, level', CASES, ids=[f'{n}-{lvl}' for n, _, lvl in CASES])
+def test_compress_list_streamed(body, name, encoder_class, level, record):
+    """The same body compressed in 64 kB chunks, each followed by a flush, as streamed responses are."""
+    encoder = encoder_class(level)
+    chunks = [body[i:i + 65536] for i in range(0, len(body), 65536)]
+
+    def compress(i):
+        stream = encoder.stream()
+        return b''.join([stream.compress(chunk) for chunk in chunks]) + stream.finish()
+
+    result = measure(compress, 20, warmup=2)
+    compressed = len(compress(0))
+    result.update(bytes_in=len(body), bytes_out=compressed, ratio=round(len(body) / compressed, 2))
+    record(result)
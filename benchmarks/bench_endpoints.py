@@ -0,0 +1,66 @@
+"""Latency and throughput of the item API, /submit and /add, via the test client and a local server."""
+from .harness import LocalServer, measure, measure_concurrent
+
+
+def test_get_items_page(client, seeded, bench_requests, record):
+    result = measure(lambda i: client.get(f'/items?after={(i * 997) % seeded}&limit=100'), bench_requests)
+    record(result)
+
+
+def test_get_item(client, seeded, bench_requests, record):
+    result = measure(lambda i: client.get(f'/items/{(i * 7919) % seeded + 1}'), bench_requests)
+    record(result)
+
+
+def test_create_item(client, seeded, bench_requests, record):
+    result = measure(lambda i: client.post('/items', data={'name': f'new-{i}', 'description': 'bench'}),
+                     bench_requests)
+    record(result)
+
+
+def test_update_item(client, seeded, bench_requests, record):
+    result = measure(lambda i: client.put(f'/items/{i % seeded + 1}', json={'description': f'updated {i}'}),
+                     bench_requests)
+    record(result)
+
+
+def test_delete_item(client, seeded, bench_requests, record):
+    requests = min(bench_requests, seeded - 10)  # leave rows for the warmup calls
+    result = measure(lambda i: client.delete(f'/items/{seeded - i}'), requests)
+    record(result)
+
+
+def test_submit_validation(client, bench_requests, record):
+    result = measure(lambda i: client.post('/submit', data={'name': f'name {i}', 'description': 'bla'}),
+                     bench_requests)
+    record(result)
+
+
+def test_add(client, bench_requests, record):
+    result = measure(lambda i: client.get(f'/add/{i}/{i + 1}'), bench_requests)
+    record(result)
+
+
+def test_server_get_item(file_app, rows, bench_requests, bench_clients, record):
+    with LocalServer(file_app) as server:
+        result = measure_concurrent(server.port, lambda n, i: f'/items/{(n * 1009 + i * 7919) % rows + 1}',
+                                    bench_clients, bench_requests // bench_clients)
+    assert result["errors"] == 0
+    record(result)
+
+
+def test_server_get_items_page(file_app, rows, bench_requests, bench_clients, record):
+    with LocalServer(file_app) as server:
+        result = measure_concurrent(server.port, lambda n, i: f'/items?after={(n * 1009 + i * 997) % rows}&limit=100',
+                                    bench_clients, bench_requests // bench_clients)
+    assert result["errors"] == 0
+    record(result)
+
+
+def test_server_create_item(file_app, rows, bench_requests, bench_clients, record):
+    with LocalServer(file_app) as server:
+        result = measure_concurrent(server.port, lambda n, i: '/items', bench_clients, bench_requests // bench_clients,
+                                    method='POST', body_for=lambda n, i: f'name=c{n}-{i}&description=bench',
+                                    headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    assert result["errors"] == 0
+    record(result)
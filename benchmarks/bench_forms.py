@@ -0,0 +1,53 @@
+"""Validation of an item submission with CSRF on: ItemForm().validate_on_submit() vs the compiled fast path."""
+import re
+import pytest
+from flask import session
+from flask_wtf.csrf import generate_csrf
+from app import create_app, db
+from app.forms import ItemForm, validate_item_request
+from .harness import measure
+
+VALID = {'name': 'John', 'description': 'bla'}
+INVALID = {'name': '', 'description': 'x' * 201}
+
+
+@pytest.fixture
+def csrf_app():
+    app = create_app('testing', {'WTF_CSRF_ENABLED': True})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.drop_all()
+
+
+def _validate_form():
+    form = ItemForm()
+    form.validate_on_submit()
+    return form.errors
+
+
+@pytest.mark.parametrize('path', ['form', 'fast'])
+@pytest.mark.parametrize('body', ['form-valid', 'form-invalid', 'json-valid'])
+def test_validate_submission(csrf_app, path, body, bench_requests, record):
+    """The validation alone, repeated within one request that carries a valid token (body parsed once)."""
+    with csrf_app.test_request_context('/submit', method='POST'):
+        token = generate_csrf()
+        session_token = dict(session)
+    data = dict(INVALID if body == 'form-invalid' else VALID, csrf_token=token)
+    kwargs = {'json': data} if body.startswith('json') else {'data': data}
+    validate = _validate_form if path == 'form' else (lambda: validate_item_request()[1])
+
+    with csrf_app.test_request_context('/submit', method='POST', **kwargs):
+        session.update(session_token)
+        assert bool(validate()) == (body == 'form-invalid')
+        record(measure(lambda i: validate(), bench_requests * 20, warmup=100))
+
+
+def test_submit_endpoint(csrf_app, bench_requests, record):
+    """POST /submit through the test client, as a browser would send it."""
+    client = csrf_app.test_client()
+    page = client.get('/submit').data.decode('utf-8')
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+    data = dict(VALID, csrf_token=token)
+    assert client.post('/submit', data=data).status_code == 200
+    record(measure(lambda i: client.post('/submit', data=data), bench_requests * 5, warmup=50))
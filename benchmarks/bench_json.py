@@ -0,0 +1,44 @@
+"""Serialization of a 10k-item list response: ORM objects + dicts + stdlib vs item rows, stdlib vs orjson."""
+import pytest
+from flask import jsonify
+from app import create_app, db
+from app.models import Item
+from app.pagination import item_rows
+from .harness import measure, seed_items
+
+ROWS = 10000
+
+
+@pytest.fixture(params=['stdlib', 'orjson'])
+def json_app(request):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    app = create_app('testing', {'JSON_BACKEND': request.param, 'CACHE_TYPE': 'null', 'ITEMS_MAX_PAGE_SIZE': ROWS})
+    with app.app_context():
+        db.create_all()
+        seed_items(ROWS)
+        yield app
+        db.drop_all()
+
+
+def test_list_orm_dicts_jsonify(json_app, record):
+    """The former get_items path: ORM objects, one dict per item, jsonify."""
+    def call(i):
+        items = Item.query.limit(ROWS).all()
+        jsonify([{"id": x.id, "name": x.name, "description": x.description} for x in items]).get_data()
+
+    with json_app.test_request_context():
+        record(measure(call, 20, warmup=2))
+
+
+def test_list_rows_items_json(json_app, record):
+    """Column tuples straight into the provider's items_json."""
+    def call(i):
+        json_app.json.items_json(db.session.execute(item_rows(0, ROWS)).all())
+
+    record(measure(call, 20, warmup=2))
+
+
+def test_list_endpoint(json_app, record):
+    client = json_app.test_client()
+    record(measure(lambda i: client.get(f'/items?limit={ROWS}'), 20, warmup=2))
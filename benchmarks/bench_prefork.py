@@ -0,0 +1,42 @@
+"""Read-heavy /items traffic against `flask serve` with 1 worker vs one worker per core (pre-fork, gunicorn).
+
+Near-linear scaling shows as 'scaling' close to the number of workers; it cannot exceed the cores of the machine.
+"""
+import pytest
+from app import create_app, db
+from app.prefork import default_workers
+from app.schema import upgrade_schema
+from .harness import PYTHON, ServerProcess, measure_concurrent, seed_items
+
+PAGE = 20
+_single = {}
+
+
+@pytest.fixture
+def database_url(tmp_path, rows):
+    url = f"sqlite:///{tmp_path / 'bench.db'}"
+    app = create_app('production', {'SQLALCHEMY_DATABASE_URI': url})
+    with app.app_context():
+        upgrade_schema()
+        seed_items(rows)
+        db.engine.dispose()
+    return url
+
+
+@pytest.mark.parametrize('workers', [1, max(default_workers(), 2)])
+def test_items_read_scaling(workers, database_url, rows, bench_requests, record):
+    pytest.importorskip('gunicorn')
+    clients = 8 * workers
+    command = [PYTHON, '-m', 'flask', '--app', "app:create_app('production')", 'serve',
+               '--bind', '127.0.0.1:{port}', '--workers', str(workers)]
+    pages = max(rows // PAGE, 1)
+    with ServerProcess(command, env={'DATABASE_URL': database_url}) as server:
+        result = measure_concurrent(server.port, lambda n, i: f'/items?after={(n * 31 + i) % pages * PAGE}&limit={PAGE}',
+                                    clients, max(bench_requests * workers // clients, 10))
+    assert result["errors"] == 0
+    result["workers"] = workers
+    if workers == 1:
+        _single[rows] = result["rps"]
+    elif rows in _single:
+        result["scaling"] = round(result["rps"] / _single[rows], 2)
+    record(result)
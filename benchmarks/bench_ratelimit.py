@@ -0,0 +1,28 @@
+"""Cost of the rate limiter: one bucket check, and a whole request with the limiter on and off."""
+import pytest
+from app import create_app
+from app.cache import FakeRedis
+from app.ratelimit import MemoryBucketStore, SharedBucketStore
+from .harness import measure
+
+CLIENTS = 10000  # distinct client keys cycled through, so that the store holds many buckets
+
+
+@pytest.mark.parametrize('store_class', [MemoryBucketStore, SharedBucketStore])
+def test_bucket_check(store_class, bench_requests, record):
+    store = store_class() if store_class is MemoryBucketStore else store_class(FakeRedis())
+    record(measure(lambda i: store.take(f'items:ip:10.0.{i % CLIENTS // 256}.{i % 256}', 1000, 2000),
+                   bench_requests * 10, warmup=100))
+
+
+@pytest.mark.parametrize('limits', ['off', 'rate', 'rate+cap'])
+def test_request_overhead(limits, bench_requests, record):
+    """GET / (no database work) through the test client, so the limiter is a visible share of the time."""
+    app = create_app('testing', {'RATELIMIT_ENABLED': limits != 'off', 'RATELIMIT_DEFAULT': (1e9, 1e9),
+                                 'MAX_CONCURRENT_REQUESTS': 64 if limits == 'rate+cap' else 0,
+                                 'METRICS_ENABLED': False})
+    client = app.test_client()
+    result = measure(lambda i: client.get('/', environ_base={'REMOTE_ADDR': f'10.0.0.{i % 256}'}),
+                     bench_requests * 5, warmup=50)
+    assert client.get('/').status_code == 200
+    record(result)
@@ -0,0 +1,76 @@
+"""Latency of GET /items/search (FTS5 and name index) against a LIKE full-table scan.
+
+Run from the project root:
+    python -m benchmarks.bench_search --rows 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from sqlalchemy import insert, text
+from app import create_app, db
+from app.models import Item
+from app.schema import upgrade_schema
+from app.search import search_items
+
+WORDS = ['red', 'green', 'blue', 'small', 'large', 'wooden', 'metal', 'chair', 'table', 'lamp', 'shelf',
+         'orange', 'apple', 'cable', 'phone', 'screen', 'paper', 'glass', 'bottle', 'garden']
+
+
+def seed(rows, batch=50000):
+    rng = random.Random(42)
+    for start in range(0, rows, batch):
+        values = [{"name": f"{rng.choice(WORDS)}-{start + i}",
+                   "description": ' '.join(rng.choice(WORDS) for _ in range(8)) + f" sku{start + i}"}
+                  for i in range(min(batch, rows - start))]
+        db.session.execute(insert(Item), values)
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    """Median and max wall time of fn() in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app('production', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(tmp, 'bench.db')}"})
+        with app.app_context():
+            upgrade_schema()
+            start = time.perf_counter()
+            seed(args.rows)
+            print(f"seeded {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+            needle = f"sku{args.rows // 2}"
+            cases = {
+                'fts substring (rare term)': lambda: search_items(needle, limit=20),
+                'LIKE scan (rare term)': lambda: db.session.execute(text(
+                    "SELECT id, name, description FROM item WHERE description LIKE :p LIMIT 20"),
+                    {'p': f'%{needle}%'}).all(),
+                'fts substring (common term)': lambda: search_items('garden', limit=20),
+                'LIKE scan (common term)': lambda: db.session.execute(text(
+                    "SELECT id, name, description FROM item WHERE description LIKE '%garden%' LIMIT 20")).all(),
+                'name prefix (index)': lambda: search_items(name_prefix='lamp-12', limit=20),
+                'name LIKE prefix (scan)': lambda: db.session.execute(text(
+                    "SELECT id, name, description FROM item WHERE name LIKE 'lamp-12%' LIMIT 20")).all(),
+            }
+            for label, fn in cases.items():
+                median, worst = timed(fn, args.repeat)
+                print(f"{label:28} median {median:8.2f} ms   max {worst:8.2f} ms")
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
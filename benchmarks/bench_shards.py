@@ -0,0 +1,44 @@
+"""Write throughput against `flask serve` with the items on 1 vs 4 SQLite shards.
+
+Every worker writes at once: with one shard they queue for its write lock, with several a new item
+waits only for the writers of its own shard. A bulk request of ids spread over every shard locks them
+all in turn, and every write still touches the primary once (change counter and change log).
+"""
+import json
+import pytest
+from app import create_app, db
+from app.prefork import default_workers
+from app.schema import upgrade_schema
+from .harness import PYTHON, ServerProcess, measure_concurrent
+
+BATCH = 100  # rows per bulk request
+
+
+def databases(tmp_path, shards):
+    primary = f"sqlite:///{tmp_path / 'primary.db'}"
+    uris = [f"sqlite:///{tmp_path / f'shard{n}.db'}" for n in range(shards)]
+    app = create_app('production', {'SQLALCHEMY_DATABASE_URI': primary, 'SHARD_DATABASE_URIS': uris})
+    with app.app_context():
+        upgrade_schema()
+        for engine in db.engines.values():
+            engine.dispose()
+    return {'DATABASE_URL': primary, 'SHARD_DATABASE_URLS': ','.join(uris)}
+
+
+@pytest.mark.parametrize('shards', [1, 4])
+@pytest.mark.parametrize('path', ['/items', '/items/bulk'])
+def test_write_scaling(path, shards, tmp_path, bench_requests, bench_clients, record):
+    pytest.importorskip('gunicorn')
+    workers = max(default_workers(), 4)
+    command = [PYTHON, '-m', 'flask', '--app', "app:create_app('production', {'WTF_CSRF_ENABLED': False})", 'serve',
+               '--bind', '127.0.0.1:{port}', '--workers', str(workers)]
+    rows = BATCH if path == '/items/bulk' else 1
+    items = [{"name": f"item-{i}", "description": f"benchmark item number {i}"} for i in range(rows)]
+    body = json.dumps(items if path == '/items/bulk' else items[0])
+    with ServerProcess(command, env=databases(tmp_path, shards)) as server:
+        result = measure_concurrent(server.port, lambda n, i: path, bench_clients,
+                                    max(bench_requests // bench_clients, 10), method='POST',
+                                    body_for=lambda n, i: body, headers={'Content-Type': 'application/json'})
+    assert result["errors"] == 0
+    result.update(shards=shards, workers=workers, rows_per_second=round(result["rps"] * rows))
+    record(result)
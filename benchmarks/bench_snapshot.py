@@ -0,0 +1,83 @@
+"""Item reads from the in-process snapshot vs SQL: memory per row, lookup latency and endpoint latency."""
+import gc
+import tracemalloc
+import pytest
+from sqlalchemy import select
+from app import create_app, db
+from app.models import Item
+from app.snapshot import ItemSnapshot
+from .harness import measure, seed_items
+
+
+@pytest.fixture
+def database_uri(tmp_path, rows):
+    uri = f"sqlite:///{tmp_path / 'bench.db'}"
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': uri})
+    with app.app_context():
+        db.create_all()
+        seed_items(rows)
+        db.engine.dispose()
+    return uri
+
+
+def _allocated(load):
+    """Bytes still allocated by what load() returns, once it is built."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = load()
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return allocated
+
+
+def test_load(database_uri, rows, record):
+    """Time to load the snapshot at startup, and its memory per row vs the ORM instances of the same rows."""
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': database_uri})
+    with app.app_context():
+        def load_snapshot():
+            snapshot = ItemSnapshot(app)
+            snapshot.load()
+            return snapshot
+
+        result = measure(lambda i: load_snapshot(), 3, warmup=1)
+        snapshot_bytes = _allocated(load_snapshot)
+        orm_bytes = _allocated(lambda: db.session.execute(select(Item)).scalars().all())
+        db.session.remove()
+        db.engine.dispose()
+    result.update(rows=rows, snapshot_bytes_per_row=round(snapshot_bytes / rows, 1),
+                  orm_bytes_per_row=round(orm_bytes / rows, 1))
+    record(result)
+
+
+@pytest.mark.parametrize('source', ['sql', 'snapshot'])
+def test_lookup(source, database_uri, rows, bench_requests, record):
+    """One item by id, without the HTTP layer: a primary key SELECT vs a bisection."""
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': database_uri, 'ITEM_SNAPSHOT_ENABLED': source == 'snapshot'})
+    with app.app_context():
+        if source == 'snapshot':
+            snapshot = app.extensions['item_snapshot']
+            lookup = lambda i: snapshot.get(i % rows + 1)
+        else:
+            query = select(Item.id, Item.name, Item.description, Item.version)
+            lookup = lambda i: db.session.execute(query.where(Item.id == i % rows + 1)).first()
+        assert lookup(0) is not None
+        record(measure(lookup, bench_requests * 20, warmup=100))
+        db.engine.dispose()
+
+
+@pytest.mark.parametrize('source', ['sql', 'cache', 'snapshot'])
+@pytest.mark.parametrize('path', ['item', 'page'])
+def test_endpoint(path, source, database_uri, rows, bench_requests, record):
+    """GET /items/<id> and GET /items through the test client: SQL, LRU cache (hits after the warm-up) or snapshot."""
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': database_uri, 'ITEM_SNAPSHOT_ENABLED': source == 'snapshot',
+                                 'CACHE_TYPE': 'null' if source == 'sql' else 'lru'})
+    client = app.test_client()
+    keys = min(rows, 500)
+    url = (lambda i: f'/items/{i % keys + 1}') if path == 'item' else (lambda i: f'/items?after={i % keys}&limit=20')
+    assert client.get(url(0)).status_code == 200
+    record(measure(lambda i: client.get(url(i)), bench_requests * 5, warmup=keys))
+    with app.app_context():
+        db.engine.dispose()
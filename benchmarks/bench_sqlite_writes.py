@@ -0,0 +1,66 @@
+"""Write throughput of POST /items with N concurrent writers: SQLite defaults, tuned pragmas, write-behind.
+
+Run from the project root:
+    python -m benchmarks.bench_sqlite_writes --writers 8 --items 200
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from app import create_app
+from app.schema import upgrade_schema
+
+
+def run(pragmas, writers, items_per_writer, write_behind=False):
+    """Return (writes per second, failed writes) for one configuration on a fresh database file."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app('production', {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            'SQLITE_PRAGMAS': pragmas,
+            'CACHE_TYPE': 'null',
+            'WTF_CSRF_ENABLED': False,
+            'WRITE_BEHIND_ENABLED': write_behind,
+        })
+        with app.app_context():
+            upgrade_schema()
+        failures = []
+
+        def writer(n):
+            client = app.test_client()
+            for i in range(items_per_writer):
+                response = client.post('/items', data={'name': f'w{n}-{i}', 'description': 'benchmark'})
+                if response.status_code not in (201, 202):
+                    failures.append(response.status_code)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if write_behind:
+            app.extensions['write_behind'].close()  # the rows must be on disk before the clock stops
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            from app import db
+            db.engine.dispose()
+        return (writers * items_per_writer - len(failures)) / elapsed, len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--items', type=int, default=200, help='items posted by each writer')
+    args = parser.parse_args()
+
+    from app.database import DEFAULT_SQLITE_PRAGMAS
+    cases = (('sqlite defaults', {}, False), ('tuned pragmas', DEFAULT_SQLITE_PRAGMAS, False),
+             ('write-behind', DEFAULT_SQLITE_PRAGMAS, True))
+    for label, pragmas, write_behind in cases:
+        rate, failures = run(pragmas, args.writers, args.items, write_behind)
+        print(f"{label:16} {args.writers} writers: {rate:8.0f} writes/s, {failures} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Cold start of a worker: import of the app package, create_app() and the first responses.
+
+Every run is a fresh interpreter so that nothing is already imported or compiled. The median must
+stay within --bench-startup-budget (seconds).
+"""
+import json
+import os
+import statistics
+import subprocess
+import time
+import pytest
+from app import create_app, db
+from .harness import PYTHON, summarize
+
+RUNS = 5
+
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app('production', {'SQLALCHEMY_DATABASE_URI': %r, 'JINJA_BYTECODE_CACHE_DIR': %r})
+created = time.perf_counter()
+client = app.test_client()
+assert client.get('/items?limit=10').status_code == 200
+assert client.get('/submit').status_code == 200
+first = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported, 'first_response': first - created}))
+"""
+
+
+@pytest.fixture
+def deployed(tmp_path):
+    """A database file and template cache as `flask init-db` leaves them."""
+    url = f"sqlite:///{tmp_path / 'bench.db'}"
+    cache_dir = str(tmp_path / 'jinja_cache')
+    app = create_app('production', {'SQLALCHEMY_DATABASE_URI': url, 'JINJA_BYTECODE_CACHE_DIR': cache_dir})
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['init-db']).exit_code == 0
+    with app.app_context():
+        db.engine.dispose()
+    return url, cache_dir
+
+
+def test_cold_start(deployed, pytestconfig, record):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    phases = []
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        output = subprocess.run([PYTHON, '-c', STARTUP_SCRIPT % deployed], cwd=root, capture_output=True,
+                                text=True, check=True).stdout
+        phases.append(json.loads(output))
+    elapsed = time.perf_counter() - start
+
+    result = summarize([sum(p.values()) for p in phases], elapsed)
+    for phase in phases[0]:
+        result[f"{phase}_ms"] = round(statistics.median(p[phase] for p in phases) * 1000, 3)
+    record(result)
+    budget = pytestconfig.getoption('--bench-startup-budget')
+    assert result["p50_ms"] <= budget * 1000, f"cold start {result['p50_ms']} ms is over the {budget} s budget"
+
+
+def test_create_app(record):
+    """create_app() in a process that already built one, as in the test suite."""
+    create_app('testing')
+    durations = []
+    start = time.perf_counter()
+    for _ in range(50):
+        t = time.perf_counter()
+        create_app('testing')
+        durations.append(time.perf_counter() - t)
+    record(summarize(durations, time.perf_counter() - start))
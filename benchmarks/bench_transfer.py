@@ -0,0 +1,42 @@
+"""Throughput of the streaming export and import of the item table (target: over 100k rows/s on SQLite)."""
+import io
+import time
+from app import create_app, db
+from app.transfer import export_items, import_items
+from .harness import summarize
+
+REPEAT = 3
+
+
+def _dump(app, fmt):
+    with app.app_context():
+        return ''.join(export_items(fmt)).encode()
+
+
+def test_export(file_app, rows, record):
+    for fmt in ('ndjson', 'csv'):
+        samples = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            _dump(file_app, fmt)
+            samples.append(time.perf_counter() - start)
+        result = summarize(samples, sum(samples))
+        result["rows_per_second"] = round(rows / min(samples))
+        record(result, f'test_export[{fmt}-{rows}rows]')
+
+
+def test_import(file_app, rows, tmp_path, record):
+    for fmt in ('ndjson', 'csv'):
+        dump = _dump(file_app, fmt)
+        samples = []
+        for n in range(REPEAT):
+            app = create_app('production', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / f'{fmt}{n}.db'}"})
+            with app.app_context():
+                db.create_all()
+                start = time.perf_counter()
+                assert import_items(io.BytesIO(dump), fmt) == rows
+                samples.append(time.perf_counter() - start)
+                db.engine.dispose()
+        result = summarize(samples, sum(samples))
+        result["rows_per_second"] = round(rows / min(samples))
+        record(result, f'test_import[{fmt}-{rows}rows]')
@@ -0,0 +1,94 @@
+"""Benchmark suite, run on demand:
+
+    pytest benchmarks/ --bench-rows 1000,100000 --bench-output results.json --bench-baseline baseline.json
+"""
+import os
+import pytest
+from app import create_app, db
+from tests.conftest import app, client  # noqa: F401  (the create_app('testing') fixtures)
+from .harness import compare, load_results, save_results, seed_items
+
+_results = {}
+os.environ.setdefault('QUERY_PROFILER', '0')  # on by default in testing mode, it would skew the timings
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench-rows', default='1000', help="comma separated table sizes, e.g. 1000,100000,1000000")
+    group.addoption('--bench-requests', type=int, default=300, help="requests per measurement")
+    group.addoption('--bench-clients', type=int, default=8, help="concurrent clients against the local server")
+    group.addoption('--bench-output', default=None, help="write the results to this JSON file")
+    group.addoption('--bench-baseline', default=None, help="JSON results to compare against")
+    group.addoption('--bench-startup-budget', type=float, default=1.5,
+                    help="seconds allowed for import, create_app() and the first responses of a new worker")
+    group.addoption('--bench-tolerance', type=float, default=0.25, help="allowed slowdown before flagging")
+
+
+def pytest_collect_file(file_path, parent):
+    # Benchmark modules are named bench_*.py so that a plain test run never picks them up
+    if (file_path.name.startswith('bench_') and file_path.suffix == '.py'
+            and not parent.session.isinitpath(file_path)):  # files named on the command line are collected anyway
+        return pytest.Module.from_parent(parent, path=file_path)
+
+
+def pytest_generate_tests(metafunc):
+    if 'rows' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('--bench-rows').split(',')]
+        metafunc.parametrize('rows', sizes, ids=[f'{size}rows' for size in sizes])
+
+
+@pytest.fixture
+def bench_requests(pytestconfig):
+    return pytestconfig.getoption('--bench-requests')
+
+
+@pytest.fixture
+def bench_clients(pytestconfig):
+    return pytestconfig.getoption('--bench-clients')
+
+
+@pytest.fixture
+def seeded(app, rows):
+    """The testing app with rows items in its database."""
+    seed_items(rows)
+    return rows
+
+
+@pytest.fixture
+def file_app(tmp_path, rows):
+    """A testing app on a database file, safe to share between server threads, seeded with rows items."""
+    file_app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'bench.db'}"})
+    with file_app.app_context():
+        db.create_all()
+        seed_items(rows)
+        yield file_app
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def record(request):
+    """Store one benchmark result under the test's id."""
+    def record(result, name=None):
+        _results[name or request.node.name] = result
+        print(f"\n{name or request.node.name}: {result}")
+    return record
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    if not _results:
+        return
+    if config.getoption('--bench-output'):
+        save_results(config.getoption('--bench-output'), _results)
+    if config.getoption('--bench-baseline'):
+        regressions = compare(_results, load_results(config.getoption('--bench-baseline')),
+                              config.getoption('--bench-tolerance'))
+        reporter = config.pluginmanager.get_plugin('terminalreporter')
+        if regressions:
+            reporter.write_line("Benchmark regressions:", red=True)
+            for line in regressions:
+                reporter.write_line(f"  {line}", red=True)
+            session.exitstatus = 1
+        else:
+            reporter.write_line("No benchmark regressions against the baseline.", green=True)
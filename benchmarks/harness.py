@@ -0,0 +1,166 @@
+"""Helpers of the benchmark suite: seeding, timing, a local WSGI server and baseline comparison."""
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from sqlalchemy import insert
+from werkzeug.serving import make_server
+from app import db
+from app.models import Item
+
+
+def seed_items(rows, batch=50000):
+    """Insert rows generated items with executemany batches (inside an app context)."""
+    for start in range(0, rows, batch):
+        values = [{"name": f"item-{i}", "description": f"benchmark item number {i}"}
+                  for i in range(start, min(start + batch, rows))]
+        db.session.execute(insert(Item), values)
+    db.session.commit()
+
+
+def summarize(samples, elapsed):
+    """Latency percentiles (ms) and throughput of a list of per-request durations in seconds."""
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "requests": len(ordered),
+        "p50_ms": round(percentile(50), 3),
+        "p90_ms": round(percentile(90), 3),
+        "p99_ms": round(percentile(99), 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "rps": round(len(ordered) / elapsed, 1),
+    }
+
+
+def measure(call, requests, warmup=10):
+    """Call call(i) requests times in a row and summarize the latencies."""
+    for i in range(warmup):
+        call(i)
+    samples = []
+    start = time.perf_counter()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        call(i)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - start)
+
+
+class LocalServer:
+    """The app served by a threaded werkzeug server on a free local port, in a background thread."""
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+
+class ServerProcess:
+    """A server command (e.g. uvicorn) run in a subprocess, from the project root, on a free port.
+
+    The command is a list where '{port}' is replaced by the chosen port."""
+
+    def __init__(self, command, env=None, startup_timeout=20):
+        self.port = free_port()
+        self.command = [part.replace('{port}', str(self.port)) for part in command]
+        self.env = dict(os.environ, **(env or {}))
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    def __enter__(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(self.command, cwd=root, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.2).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.process.kill()
+        raise RuntimeError(f"{self.command} did not start listening on port {self.port}")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(10)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+PYTHON = sys.executable
+
+
+def measure_concurrent(port, path_for, clients, requests_per_client, method='GET', body_for=None, headers=None):
+    """Run clients threads, each sending requests over one keep-alive connection, and summarize."""
+    samples, errors, lock = [], [], threading.Lock()
+
+    def client(n):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        local = []
+        for i in range(requests_per_client):
+            body = body_for(n, i) if body_for else None
+            t0 = time.perf_counter()
+            conn.request(method, path_for(n, i), body=body, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+            local.append(time.perf_counter() - t0)
+            if response.status >= 400:
+                errors.append(response.status)
+        conn.close()
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = summarize(samples, time.perf_counter() - start)
+    result["errors"] = len(errors)
+    result["clients"] = clients
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """List the benchmarks whose p50 latency grew, or throughput dropped, by more than tolerance."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if result["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {old['p50_ms']} ms -> {result['p50_ms']} ms")
+        if result["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {old['rps']} req/s -> {result['rps']} req/s")
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump({"created": time.strftime('%Y-%m-%dT%H:%M:%S'), "results": results}, f, indent=2, sort_keys=True)
@@ -1,5 +1,8 @@
 from app import create_app
+from app.schema import upgrade_schema
 
 if __name__ == "__main__":
     app = create_app()
+    with app.app_context():
+        upgrade_schema()  # deployments run `flask --app app init-db` instead
     app.run(debug=True)
\ No newline at end of file
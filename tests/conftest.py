@@ -46,3 +46,24 @@ def init_database(app):
         db.session.rollback()
 
 
+
+
+@pytest.fixture
+def query_budget(request, app):
+    """assert on the SQL statements per request of each endpoint, from @pytest.mark.query_budget(get_item=1)
+    or query_budget(get_item=1) in the test; a request over its budget or with an N+1 pattern fails the test"""
+    profiler = app.extensions['query_profiler']
+    profiler.clear()
+    budgets = {}
+    for marker in request.node.iter_markers('query_budget'):
+        budgets.update(marker.kwargs)
+    yield budgets.update
+    violations = profiler.budget_violations(budgets)
+    assert not violations, '\n'.join(violations)
+
+
+@pytest.fixture(autouse=True)
+def query_budget_marker(request):
+    """the query_budget marker alone is enough, the fixture does not have to be named too"""
+    if request.node.get_closest_marker('query_budget'):
+        request.getfixturevalue('query_budget')
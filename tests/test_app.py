@@ -1,5 +1,11 @@
+import gzip
+import io
 import json
+import re
+import zlib
+import pytest
 from app import create_app
+from app.cache import LRUCache, FakeRedis
 from app.utils import get_home_message, add_numbers ## import the helper function
 
 
@@ -348,8 +354,1208 @@ def test_config_mode_production_testing(client2, client): #set up of the app for
     assert data["debug_mode"] == True
 
 
+""" test keyset pagination of items with limit/after and next cursor links"""
+def test_get_items_pagination(client, init_database):
+    """ test keyset pagination of items with limit/after and next cursor links"""
+    response = client.get('/items?limit=1')
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data == [{"id": 1, "name": "John", "description": "bla"}] #only first page
+    assert response.headers["X-Next-Cursor"] == "1"
+    assert 'after=1' in response.headers["Link"] and 'rel="next"' in response.headers["Link"]
+
+    response = client.get('/items?limit=1&after=1')
+    data = response.get_json()
+    assert data == [{"id": 2, "name": "Jane", "description": "bla2"}]
+    assert "Link" not in response.headers #last page has no next link
+
+    response = client.get('/items?limit=abc')
+    assert response.status_code == 400
+    assert client.get(f'/items?after={2 ** 63 - 1}').get_json() == [] #the largest id is a valid cursor
+    assert client.get(f'/items?after={2 ** 63}').status_code == 400 #past the 64-bit ids, not an overflow
+    assert client.get(f'/items?after={2 ** 70}&stream=ndjson').status_code == 400
+
+
+""" test streaming all items as JSON array and NDJSON"""
+def test_get_items_streaming(client, init_database):
+    """ test streaming all items as JSON array and NDJSON"""
+    response = client.get('/items?stream=json')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert json.loads(response.data) == [{"id": 1, "name": "John", "description": "bla"},
+                                         {"id": 2, "name": "Jane", "description": "bla2"}]
+
+    response = client.get('/items?stream=ndjson&after=1')
+    assert response.content_type == 'application/x-ndjson'
+    lines = response.data.decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == [{"id": 2, "name": "Jane", "description": "bla2"}]
+
+    response = client.get('/items?stream=xml')
+    assert response.status_code == 400
+
+
+""" test bulk creating items from JSON array and NDJSON body"""
+def test_create_items_bulk(client):
+    """ test bulk creating items from JSON array and NDJSON body"""
+    rows = [{"name": "John", "description": "bla"}, {"name": "Jane", "description": "bla2"}]
+    response = client.post('/items/bulk', json=rows)
+    data = response.get_json()
+    assert response.status_code == 201
+    assert data == {"created": 2, "ids": [1, 2]}
+
+    body = '{"name": "Eric", "description": "bla3"}\n{"name": "Anna", "description": "bla4"}\n'
+    response = client.post('/items/bulk', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 201
+    assert response.get_json()["ids"] == [3, 4]
 
+    #invalid rows are reported per row and nothing is inserted
+    rows = [{"name": "Ok", "description": "fine"}, {"name": "", "description": "bla"}, {"name": 5, "description": "x"}]
+    response = client.post('/items/bulk', json=rows)
+    data = response.get_json()
+    assert response.status_code == 400
+    assert [e["index"] for e in data["errors"]] == [1, 2]
+    assert "name" in data["errors"][0]["errors"]
+    assert len(client.get('/items').get_json()) == 4
+
+
+""" test bulk updating and deleting items by list of ids"""
+def test_update_and_delete_items_bulk(client, init_database):
+    """ test bulk updating and deleting items by list of ids"""
+    response = client.put('/items/bulk', json={"ids": [1, 2, 3], "description": "same"})
+    assert response.status_code == 200
+    assert response.get_json() == {"updated": 2} #id 3 does not exist
+    assert [i["description"] for i in client.get('/items').get_json()] == ["same", "same"]
+
+    response = client.put('/items/bulk', json={"ids": [1], "name": "x" * 51})
+    assert response.status_code == 400
+
+    response = client.put('/items/bulk', json={"ids": "1"})
+    assert response.status_code == 400
+    for ids in ([2 ** 70], [0], [True]): #outside the id range, not an overflow in SQLite
+        assert client.put('/items/bulk', json={"ids": ids, "name": "x"}).status_code == 400
+        assert client.delete('/items/bulk', json={"ids": ids}).status_code == 400
+    client.application.config['ITEMS_BULK_MAX_ROWS'] = 2
+    response = client.delete('/items/bulk', json={"ids": [1, 2, 3]})
+    assert response.status_code == 400 and response.get_json()["error"] == "Too many ids, the limit is 2"
+
+    response = client.delete('/items/bulk', json={"ids": [1, 2]})
+    assert response.status_code == 200
+    assert response.get_json() == {"deleted": 2}
+    assert client.get('/items').get_json() == []
+
+
+""" test item reads are cached and invalidated by writes"""
+def test_item_cache_read_through_and_invalidation(client, init_database):
+    """ test item reads are cached and invalidated by writes"""
+    response = client.get('/items/1')
+    assert response.headers["X-Cache"] == "MISS"
+    response = client.get('/items/1')
+    assert response.headers["X-Cache"] == "HIT" #second read served from cache
+    assert response.get_json() == {"id": 1, "name": "John", "description": "bla"}
 
+    client.get('/items')
+    assert client.get('/items').headers["X-Cache"] == "HIT"
 
+    client.put('/items/1', json={"name": "Eric"}) #update drops the cached item and list pages
+    response = client.get('/items/1')
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.get_json()["name"] == "Eric"
+    assert client.get('/items').get_json()[0]["name"] == "Eric"
+
+    client.post('/items', data={'name': 'Anna', 'description': 'bla3'})
+    assert len(client.get('/items').get_json()) == 3
+    client.delete('/items/2')
+    assert client.get('/items/2').status_code == 404
+
+    stats = client.get('/cache-stats').get_json()
+    assert stats["hits"] == 2
+    assert stats["backend"] == "LRUCache"
+
+
+""" test LRU eviction, TTL expiry and counters of the in-process cache"""
+def test_lru_cache_eviction_and_ttl():
+    """ test LRU eviction, TTL expiry and counters of the in-process cache"""
+    now = [0]
+    cache = LRUCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1 #'a' becomes most recently used
+    cache.set('c', 3) #evicts 'b'
+    assert cache.get('b') is None
+    now[0] = 11 #everything expired
+    assert cache.get('a') is None
+    assert cache.stats.as_dict() == {"hits": 1, "misses": 2, "evictions": 2}
+
+
+""" test a compressed variant is only added to the entry it was made from, which keeps its expiry"""
+def test_item_cache_add_variant():
+    """ test a compressed variant is only added to the entry it was made from, which keeps its expiry"""
+    from app.cache import ItemCache, SharedCache
+    now = [0]
+    for backend in (LRUCache(ttl=60, clock=lambda: now[0]), SharedCache(FakeRedis(clock=lambda: now[0]), ttl=60)):
+        now[0] = 0
+        cache = ItemCache(backend)
+        entry = cache.set('item:1', b'{"id": 1}')
+        now[0] = 50
+        cache.add_variant('item:1', entry, 'gzip', b'gz')
+        assert cache.get('item:1')[2] == {'gzip': b'gz'}
+        now[0] = 61 #the variant did not restart the TTL
+        assert cache.get('item:1') is None
+
+        entry = cache.set('item:1', b'{"id": 1}')
+        cache.invalidate(None, 'update', [1]) #a write between the response and its compression
+        cache.add_variant('item:1', entry, 'gzip', b'gz')
+        assert cache.get('item:1') is None #not brought back
+        newer = cache.set('item:1', b'{"id": 1, "v": 2}')
+        cache.add_variant('item:1', entry, 'gzip', b'gz')
+        assert cache.get('item:1') == newer #an older entry's variant does not replace the newer entry
+
+
+""" test an lru cache drops what another process wrote, from the change log"""
+def test_item_cache_follows_change_log(tmp_path):
+    """ test an lru cache drops what another process wrote, from the change log"""
+    import time
+    from app import db
+    config = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}", 'CACHE_TYPE': 'lru',
+              'CACHE_POLL_INTERVAL': 0.05}
+    reader, writer = create_app('testing', config), create_app('testing', config) #two workers on one database
+    with reader.app_context():
+        db.create_all()
+    client = reader.test_client()
+    writer.test_client().post('/items', data={'name': 'Jane', 'description': 'hello'})
+    client.get('/items/1')
+    client.get('/items')
+    assert client.get('/items/1').headers['X-Cache'] == 'HIT'
+
+    writer.test_client().put('/items/1', json={"name": "Eric"})
+    with reader.app_context():
+        reader.extensions['item_cache'].follower.catch_up()
+    response = client.get('/items/1')
+    assert response.headers['X-Cache'] == 'MISS' and response.get_json()["name"] == "Eric"
+    assert client.get('/items').get_json()[0]["name"] == "Eric"
+
+    writer.test_client().delete('/items/1') #the poll thread catches up by itself
+    deadline = time.monotonic() + 5
+    while client.get('/items/1').status_code != 404 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert client.get('/items/1').status_code == 404
+    assert create_app('testing').extensions['item_cache'].follower is None #no other process sees :memory:
+    with reader.app_context():
+        db.drop_all()
+        db.engine.dispose()
+    with writer.app_context():
+        db.engine.dispose()
+
+
+""" test a GET that read an item before a write does not cache it after the write's invalidation"""
+def test_item_cache_write_between_read_and_store(tmp_path):
+    """ test a GET that read an item before a write does not cache it after the write's invalidation"""
+    from app import db
+    redis = FakeRedis()
+    config = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}", 'CACHE_TYPE': 'shared',
+              'CACHE_CLIENT': redis}
+    reader, writer = create_app('testing', config), create_app('testing', config) #two workers, one Redis
+    with reader.app_context():
+        db.create_all()
+    writer.test_client().post('/items', data={'name': 'Jane', 'description': 'hello'})
+    backend = reader.extensions['item_cache'].backend
+    store = backend.set
+
+    def write_then_store(key, value):
+        backend.set = store
+        writer.test_client().put('/items/1', json={"name": "Eric"}) #committed and invalidated in between
+        store(key, value)
+
+    backend.set = write_then_store
+    client = reader.test_client()
+    assert client.get('/items/1').get_json()["name"] == "Jane" #what the query read before the write
+    response = client.get('/items/1')
+    assert response.headers["X-Cache"] == "MISS" and response.get_json()["name"] == "Eric"
+    assert response.headers["ETag"] == '"item-1-v2"'
+    assert client.get('/items/1').headers["X-Cache"] == "HIT"
+    with reader.app_context():
+        db.drop_all()
+        db.engine.dispose()
+    with writer.app_context():
+        db.engine.dispose()
+
+
+""" test the shared cache backend with the local fake Redis client"""
+def test_shared_cache_backend():
+    """ test the shared cache backend with the local fake Redis client"""
+    app = create_app('testing', {'CACHE_TYPE': 'shared', 'CACHE_CLIENT': FakeRedis()})
+    with app.app_context():
+        from app import db
+        db.create_all()
+        client = app.test_client()
+        client.post('/items', data={'name': 'Jane', 'description': 'hello'})
+        assert client.get('/items/1').headers["X-Cache"] == "MISS"
+        assert client.get('/items/1').headers["X-Cache"] == "HIT"
+        client.put('/items/1', json={"description": "new"})
+        assert client.get('/items/1').get_json()["description"] == "new"
+        assert client.get('/cache-stats').get_json()["backend"] == "SharedCache"
+        db.drop_all()
+
+
+""" test ETag and If-None-Match conditional GET on one item"""
+def test_item_etag_conditional_get(client, init_database):
+    """ test ETag and If-None-Match conditional GET on one item"""
+    response = client.get('/items/1')
+    etag = response.headers["ETag"]
+    assert etag == '"item-1-v1"'
 
+    response = client.get('/items/1', headers={"If-None-Match": etag})
+    assert response.status_code == 304 #not modified, no body
+    assert response.data == b""
 
+    client.put('/items/1', json={"name": "Eric"}) #update bumps the version
+    response = client.get('/items/1', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"item-1-v2"'
+
+
+""" test ETag of the item list follows the table change counter"""
+def test_items_list_etag(client, init_database):
+    """ test ETag of the item list follows the table change counter"""
+    etag = client.get('/items').headers["ETag"]
+    response = client.get('/items', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.post('/items', data={'name': 'Anna', 'description': 'bla3'})
+    response = client.get('/items', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 3
+    assert response.headers["ETag"] != etag
+
+
+""" test If-Match optimistic concurrency on PUT and DELETE"""
+def test_if_match_on_put_and_delete(client, init_database):
+    """ test If-Match optimistic concurrency on PUT and DELETE"""
+    response = client.put('/items/1', json={"name": "Eric"}, headers={"If-Match": '"item-1-v1"'})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"item-1-v2"'
+
+    response = client.put('/items/1', json={"name": "Anna"}, headers={"If-Match": '"item-1-v1"'}) #stale version
+    assert response.status_code == 412
+    assert client.get('/items/1').get_json()["name"] == "Eric"
+
+    response = client.delete('/items/1', headers={"If-Match": '"item-1-v1"'})
+    assert response.status_code == 412
+    response = client.delete('/items/1', headers={"If-Match": '"item-1-v2"'})
+    assert response.status_code == 200
+
+
+""" test the database URI from environment, SQLite pragmas and pool options"""
+def test_database_configuration(tmp_path, monkeypatch):
+    """ test the database URI from environment, SQLite pragmas and pool options"""
+    from app import db
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'env.db'}")
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    app = create_app('production')
+    with app.app_context():
+        assert app.config['SQLALCHEMY_DATABASE_URI'].endswith('env.db') #URI read from environment
+        assert db.engine.pool.size() == 3
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1 #NORMAL
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        db.engine.dispose()
+
+
+""" test search on description (substring and prefix) and name filters"""
+def test_search_items(client):
+    """ test search on description (substring and prefix) and name filters"""
+    rows = [{"name": "Apple", "description": "red fruit from a tree"},
+            {"name": "Apricot", "description": "orange fruit"},
+            {"name": "Banana", "description": "long yellow fruit"},
+            {"name": "Carrot", "description": "orange vegetable"}]
+    client.post('/items/bulk', json=rows)
+
+    response = client.get('/items/search?q=orange')
+    assert response.status_code == 200
+    assert sorted(i["name"] for i in response.get_json()) == ["Apricot", "Carrot"]
+
+    response = client.get('/items/search?q=ruit') #substring inside a word
+    assert len(response.get_json()) == 3
+
+    response = client.get('/items/search?q=orange&mode=prefix&name_prefix=Ap')
+    assert [i["name"] for i in response.get_json()] == ["Apricot"]
+
+    response = client.get('/items/search?name=Banana')
+    assert response.get_json()[0]["id"] == 3
+
+    response = client.get('/items/search?q=fruit&limit=2') #paginated with next link
+    assert len(response.get_json()) == 2
+    assert "offset=2" in response.headers["Link"]
+    assert client.get(f'/items/search?q=fruit&offset={2 ** 62}').get_json() == []
+    assert client.get(f'/items/search?q=fruit&offset={2 ** 70}').status_code == 400 #not an overflow in SQLite
+    assert client.get(f'/items/search?name=Banana&offset={2 ** 63 - 1}').status_code == 400
+    for q in ('a%00b', 'fruit%00', 'a%0Ab', 'ab%7F'): #control characters, a NUL broke the FTS5 query
+        response = client.get(f'/items/search?q={q}')
+        assert response.status_code == 400 and "control characters" in response.get_json()["error"]
+
+    client.put('/items/4', json={"description": "purple vegetable"}) #index follows updates
+    assert [i["name"] for i in client.get('/items/search?q=orange').get_json()] == ["Apricot"]
+    client.delete('/items/2')
+    assert client.get('/items/search?q=orange').get_json() == []
+
+    response = client.get('/items/search')
+    assert response.status_code == 400
+
+
+""" test write-behind mode queues items and writes them in a batch"""
+def test_write_behind_create_item():
+    """ test write-behind mode queues items and writes them in a batch"""
+    from app import db
+    app = create_app('testing', {'WRITE_BEHIND_ENABLED': True, 'WRITE_BEHIND_FLUSH_INTERVAL': 0.01})
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        response = client.post('/items', data={'name': 'Jane', 'description': 'hello'})
+        data = response.get_json()
+        assert response.status_code == 202 #accepted, written later
+        assert data["status"] == "pending"
+        assert response.headers["Location"] == data["status_url"]
+
+        writer = app.extensions['write_behind']
+        writer.wait() #wait for the background flush
+        data = client.get(data["status_url"]).get_json()
+        assert data["status"] == "created"
+        assert client.get(data["url"]).get_json() == {"id": 1, "name": "Jane", "description": "hello"}
+
+        assert client.get('/items/pending/unknown').status_code == 404
+        writer.close() #drains and stops the writer thread
+        response = client.post('/items', data={'name': 'Eric', 'description': 'late'})
+        assert response.status_code == 503 #closed queue applies backpressure
+        assert response.headers["Retry-After"] == "1"
+        db.drop_all()
+
+
+""" test /metrics reports requests, latency, sizes and SQL queries per endpoint"""
+def test_metrics_endpoint(client, init_database):
+    """ test /metrics reports requests, latency, sizes and SQL queries per endpoint"""
+    client.get('/items/1')
+    client.get('/items/1') #served from cache, no SQL
+    client.get('/items/3')
+    response = client.get('/metrics')
+    data = response.data.decode('utf-8')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert 'http_requests_total{endpoint="get_item",method="GET",status="200"} 2' in data
+    assert 'http_requests_total{endpoint="get_item",method="GET",status="404"} 1' in data
+    assert 'http_request_duration_seconds_count{endpoint="get_item"} 3' in data
+    assert 'http_response_size_bytes_bucket{endpoint="get_item",le="100"} 3' in data
+    assert 'db_queries_per_request_bucket{endpoint="get_item",le="0"} 1' in data #the cache hit
+    assert 'item_cache_hits_total 1' in data
+
+
+""" test requests over the threshold are logged with their queries"""
+def test_slow_request_log(caplog):
+    """ test requests over the threshold are logged with their queries"""
+    from app import db
+    app = create_app('testing', {'METRICS_SLOW_REQUEST_THRESHOLD': 0})
+    with app.app_context():
+        db.create_all()
+        app.test_client().get('/items')
+        assert "Slow request GET /items" in caplog.text
+        assert "FROM item" in caplog.text
+        db.drop_all()
+
+
+""" test the stdlib and orjson backends give the same item responses"""
+def test_json_backends():
+    """ test the stdlib and orjson backends give the same item responses"""
+    from app import db
+    bodies = []
+    for backend in ('stdlib', 'orjson'):
+        app = create_app('testing', {'JSON_BACKEND': backend})
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            client.post('/items/bulk', json=[{"name": "Jane", "description": "caf\u00e9 \"quoted\""},
+                                             {"name": "John", "description": "bla"}])
+            bodies.append(client.get('/items').get_json())
+            assert client.get('/items/1').get_json() == {"id": 1, "name": "Jane", "description": "caf\u00e9 \"quoted\""}
+            assert client.get('/items?stream=json').get_json() == bodies[-1]
+            big = 2 ** 70 #over 64 bits, orjson falls back to the stdlib
+            assert client.get(f'/add/{big}/1').get_json() == {"result": big + 1}
+            db.drop_all()
+    assert bodies[0] == bodies[1]
+
+
+""" test gzip compression of item lists, reuse of the cached compressed body and conditional GET"""
+def test_gzip_compression_and_cached_variant(client):
+    """ test gzip compression of item lists, reuse of the cached compressed body and conditional GET"""
+    client.post('/items/bulk', json=[{"name": f"n{i}", "description": "some description"} for i in range(50)])
+    response = client.get('/items', headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert len(json.loads(gzip.decompress(response.data))) == 50
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/') #compressed bytes get the weak form of the ETag
+
+    response = client.get('/items', headers={"Accept-Encoding": "gzip"}) #served precompressed from the cache
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(json.loads(gzip.decompress(response.data))) == 50
+
+    response = client.get('/items', headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get('/items') #identity for clients without Accept-Encoding
+    assert "Content-Encoding" not in response.headers
+    response = client.get('/items/1', headers={"Accept-Encoding": "gzip"}) #under COMPRESS_MIN_SIZE
+    assert "Content-Encoding" not in response.headers
+
+
+""" test streamed responses are compressed incrementally"""
+def test_streaming_compression(client):
+    """ test streamed responses are compressed incrementally"""
+    client.post('/items/bulk', json=[{"name": f"n{i}", "description": "bla"} for i in range(20)])
+    response = client.get('/items?stream=ndjson', headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    lines = zlib.decompress(response.data, 31).decode('utf-8').splitlines()
+    assert len(lines) == 20
+
+
+""" test brotli is preferred when the client accepts it"""
+def test_brotli_compression(client):
+    """ test brotli is preferred when the client accepts it"""
+    brotli = pytest.importorskip('brotli')
+    client.post('/items/bulk', json=[{"name": f"n{i}", "description": "some description"} for i in range(50)])
+    response = client.get('/items', headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert len(json.loads(brotli.decompress(response.data))) == 50
+
+
+def asgi_request(asgi_app, method, path, body=b'', headers=()):
+    """Send one HTTP request straight to an ASGI app and return (status, headers, body)."""
+    import asyncio
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'http_version': '1.1', 'scheme': 'http', 'server': ('localhost', 80), 'root_path': '',
+             'method': method, 'path': path, 'query_string': query.encode(),
+             'headers': [(k.lower().encode(), v.encode()) for k, v in headers]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    response_headers = {k.decode(): v.decode() for k, v in messages[0]['headers']}
+    return messages[0]['status'], response_headers, messages[1]['body']
+
+
+""" test the async item API serves the same CRUD as the Flask routes"""
+def test_asgi_item_api(tmp_path, monkeypatch):
+    """ test the async item API serves the same CRUD as the Flask routes"""
+    pytest.importorskip('aiosqlite')
+    pytest.importorskip('asgiref')
+    from app import db, models
+    from app.asgi import create_asgi_app
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'asgi.db'}"})
+    with app.app_context():
+        db.create_all()
+    asgi_app = create_asgi_app(app)
+    form = [('Content-Type', 'application/x-www-form-urlencoded')]
+    import threading
+    from app.signals import items_changed
+    receivers = []
+
+    def receiver(sender, op, ids):
+        receivers.append(threading.current_thread())
+
+    items_changed.connect(receiver, sender=app)
+
+    status, headers, body = asgi_request(asgi_app, 'POST', '/items', b'name=Jane&description=hello', form)
+    assert status == 201
+    assert json.loads(body) == {"id": 1, "name": "Jane", "description": "hello"}
+    assert receivers and threading.main_thread() not in receivers #not on the event loop, they may block
+    status, headers, body = asgi_request(asgi_app, 'POST', '/items', b'name=&description=hello', form)
+    assert status == 400
+
+    status, headers, body = asgi_request(asgi_app, 'GET', '/items/1')
+    assert json.loads(body) == {"id": 1, "name": "Jane", "description": "hello"}
+    status, _, _ = asgi_request(asgi_app, 'GET', '/items/1', headers=[('If-None-Match', headers['etag'])])
+    assert status == 304
+
+    update = json.dumps({"name": "Eric"}).encode()
+    status, headers, body = asgi_request(asgi_app, 'PUT', '/items/1', update, [('Content-Type', 'application/json')])
+    assert status == 200
+    assert headers['etag'] == '"item-1-v2"'
+    status, _, _ = asgi_request(asgi_app, 'PUT', '/items/1', update,
+                                [('Content-Type', 'application/json'), ('If-Match', '"item-1-v1"')])
+    assert status == 412
+
+    status, headers, body = asgi_request(asgi_app, 'GET', '/items?limit=10')
+    assert json.loads(body) == [{"id": 1, "name": "Eric", "description": "hello"}]
+    status, headers, body = asgi_request(asgi_app, 'GET', '/items?stream=ndjson') #arguments it does not handle
+    assert headers['content-type'] == 'application/x-ndjson' #streamed by the Flask app
+    assert [json.loads(line) for line in body.splitlines()] == [{"id": 1, "name": "Eric", "description": "hello"}]
+    with app.app_context(): #the Flask side sees the same rows
+        assert app.test_client().get('/items/1').get_json()["name"] == "Eric"
+
+    status, _, _ = asgi_request(asgi_app, 'DELETE', '/items/1')
+    assert status == 200
+    status, _, body = asgi_request(asgi_app, 'GET', '/items/1')
+    assert status == 404
+    status, _, body = asgi_request(asgi_app, 'GET', '/about') #other paths go to the Flask app
+    assert body == b"About Page"
+    snapshot_app = create_asgi_app(create_app('testing', {'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+                                                         'ITEM_SNAPSHOT_ENABLED': True}))
+    assert snapshot_app._route('GET', '/items/1')[0] is None #reads come from the snapshot of the Flask app
+    assert snapshot_app._route('GET', '/items', b'limit=5')[0] is None
+    assert snapshot_app._route('PUT', '/items/1')[0] is not None
+
+    changes = app.test_client().get('/items/changes').get_json()["changes"]
+    assert [(c["seq"], c["op"]) for c in changes] == [(1, 'create'), (2, 'update'), (3, 'delete')]
+    app.config['ITEM_CHANGES_KEEP'] = 1
+    monkeypatch.setattr(models, 'CHANGE_PRUNE_EVERY', 2)
+    asgi_request(asgi_app, 'POST', '/items', b'name=Jim&description=hi', form) #seq 4 crosses a prune point
+    assert app.test_client().get('/items/changes?since=1').status_code == 410 #pruned like the Flask writes
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+""" test the async item API checks CSRF tokens on POST /items like the Flask route"""
+def test_asgi_item_api_csrf(tmp_path):
+    """ test the async item API checks CSRF tokens on POST /items like the Flask route"""
+    import re
+    pytest.importorskip('aiosqlite')
+    pytest.importorskip('asgiref')
+    from app import db
+    from app.asgi import create_asgi_app
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'asgi.db'}",
+                                 'WTF_CSRF_ENABLED': True})
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        page = client.get('/submit').data.decode('utf-8')
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+        cookie = f"{app.config['SESSION_COOKIE_NAME']}={client.get_cookie(app.config['SESSION_COOKIE_NAME']).value}"
+    asgi_app = create_asgi_app(app)
+    form = [('Content-Type', 'application/x-www-form-urlencoded'), ('Cookie', cookie)]
+
+    status, _, body = asgi_request(asgi_app, 'POST', '/items', b'name=Jane&description=hello', form)
+    assert status == 400
+    assert json.loads(body)["errors"] == {"csrf_token": ["The CSRF token is missing."]}
+    status, _, body = asgi_request(asgi_app, 'POST', '/items', b'name=Jane&description=hello&csrf_token=x', form)
+    assert json.loads(body)["errors"] == {"csrf_token": ["The CSRF token is invalid."]}
+    status, _, body = asgi_request(asgi_app, 'POST', '/items', f'name=Jane&description=hello&csrf_token={token}'.encode(),
+                                   form)
+    assert status == 201
+    status, _, body = asgi_request(asgi_app, 'POST', '/items', json.dumps({"name": "Eric", "description": "hi"}).encode(),
+                                   [('Content-Type', 'application/json'), ('Cookie', cookie), ('X-CSRFToken', token)])
+    assert status == 201 #JSON bodies with the token in a header, as on the Flask route
+    status, _, _ = asgi_request(asgi_app, 'POST', '/items', b'name=Jane&description=hello',
+                                [('Content-Type', 'application/x-www-form-urlencoded'), ('X-CSRFToken', token)])
+    assert status == 400 #a token without its session cookie
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+""" test item reads go to the replicas, writers read their own writes and broken replicas fail over"""
+def test_read_replica_routing(tmp_path):
+    """ test item reads go to the replicas, writers read their own writes and broken replicas fail over"""
+    from app import db
+    replicas = [f"sqlite:///{tmp_path / 'replica0.db'}", f"sqlite:///{tmp_path / 'replica1.db'}"]
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+                                 'REPLICA_DATABASE_URIS': replicas, 'CACHE_TYPE': 'null'})
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica0']) #replica0 has the schema but is not caught up yet
+        writer = app.test_client()
+        response = writer.post('/items', data={'name': 'Jane', 'description': 'hello'})
+        assert response.status_code == 201
+        assert writer.get('/items/1').status_code == 200 #sticky: the writer reads from the primary
+
+        reader = app.test_client()
+        assert reader.get('/items/1').status_code == 404 #replica0 does not have the row
+        # replica1 has no tables at all: the query fails and the read is retried on the primary
+        assert reader.get('/items/1').status_code == 200
+        assert app.extensions['replicas'].healthy() == ['replica0']
+        assert reader.get('/items').get_json() == [] #replica0 again
+        db.drop_all()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+""" test create_app leaves the schema alone, init-db creates it and compiles the templates"""
+def test_init_db_command(tmp_path):
+    """ test create_app leaves the schema alone, init-db creates it and compiles the templates"""
+    from sqlalchemy import inspect
+    from app import db
+    cache_dir = tmp_path / 'jinja_cache'
+    app = create_app('production', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'new.db'}",
+                                    'JINJA_BYTECODE_CACHE_DIR': str(cache_dir)})
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == [] #no DDL on startup
+    assert not cache_dir.exists() #created on the first compiled template
+
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, repr(result.exception)
+    assert "up to date" in result.output
+    with app.app_context():
+        assert {'item', 'item_table_version', 'item_fts'} <= set(inspect(db.engine).get_table_names())
+        db.engine.dispose()
+    assert any(cache_dir.iterdir()) #submit.html bytecode
+
+    # URL builders are shared between apps and still build the right URLs
+    other = create_app('testing')
+    with other.test_request_context():
+        from flask import url_for
+        assert url_for('get_item', id=7) == '/items/7'
+        assert url_for('search', q='abc') == '/items/search?q=abc'
+
+
+""" test per-client token buckets, per-route limits, the shared store and the concurrency cap"""
+def test_rate_limits(app):
+    """ test per-client token buckets, per-route limits, the shared store and the concurrency cap"""
+    from app.ratelimit import MemoryBucketStore, SharedBucketStore
+    limited = create_app('testing', {'RATELIMIT_ENABLED': True, 'RATELIMIT_DEFAULT': (1, 3),
+                                     'RATELIMIT_ROUTES': {'about': (1, 1), 'metrics_endpoint': None}})
+    client = limited.test_client()
+    assert [client.get('/').status_code for _ in range(4)] == [200, 200, 200, 429] #burst of 3
+    response = client.get('/')
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json() == {"error": "Too many requests, retry later"}
+    assert [client.get('/about').status_code for _ in range(2)] == [200, 429] #own limit per route
+    assert client.get('/', headers={'X-API-Key': 'abc'}).status_code == 200 #own bucket per API key
+    assert all(client.get('/metrics').status_code == 200 for _ in range(5)) #not limited
+    assert 'status="429"' in client.get('/metrics').get_data(as_text=True) #refused requests are counted
+
+    # tokens come back at the rate, idle clients are dropped from the store
+    now = [0.0]
+    store = MemoryBucketStore(max_keys=2, clock=lambda: now[0])
+    assert store.take('a', 2, 2) == 0 and store.take('a', 2, 2) == 0
+    assert store.take('a', 2, 2) == 0.5
+    now[0] = 0.5
+    assert store.take('a', 2, 2) == 0
+    now[0] = 10
+    store.take('b', 2, 2)
+    assert len(store) == 1 #'a' was full again and evicted
+    shared = SharedBucketStore(FakeRedis(), clock=lambda: now[0])
+    assert shared.take('a', 1, 1) == 0
+    assert shared.take('a', 1, 1) == 1
+
+    capped = create_app('testing', {'MAX_CONCURRENT_REQUESTS': 1})
+    slots = capped.extensions['request_slots']
+    assert capped.test_client().get('/').status_code == 200
+    slots.acquire() #one request in progress
+    response = capped.test_client().get('/')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    slots.release()
+    assert capped.test_client().get('/').status_code == 200 #the slot was given back
+
+
+""" test NDJSON/CSV export and import of the item table, by HTTP and with the CLI commands"""
+def test_export_import(client, app, tmp_path):
+    """ test NDJSON/CSV export and import of the item table, by HTTP and with the CLI commands"""
+    body = '\n'.join(json.dumps({"name": f"n{i}", "description": f"item {i}"}) for i in range(7)) + '\n\n'
+    app.config['ITEMS_IMPORT_BATCH_SIZE'] = 2 #several batches and commits
+    app.config['ITEMS_IMPORT_COMMIT_ROWS'] = 4
+    response = client.post('/items/import', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 201
+    assert response.get_json()["imported"] == 7
+
+    response = client.get('/items/export?format=csv')
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    csv_dump = response.get_data(as_text=True)
+    assert csv_dump.splitlines()[:2] == ['id,name,description', '1,n0,item 0']
+    ndjson_dump = client.get('/items/export').get_data(as_text=True)
+    assert json.loads(ndjson_dump.splitlines()[6]) == {"id": 7, "name": "n6", "description": "item 6"}
+    assert client.get('/items/export?format=xml').status_code == 400
+
+    # ids from the dump are kept, so importing it again conflicts
+    response = client.post('/items/import', data={'file': (io.BytesIO(csv_dump.encode()), 'items.csv', 'text/csv')})
+    assert response.status_code == 400
+    assert response.get_json()["imported"] == 0
+    client.delete('/items/bulk', json={"ids": [1, 2, 3, 4, 5, 6, 7]})
+    response = client.post('/items/import?format=csv', data=csv_dump)
+    assert response.status_code == 201
+    assert client.get('/items/7').get_json()["name"] == "n6"
+    assert [item["id"] for item in client.get('/items/search?q=item 5').get_json()] == [6] #indexed for search
+
+    # an invalid row stops the import, the committed rows before it stay
+    bad = '{"name": "a", "description": "ok"}\n{"name": "", "description": "empty name"}\n'
+    response = client.post('/items/import', data=bad, content_type='application/x-ndjson')
+    assert response.status_code == 400
+    assert response.get_json()["row"] == 2
+    assert client.post('/items/import', data='{"name": ', content_type='application/x-ndjson').status_code == 400
+    for id in ('true', '1.7', '-3', '"x"', str(2 ** 70)): #only real integers in the id range
+        row = f'{{"id": {id}, "name": "a", "description": "ok"}}\n'
+        response = client.post('/items/import', data=row, content_type='application/x-ndjson')
+        assert response.status_code == 400 and response.get_json()["imported"] == 0
+    for id in ('1.7', '-3', '1e3', '\u00b2'):
+        response = client.post('/items/import?format=csv', data=f'id,name,description\n{id},a,ok\n')
+        assert response.status_code == 400
+    huge = 'id,name,description\n"' + 'x' * 200000 + '",a,ok\n' #over the csv module's field size limit
+    response = client.post('/items/import?format=csv', data=huge)
+    assert response.status_code == 400 and "field larger than field limit" in response.get_json()["error"]
+    assert len(client.get('/items?limit=100').get_json()) == 7 #none of these rows were imported
+
+    runner = app.test_cli_runner()
+    dump = tmp_path / 'items.ndjson'
+    result = runner.invoke(args=['export-items', str(dump)])
+    assert result.exit_code == 0
+    assert len(dump.read_text().splitlines()) == 7
+    client.delete('/items/bulk', json={"ids": [1, 2, 3, 4, 5, 6, 7]})
+    result = runner.invoke(args=['import-items', str(dump)])
+    assert result.exit_code == 0
+    assert "Imported 7 items" in result.output
+    assert len(client.get('/items').get_json()) == 7
+
+
+""" test batch addition with JSON and binary bodies, big integers and the pure-Python fallback"""
+def test_add_batch(client, monkeypatch):
+    """ test batch addition with JSON and binary bodies, big integers and the pure-Python fallback"""
+    import struct
+    from app import arithmetic
+    big = 2 ** 63 - 1
+    response = client.post('/add/batch', json={"a": [1, -2, big, 10 ** 30], "b": [2, 2, big, 1]})
+    assert response.status_code == 200
+    assert response.is_streamed
+    expected = [3, 0, 2 * big, 10 ** 30 + 1] #int64 overflow and ints over 64 bits stay exact
+    assert json.loads(response.data)["results"] == expected
+
+    response = client.post('/add/batch', json=[[4, 6], [-big - 1, -1]])
+    assert response.get_json()["results"] == [10, -big - 2]
+
+    pairs = [(i, 3 * i) for i in range(1000)] + [(big, 1)]
+    body = b''.join(struct.pack('<qq', a, b) for a, b in pairs)
+    response = client.post('/add/batch', data=body, content_type='application/octet-stream')
+    assert response.get_json()["results"] == [a + b for a, b in pairs]
+    assert client.post('/add/batch', data=body[:-3], content_type='application/octet-stream').status_code == 400
+
+    monkeypatch.setattr(arithmetic, 'numpy', None) #same results without NumPy
+    assert client.post('/add/batch', json={"a": [1, big], "b": [2, big]}).get_json()["results"] == [3, 2 * big]
+    response = client.post('/add/batch', data=body, content_type='application/octet-stream')
+    assert response.get_json()["results"] == [a + b for a, b in pairs]
+
+    assert client.post('/add/batch', json={"a": [1, 2], "b": [1]}).status_code == 400
+    assert client.post('/add/batch', json={"a": [1.5], "b": [1]}).status_code == 400
+    assert client.post('/add/batch', json={"a": [True], "b": [1]}).status_code == 400
+    assert client.post('/add/batch', data='not json', content_type='application/json').status_code == 400
+
+    client.application.config['ADD_BATCH_MAX_PAIRS'] = 2
+    pairs = json.dumps([[big, -big - 1]] * 2) #the longest pairs fit the byte limit
+    assert client.post('/add/batch', data=pairs, content_type='application/json').status_code == 200
+    response = client.post('/add/batch', data=json.dumps([[1, 1]] * 1000), content_type='application/json')
+    assert response.status_code == 413 #refused from its Content-Length, the body is not parsed
+    response = client.post('/add/batch', data='[[1, 1]]', content_type='application/json',
+                           headers={'Transfer-Encoding': 'chunked'})
+    assert response.status_code == 411 #no length to check
+
+    # the single-pair route, answered from its memo the second time
+    for _ in range(2):
+        assert client.get(f'/add/{big}/{big}').get_json() == {"result": 2 * big}
+
+
+""" test the query budgets of the item endpoints, checked by the query_budget marker"""
+@pytest.mark.query_budget(get_item=1, get_items=2, search=1, create_items_bulk=4, items_export=1)
+def test_query_budgets(client, init_database):
+    """ test the query budgets of the item endpoints, checked by the query_budget marker"""
+    client.post('/items/bulk', json=[{"name": f"item{i}", "description": "bulk"} for i in range(20)])
+    client.get('/items/3')
+    client.get('/items?limit=5')
+    client.get('/items/search?name_prefix=item1')
+    client.get('/items/export').get_data() #the statements of streamed responses are counted too
+
+
+""" test the profiler reports call sites, N+1 patterns and full table scans"""
+def test_query_profiler(app, client, init_database, caplog):
+    """ test the profiler reports call sites, N+1 patterns and full table scans"""
+    from sqlalchemy import select
+    from app import db
+    from app.models import Item
+
+    def names_one_by_one():
+        names = [db.session.execute(select(Item.name).where(Item.id == id)).scalar() for id in (1, 2, 1, 2, 1)]
+        names += db.session.execute(select(Item.name).where(Item.description == 'bla')).scalars().all()
+        return {"names": names}
+
+    app.add_url_rule('/names', 'names_one_by_one', names_one_by_one)
+    profiler = app.extensions['query_profiler']
+    client.get('/items/1')
+    profile = profiler.for_endpoint('get_item')[-1]
+    assert len(profile.queries) == 1 #statement, duration and call site of every query
+    assert profile.queries[0].call_site.startswith('app/routes.py:') and profile.queries[0].seconds > 0
+    assert profile.problems() == [] #primary key lookup
+
+    client.get('/names')
+    profile = profiler.for_endpoint('names_one_by_one')[-1]
+    assert list(profile.repeated.values()) == [5] #one query per id
+    assert list(profile.scans.values()) == [['item']] #description has no index
+    assert "Query profile of GET /names" in caplog.text
+    assert "5x the same statement (N+1?) from tests/test_app.py:" in caplog.text
+    violations = profiler.budget_violations({'names_one_by_one': 3})
+    assert len(violations) == 2 and "ran 6 queries" in violations[0]
+    assert profiler.budget_violations({'names_one_by_one': 6}, allow_repeats=True) == []
+
+
+""" test the compiled ItemForm schema gives the same data and errors as the form"""
+def test_item_schema_matches_form(app):
+    """ test the compiled ItemForm schema gives the same data and errors as the form"""
+    from werkzeug.datastructures import MultiDict
+    from app.forms import ItemForm, ITEM_SCHEMA
+    samples = [None, '', '   ', 'a', 'x' * 50, 'x' * 51, 'y' * 200, 'y' * 201]
+    with app.test_request_context():
+        for name in samples:
+            for description in samples:
+                data = {k: v for k, v in (('name', name), ('description', description)) if v is not None}
+                form = ItemForm(formdata=MultiDict(data), meta={'csrf': False})
+                form.validate()
+                values, errors = ITEM_SCHEMA.validate(data)
+                assert errors == form.errors #same messages, one pass
+                assert values == {'name': form.name.data, 'description': form.description.data}
+    codes = {}
+    assert ITEM_SCHEMA.validate({'name': 'x' * 51, 'description': 5}, codes)[1] == {'description': ["Invalid type. Expected a string."]}
+    assert codes == {'description': 'type'} #JSON values of the wrong type are reported first
+
+
+""" test CSRF tokens are checked on form and JSON submissions, and verified tokens are cached"""
+def test_submit_csrf_cache():
+    """ test CSRF tokens are checked on form and JSON submissions, and verified tokens are cached"""
+    import re
+    from app import db
+    app = create_app('testing', {'WTF_CSRF_ENABLED': True})
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        page = client.get('/submit').data.decode('utf-8') #the token is stored in the session cookie
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+
+        response = client.post('/submit', data={'name': 'John', 'description': 'bla'})
+        assert response.status_code == 200 and b"Submit an Item" in response.data #no token, the form again
+        response = client.post('/submit', data={'name': 'John', 'description': 'bla', 'csrf_token': token + 'x'})
+        assert b"Submit an Item" in response.data
+
+        response = client.post('/submit', data={'name': 'John', 'description': 'bla', 'csrf_token': token})
+        assert response.get_json()["message"] == "Form submitted"
+        cache = app.extensions['csrf_cache']
+        assert len(cache) == 1 and cache.stats.misses == 2 #only the valid token is remembered
+        response = client.post('/submit', data={'name': '', 'description': 'bla', 'csrf_token': token})
+        assert response.status_code == 400
+        assert response.get_json() == {"error": "Name required", "errors": {"name": ["This field is required."]}}
+        assert cache.stats.hits == 1 #the signature was not checked again
+
+        response = client.post('/items', json={'name': 'Jane', 'description': 'hello'}, headers={'X-CSRFToken': token})
+        assert response.status_code == 201 and response.get_json()["name"] == "Jane" #JSON bodies too
+        response = client.post('/items', json={'name': 'Jane', 'description': 'hello'})
+        assert response.get_json()["errors"] == {"csrf_token": ["The CSRF token is missing."]}
+        for bad in (123, ["x"], {"a": 1}, True): #JSON values that are not strings are rejected, not a 500
+            response = client.post('/items', json={'name': 'Jane', 'description': 'hello', 'csrf_token': bad})
+            assert response.status_code == 400
+            assert response.get_json()["errors"] == {"csrf_token": ["The CSRF token is invalid."]}
+        db.drop_all()
+
+
+""" test the master warms the app before forking and every worker gets its own pools and threads"""
+def test_prefork_warm_and_after_fork(tmp_path):
+    """ test the master warms the app before forking and every worker gets its own pools and threads"""
+    import gc
+    from app import db
+    from app.prefork import after_fork, warm_for_fork
+    from app.schema import upgrade_schema
+    app = create_app('production', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+                                    'WRITE_BEHIND_ENABLED': True, 'WTF_CSRF_ENABLED': False,
+                                    'JINJA_BYTECODE_CACHE_DIR': str(tmp_path / 'jinja')})
+    with app.app_context():
+        upgrade_schema()
+    master_writer = app.extensions['write_behind']
+    try:
+        warm_for_fork(app)
+    finally:
+        gc.unfreeze()
+    assert master_writer.closed #no thread in the master, it would not survive the fork
+    assert len(app.extensions['item_cache'].backend) == 1 #the first page of /items is ready for every worker
+    with app.app_context():
+        assert db.engine.pool.checkedin() == 0 #no connection to inherit
+
+    after_fork(app) #what every worker runs first
+    writer = app.extensions['write_behind']
+    assert writer is not master_writer and not writer.closed
+    response = app.test_client().post('/items', data={'name': 'Jane', 'description': 'hello'})
+    assert response.status_code == 202
+    writer.close()
+    with app.app_context():
+        assert db.session.execute(db.text("SELECT name FROM item")).scalar() == 'Jane'
+        db.engine.dispose()
+
+
+""" test `flask serve` keeps the per-worker item caches in sync with the change log, or turns them off"""
+def test_prefork_worker_caches(tmp_path):
+    """ test `flask serve` keeps the per-worker item caches in sync with the change log, or turns them off"""
+    from app import db
+    from app.cache import LRUCache, NullCache
+    from app.prefork import after_fork, check_worker_caches
+    config = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}", 'CACHE_TYPE': 'lru'}
+    app = create_app('testing', config)
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    client.post('/items', data={'name': 'Jane', 'description': 'hello'})
+    check_worker_caches(app, 4)
+    assert isinstance(app.extensions['item_cache'].backend, LRUCache) #it follows the change log
+    client.get('/items/1')
+
+    other = create_app('testing', config) #another worker writes
+    other.test_client().put('/items/1', json={"name": "Eric"})
+    after_fork(app) #a worker forked now does not start from the master's stale entries
+    assert client.get('/items/1').get_json()["name"] == "Eric"
+
+    unsynced = create_app('testing', dict(config, CACHE_POLL_INTERVAL=None))
+    check_worker_caches(unsynced, 1)
+    assert isinstance(unsynced.extensions['item_cache'].backend, LRUCache) #one worker, nothing to sync
+    check_worker_caches(unsynced, 4)
+    assert isinstance(unsynced.extensions['item_cache'].backend, NullCache)
+    assert unsynced.test_client().get('/items/1').headers["X-Cache"] == "MISS"
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+    for worker in (other, unsynced):
+        with worker.app_context():
+            db.engine.dispose()
+
+
+""" test item writes are logged with sequence numbers and read back with GET /items/changes"""
+def test_item_changes(client, app):
+    """ test item writes are logged with sequence numbers and read back with GET /items/changes"""
+    client.post('/items', data={'name': 'Jane', 'description': 'hello'})
+    client.post('/items/bulk', json=[{"name": "a", "description": "x"}, {"name": "b", "description": "y"}])
+    client.put('/items/2', json={'name': 'a2'})
+    client.delete('/items/3')
+
+    data = client.get('/items/changes?since=0&limit=3').get_json()
+    assert [(c["seq"], c["op"], c["id"]) for c in data["changes"]] == [(1, 'create', 1), (2, 'create', 2), (3, 'create', 3)]
+    assert data["changes"][1]["item"] == {"id": 2, "name": "a2", "description": "x", "version": 2} #current state
+    assert data["last_seq"] == 3 and data["more"] is True
+    data = client.get('/items/changes?since=3').get_json() #only the deltas
+    assert [(c["op"], c["id"], c["item"]) for c in data["changes"]] == [('update', 2, data["changes"][0]["item"]), ('delete', 3, None)]
+    assert data["last_seq"] == 5 and data["more"] is False
+    assert client.get('/items/changes?since=5').get_json() == {"changes": [], "last_seq": 5, "more": False}
+    assert client.get('/items/changes?since=x').status_code == 400
+    assert client.get(f'/items/changes?since={2 ** 70}').status_code == 400 #not an overflow in SQLite
+    assert client.get(f'/items/changes/stream?since={2 ** 63}').status_code == 400
+
+    app.config['ITEM_CHANGES_KEEP'] = 2 #pruned once per CHANGE_PRUNE_EVERY changes
+    from app.models import CHANGE_PRUNE_EVERY
+    client.post('/items/bulk', json=[{"name": "n", "description": "d"}] * CHANGE_PRUNE_EVERY)
+    response = client.get('/items/changes?since=3')
+    assert response.status_code == 410 #the consumer has to resync
+    assert response.get_json()["oldest_seq"] == CHANGE_PRUNE_EVERY + 4
+
+
+""" test the SSE stream sends the backlog, then the live changes, and catches up after an overflow"""
+def test_item_changes_stream(tmp_path):
+    """ test the SSE stream sends the backlog, then the live changes, and catches up after an overflow"""
+    import http.client
+    import threading
+    from werkzeug.serving import make_server
+    from app import db
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+                                 'ITEM_CHANGES_POLL_INTERVAL': 0.05, 'ITEM_CHANGES_BUFFER_SIZE': 2})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    client.post('/items', data={'name': 'Jane', 'description': 'hello'})
+    server = make_server('127.0.0.1', 0, app, threaded=True) #the stream is read while other requests write
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+    try:
+        connection.request('GET', '/items/changes/stream', headers={'Last-Event-ID': '0'})
+        response = connection.getresponse()
+        assert response.getheader('Content-Type').startswith('text/event-stream')
+
+        def next_events(count):
+            events = []
+            while len(events) < count:
+                line = response.fp.readline().decode()
+                if line.startswith('id: '):
+                    events.append((line[4:].strip(), response.fp.readline().decode()[7:].strip()))
+            return events
+
+        assert next_events(1) == [('1', 'create')] #the backlog
+        client.put('/items/1', json={'name': 'Jim'})
+        assert next_events(1) == [('2', 'update')] #pushed live
+        client.post('/items/bulk', json=[{"name": "n", "description": "d"}] * 5) #more than the buffer holds
+        assert next_events(5) == [(str(seq), 'create') for seq in range(3, 8)] #read back from the log, none lost
+    finally:
+        connection.close()
+        server.shutdown()
+        with app.app_context():
+            db.engine.dispose()
+
+
+""" test the change feed thread survives a failed log read and is restarted in a forked worker"""
+def test_change_feed_read_errors(tmp_path, monkeypatch):
+    """ test the change feed thread survives a failed log read and is restarted in a forked worker"""
+    from sqlalchemy.exc import OperationalError
+    from app import changes, db
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+                                 'ITEM_CHANGES_POLL_INTERVAL': 0.05})
+    with app.app_context():
+        db.create_all()
+    feed = app.extensions['item_changes']
+    subscription = feed.subscribe()
+    read_changes, failures = changes.read_changes, []
+
+    def failing_once(*args):
+        if not failures:
+            failures.append(1)
+            raise OperationalError("SELECT", {}, Exception("database is locked"))
+        return read_changes(*args)
+
+    monkeypatch.setattr(changes, 'read_changes', failing_once)
+    client = app.test_client()
+    client.post('/items', data={'name': 'Jane', 'description': 'hello'})
+    client.post('/items', data={'name': 'Jim', 'description': 'hello'})
+    events = []
+    for _ in range(100):
+        events += subscription.get(0.05)[0]
+        if len(events) == 2:
+            break
+    assert failures and [seq for seq, _ in events] == [1, 2] #the next poll read them all
+    assert feed._thread.is_alive()
+
+    feed._after_fork() #what a forked worker runs: no thread nor subscribers of the parent
+    assert feed._thread is None and not feed.subscribers
+    feed.subscribe()
+    assert feed._thread.is_alive()
+    with app.app_context():
+        db.engine.dispose()
+
+
+""" test sharded items are written to the shard of their id and read back merged in id order"""
+def test_sharded_items(tmp_path):
+    """ test sharded items are written to the shard of their id and read back merged in id order"""
+    from sqlalchemy import select
+    from app import db
+    from app.models import Item
+    from app.schema import upgrade_schema
+    from app.sharding import shard_index
+    shards = [f"sqlite:///{tmp_path / f'shard{n}.db'}" for n in range(3)]
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+                                 'SHARD_DATABASE_URIS': shards, 'CACHE_TYPE': 'null', 'SHARD_ID_BLOCK_SIZE': 4})
+    with app.app_context():
+        upgrade_schema()
+    client = app.test_client()
+    ids = [client.post('/items', data={'name': f'n{i}', 'description': 'd'}).get_json()['id'] for i in range(3)]
+    assert ids == [1, 2, 3]
+    bulk = client.post('/items/bulk', json=[{"name": f"b{i}", "description": "d"} for i in range(6)])
+    assert bulk.get_json()['ids'] == [5, 6, 7, 8, 9, 10] #6 ids do not fit in what is left of the block of 4
+    with app.app_context():
+        for n in range(3):
+            ids = db.session.execute(select(Item.id), bind_arguments={'bind': db.engines[f'shard{n}']}).scalars().all()
+            assert ids and all(shard_index(id, 3) == n for id in ids) #every item on the shard of its id
+        assert db.session.execute(select(Item.id)).first() is None #none on the primary
+
+    page = client.get('/items?limit=4')
+    assert [item['id'] for item in page.get_json()] == [1, 2, 3, 5]
+    assert page.headers['X-Next-Cursor'] == '5'
+    assert [item['id'] for item in client.get('/items?after=5&limit=4').get_json()] == [6, 7, 8, 9]
+    assert len(client.get('/items?stream=ndjson').data.splitlines()) == 9
+    assert client.put('/items/6', json={'name': 'Jim'}).get_json()['name'] == 'Jim'
+    assert client.delete('/items/7').status_code == 200
+    assert client.get('/items/7').status_code == 404
+    assert client.put('/items/bulk', json={'ids': [1, 2, 8], 'name': 'x'}).get_json() == {'updated': 3}
+    changes = client.get('/items/changes?since=9').get_json()['changes']
+    assert [(c['op'], c['id'], c['item'] and c['item']['name']) for c in changes] == [
+        ('update', 6, 'Jim'), ('delete', 7, None), ('update', 1, 'x'), ('update', 2, 'x'), ('update', 8, 'x')]
+    assert client.get('/items/search?q=b1').status_code == 501 #the FTS index is on the primary only
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+""" test the item snapshot serves reads and follows the writes of its own and of other processes"""
+def test_item_snapshot(tmp_path):
+    """ test the item snapshot serves reads and follows the writes of its own and of other processes"""
+    import time
+    from app import db
+    config = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}", 'CACHE_TYPE': 'null',
+              'ITEM_SNAPSHOT_ENABLED': True, 'ITEM_SNAPSHOT_POLL_INTERVAL': 0.05}
+    writer = create_app('testing', dict(config, ITEM_SNAPSHOT_ENABLED=False)) #stands for another process
+    with writer.app_context():
+        db.create_all()
+    writer_client = writer.test_client()
+    for name in ('Jane', 'Al', 'Jane'):
+        writer_client.post('/items', data={'name': name, 'description': 'hello'})
+    app = create_app('testing', config)
+    snapshot = app.extensions['item_snapshot']
+    assert len(snapshot) == 3 #loaded at startup
+    client = app.test_client()
+
+    response = client.get('/items/2')
+    assert response.get_json() == {"id": 2, "name": "Al", "description": "hello"}
+    assert client.get('/items/2', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/items/9').status_code == 404
+    page = client.get('/items?limit=2')
+    assert [item['id'] for item in page.get_json()] == [1, 2] and page.headers['X-Next-Cursor'] == '2'
+    assert [item['id'] for item in client.get('/items/search?name=Jane').get_json()] == [1, 3]
+
+    client.put('/items/1', json={'name': 'Zoe'})
+    assert client.get('/items/1').get_json()['name'] == 'Zoe' #its own writes, right away
+    assert [item['name'] for item in client.get('/items/search?name_prefix=J').get_json()] == ['Jane']
+    writer_client.delete('/items/3')
+    writer_client.post('/items', data={'name': 'Bo', 'description': 'new'})
+    deadline = time.monotonic() + 5
+    while client.get('/items/3').status_code != 404 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [item['name'] for item in client.get('/items').get_json()] == ['Zoe', 'Al', 'Bo'] #the other's, by polling
+    assert client.get('/items/search?name=Jane').get_json() == [] #renamed and deleted
+    assert [item['id'] for item in client.get('/items/search?name_prefix=B').get_json()] == [4]
+    assert snapshot.memory_bytes() > 0
+    with app.app_context():
+        db.engine.dispose()
+
+
+""" test with the item cache on, a writer never gets a row a lagging replica served before its write"""
+def test_read_replica_cache(tmp_path):
+    """ test with the item cache on, a writer never gets a row a lagging replica served before its write"""
+    import sqlite3
+    from app import db
+    primary, replica = tmp_path / 'primary.db', tmp_path / 'replica0.db'
+    app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{primary}",
+                                 'REPLICA_DATABASE_URIS': [f"sqlite:///{replica}"], 'CACHE_TYPE': 'lru'})
+    with app.app_context():
+        db.create_all()
+        app.test_client().post('/items', data={'name': 'Jane', 'description': 'hello'})
+        with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+            source.backup(target) #the replica has the row as first written, then stops following
+        writer, reader = app.test_client(), app.test_client()
+        assert writer.put('/items/1', json={'name': 'Jim'}).status_code == 200
+        response = reader.get('/items/1')
+        assert response.get_json()['name'] == 'Jane' and response.headers['X-Cache'] == 'MISS' #from the replica
+        assert reader.get('/items/1').headers['X-Cache'] == 'MISS' #replica reads are not cached
+        response = writer.get('/items/1')
+        assert response.get_json()['name'] == 'Jim' #its own write, from the primary
+        assert [item['name'] for item in writer.get('/items').get_json()] == ['Jim']
+        db.drop_all()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+""" test the URL builder cache falls back to Werkzeug's own Rule when its private hooks change"""
+def test_url_rule_class_fallback(monkeypatch):
+    """ test the URL builder cache falls back to Werkzeug's own Rule when its private hooks change"""
+    from werkzeug.routing import Rule
+    from app.startup import CachedRule, url_rule_class
+    assert url_rule_class() is CachedRule
+    rule = create_app('testing').url_map._rules_by_endpoint['get_item'][0]
+    assert isinstance(rule, CachedRule)
+    monkeypatch.setattr(Rule, '_compile_builder', lambda self, append_unknown=True: 'werkzeug builder')
+    del rule._trace #a Werkzeug that renamed it: the builder is Werkzeug's, not one cached under a wrong key
+    assert rule._compile_builder(False) == 'werkzeug builder'
+
+    monkeypatch.setattr(Rule, '_compile_builder', lambda self, append_unknown, extra=None: None)
+    assert url_rule_class() is Rule
+    monkeypatch.delattr(Rule, '_compile_builder')
+    assert url_rule_class() is Rule